@@ -0,0 +1,95 @@
+"""Throughput and latency of bets through form view and JSON API
+
+Usage: python -m benchmarks.bet_endpoint --threads 8 --requests 200
+
+Requests go through the WSGI handler in-process with the test client, each thread playing as its own user.
+Uses file based SQLite database, so threads share it like uWSGI workers do.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from decimal import Decimal
+
+from .utils import benchmark_database, percentile, run_threads
+
+
+def create_players(count):
+    from django.contrib.auth.models import User
+    from casino.models import Customer, Wallet
+    users = []
+    for i in range(count):
+        user = User.objects.create_user('player{}'.format(i))
+        customer = Customer.objects.create(user=user)
+        Wallet.objects.create(customer=customer, currency=Wallet.EURO, amount=Decimal(10 ** 9), wagering_requirement=0)
+        users.append(user)
+    return users
+
+
+def bench_http(users, path, body, content_type, requests):
+    """Post body as every user, dictionaries are sent as multipart form like a browser would"""
+    from django.db import connection
+    from django.test import Client
+    latencies, errors = [], []
+
+    def play(index):
+        client = Client()
+        client.force_login(users[index])
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                if content_type is None:
+                    response = client.post(path, body)
+                else:
+                    response = client.post(path, body, content_type=content_type)
+                if response.status_code not in (200, 302):
+                    errors.append(response.status_code)
+            except Exception as e:
+                errors.append(type(e).__name__)
+            latencies.append(time.perf_counter() - start)
+        connection.close()
+
+    return run_threads(play, len(users)), latencies, errors
+
+
+def placed_bets():
+    from casino.models import LedgerEntry
+    return LedgerEntry.objects.filter(kind=LedgerEntry.BET).count()
+
+
+def report(name, result, bets):
+    wall, latencies, errors = result
+    # Invalid form is answered with 200 too, so every successful request must have placed a bet
+    assert bets == len(latencies) - len(errors), '{} successful requests placed {} bets'.format(
+        len(latencies) - len(errors), bets)
+    print('{:<12} {:>8.1f} req/s  p50 {:>7.2f} ms  p99 {:>7.2f} ms  errors {}'.format(
+        name, len(latencies) / wall, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+        len(errors)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent players')
+    parser.add_argument('--requests', type=int, default=200, help='Bets per player')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with benchmark_database(test_name=os.path.join(directory, 'bench.sqlite3')):
+            from django.test.utils import override_settings
+            logging.getLogger('django.request').setLevel(logging.CRITICAL)
+            users = create_players(args.threads)
+            # Players bet faster than THROTTLE_RATES allow
+            with override_settings(THROTTLE_ENABLED=False):
+                for name, path, body, content_type in [
+                    ('form view', '/', {'amount': '1'}, None),
+                    ('json api', '/api/bet/', json.dumps({'amount': '1'}), 'application/json'),
+                ]:
+                    before = placed_bets()
+                    result = bench_http(users, path, body, content_type, args.requests)
+                    report(name, result, placed_bets() - before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""N sequential bets against one batch of N bets, at service level and through JSON API
+
+Usage: python -m benchmarks.bet_many --bets 10 100 1000 --bonus-wallets 20
+
+Every run starts from the same wallets and seeded game, final wallets and ledger of both ways are compared. Uses file
+based SQLite database, so commits pay for writes like in production.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+
+from .utils import benchmark_database
+
+
+def reset(user, bonus_wallets):
+    """Euro wallet with money and bonus wallets released during play"""
+    from casino.models import Customer, LedgerEntry, Wallet
+    Customer.objects.filter(user=user).update(overall_spent_money=0)
+    customer = Customer.objects.get(user=user)
+    LedgerEntry.objects.all().delete()
+    Wallet.objects.filter(customer=customer).delete()
+    Wallet.objects.create(customer=customer, currency=Wallet.EURO, amount=Decimal(10 ** 6), wagering_requirement=0)
+    for index in range(bonus_wallets):
+        Wallet.objects.create(customer=customer, currency=Wallet.BONUS, amount=Decimal(10),
+                              wagering_requirement=index + 1)
+    Customer.objects.refresh_summary(customer)
+
+
+def state(user):
+    from casino.models import LedgerEntry, Wallet
+    wallets = list(Wallet.objects.filter(customer__user=user).order_by('pk').values_list('amount', 'depleted'))
+    ledger = list(LedgerEntry.objects.order_by('pk').values_list('kind', 'delta', 'balance'))
+    return wallets, ledger
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def service_sequential(user, amounts):
+    from casino.rng import SeededRandom
+    from casino.services import SimpleGame
+    game = SimpleGame(user, rng=SeededRandom(0))
+    return timed(lambda: [game.bet(amount) for amount in amounts])
+
+
+def service_batch(user, amounts):
+    from casino.rng import SeededRandom
+    from casino.services import SimpleGame
+    game = SimpleGame(user, rng=SeededRandom(0))
+    return timed(lambda: game.bet_many(amounts))
+
+
+def api_sequential(client, amounts):
+    return timed(lambda: [client.post('/api/bet/', json.dumps({'amount': str(amount)}),
+                                      content_type='application/json') for amount in amounts])
+
+
+def api_batch(client, amounts):
+    return timed(lambda: client.post('/api/bet/many/', json.dumps({'amounts': [str(a) for a in amounts]}),
+                                     content_type='application/json'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bets', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--bonus-wallets', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with benchmark_database(test_name=os.path.join(directory, 'bench.sqlite3')):
+            from django.contrib.auth.models import User
+            from django.test import Client
+            from django.test.utils import override_settings
+            from casino.models import Customer
+            user = User.objects.create_user('player')
+            Customer.objects.create(user=user)
+            client = Client()
+            client.force_login(user)
+            # API runs with process generator, so only service level results are compared
+            with override_settings(THROTTLE_ENABLED=False, BET_MANY_MAX=max(args.bets)):
+                for bets in args.bets:
+                    amounts = [Decimal(1)] * bets
+                    timings, states = {}, []
+                    for name, run, target in [('service bet', service_sequential, user),
+                                              ('service bet_many', service_batch, user),
+                                              ('api bet', api_sequential, client),
+                                              ('api bet many', api_batch, client)]:
+                        reset(user, args.bonus_wallets)
+                        timings[name] = run(target, amounts)
+                        if name.startswith('service'):
+                            states.append(state(user))
+                    print('{:>5} bets  '.format(bets) + '  '.join(
+                        '{} {:>8.2f} ms'.format(name, seconds * 1000) for name, seconds in timings.items()) +
+                        '  speedup service {:.1f}x api {:.1f}x  identical {}'.format(
+                            timings['service bet'] / timings['service bet_many'],
+                            timings['api bet'] / timings['api bet many'], states[0] == states[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Cold start time and memory per worker with and without preloading of application
+
+Usage: python -m benchmarks.cold_start --workers 4
+
+Every mode runs in fresh interpreter in production settings (DEBUG off): loads WSGI application, serves first and
+second request of login page, then forks workers like uWSGI master does, each serving one request. Lazy mode only
+creates application, preload mode imports igaming.wsgi which warms it up.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+MODES = ('lazy', 'preload')
+
+
+def memory():
+    """Resident and private memory of current process in MiB"""
+    values = {}
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Private_Clean', 'Private_Dirty'):
+                values[name] = int(value.split()[0]) / 1024
+    return values['Rss'], values['Private_Clean'] + values['Private_Dirty']
+
+
+def request(application, path):
+    from wsgiref.util import setup_testing_defaults
+    environ = {'PATH_INFO': path, 'HTTP_HOST': 'testserver', 'wsgi.input': io.BytesIO()}
+    setup_testing_defaults(environ)
+    start = time.perf_counter()
+    b''.join(application(environ, lambda status, headers: None))
+    return (time.perf_counter() - start) * 1000
+
+
+def child(mode, workers):
+    start = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'igaming.settings')
+    if mode == 'preload':
+        from igaming.wsgi import application
+    else:
+        from django.core.wsgi import get_wsgi_application
+        application = get_wsgi_application()
+    result = {'load': (time.perf_counter() - start) * 1000}
+
+    pids = []
+    for _ in range(workers):
+        reader, writer = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(reader)
+            first = request(application, '/accounts/login/')
+            second = request(application, '/accounts/login/')
+            os.write(writer, json.dumps([first, second] + list(memory())).encode())
+            os._exit(0)
+        os.close(writer)
+        pids.append((pid, reader))
+    stats = []
+    for pid, reader in pids:
+        with os.fdopen(reader) as stream:
+            stats.append(json.loads(stream.read()))
+        os.waitpid(pid, 0)
+    result['first'], result['second'], result['rss'], result['private'] = [
+        sum(values) / len(values) for values in zip(*stats)]
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child, args.workers)
+
+    env = dict(os.environ, ALLOWED_HOSTS='testserver')
+    env.pop('DEBUG', None)
+    print('{:<8} {:>9} {:>14} {:>15} {:>14} {:>18}'.format(
+        'mode', 'load ms', '1st request ms', '2nd request ms', 'worker RSS MiB', 'worker private MiB'))
+    for mode in MODES:
+        runs = [
+            json.loads(subprocess.check_output([sys.executable, '-m', 'benchmarks.cold_start', '--child', mode,
+                                                '--workers', str(args.workers)], env=env).decode())
+            for _ in range(args.repeat)
+        ]
+        result = {key: sorted(run[key] for run in runs)[len(runs) // 2] for key in runs[0]}
+        print('{:<8} {load:>9.1f} {first:>14.1f} {second:>15.1f} {rss:>14.1f} {private:>18.1f}'.format(
+            mode, **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Bet throughput of JSON API with database connection settings profiles
+
+Usage: python -m benchmarks.db_modes --threads 8 --requests 200
+
+With default DB_ENGINE runs file based SQLite with rollback journal and connection per request (settings before
+database profile), then with SQLITE_PRAGMAS (WAL) and persistent connections. With DB_ENGINE=postgresql runs
+configured PostgreSQL server with connection per request and with persistent connections.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+
+from .bet_endpoint import bench_http, create_players, report
+from .utils import benchmark_database
+
+SQLITE_ROLLBACK_JOURNAL = {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000, 'mmap_size': 0}
+
+
+def run_profiles(users, profiles, requests):
+    from django.db import connection
+    from django.test.utils import override_settings
+    for name, conn_max_age, pragmas in profiles:
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        with override_settings(**({'SQLITE_PRAGMAS': pragmas} if pragmas is not None else {})):
+            connection.ensure_connection()
+            report(name, bench_http(users, '/api/bet/', json.dumps({'amount': '1'}), 'application/json', requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent players')
+    parser.add_argument('--requests', type=int, default=200, help='Bets per player')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite = os.environ.get('DB_ENGINE', 'sqlite3') == 'sqlite3'
+        with benchmark_database(test_name=os.path.join(directory, 'bench.sqlite3') if sqlite else None):
+            from django.conf import settings
+            logging.getLogger('django.request').setLevel(logging.CRITICAL)
+            users = create_players(args.threads)
+            if sqlite:
+                profiles = [
+                    ('rollback', 0, SQLITE_ROLLBACK_JOURNAL),
+                    ('wal', settings.DB_CONN_MAX_AGE, settings.SQLITE_PRAGMAS),
+                ]
+            else:
+                profiles = [
+                    ('per request', 0, None),
+                    ('persistent', settings.DB_CONN_MAX_AGE, None),
+                ]
+            run_profiles(users, profiles, args.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Overhead of query count and latency metrics on table page and bet API
+
+Usage: python -m benchmarks.metrics_overhead --repeat 500
+
+Measures requests through the test client with METRICS_ENABLED off and on, with DEBUG off so that query logging
+of debug cursors does not hide the overhead.
+"""
+import argparse
+import json
+from decimal import Decimal
+
+from .utils import benchmark_database, measure, summary
+
+
+def create_player():
+    from django.contrib.auth.models import User
+    from casino.models import Customer, Wallet
+    user = User.objects.create_user('player')
+    customer = Customer.objects.create(user=user)
+    Wallet.objects.create(customer=customer, currency=Wallet.EURO, amount=Decimal(10 ** 9), wagering_requirement=0)
+    return user
+
+
+def run(connection, user, enabled, repeat):
+    from django.test import Client
+    from django.test.utils import override_settings
+    from casino import metrics
+
+    if enabled:
+        metrics.instrument_connection(connection)
+    else:
+        connection.__dict__.pop('make_cursor', None)
+        connection.__dict__.pop('make_debug_cursor', None)
+    with override_settings(METRICS_ENABLED=enabled, DEBUG=False, ALLOWED_HOSTS=['testserver']):
+        client = Client()
+        client.force_login(user)
+        body = json.dumps({'amount': '1.00'})
+        print('GET table page: {}'.format(summary(measure(lambda: client.get('/'), repeat))))
+        print('POST bet API:   {}'.format(summary(measure(
+            lambda: client.post('/api/bet/', body, content_type='application/json'), repeat))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    with benchmark_database() as connection:
+        user = create_player()
+        for enabled in (False, True, False, True):
+            print('== metrics {}'.format('enabled' if enabled else 'disabled'))
+            run(connection, user, enabled, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
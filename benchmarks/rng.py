@@ -0,0 +1,32 @@
+"""Outcomes per second of game random number generators
+
+Usage: python -m benchmarks.rng --outcomes 1000000
+"""
+import argparse
+import random
+import time
+
+from casino import rng
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--outcomes', type=int, default=1000000)
+    args = parser.parse_args()
+
+    generators = [
+        ('random.getrandbits (unbuffered)', random.getrandbits),
+        ('stdlib', rng.StdlibRandom().getrandbits),
+        ('system', rng.SystemRandom().getrandbits),
+        ('seeded', rng.SeededRandom(0).getrandbits),
+    ]
+    for name, getrandbits in generators:
+        start = time.perf_counter()
+        for _ in range(args.outcomes):
+            getrandbits(1)
+        elapsed = time.perf_counter() - start
+        print('{:<32} {:>12,.0f} outcomes/s'.format(name, args.outcomes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Latency of fair players next to abusive client, with and without throttling
+
+Usage: python -m benchmarks.throttling --players 4 --abusers 4 --seconds 5 --clients 1000 10000 100000
+
+Fair players bet through JSON API at pace allowed by THROTTLE_RATES, abusive client bets in tight loop from several
+threads as single user. Requests go through the WSGI handler in-process with the test client against file based
+SQLite database shared by threads, like uWSGI workers share it. Abusive threads compete with fair players for the
+interpreter lock of this process even when answered with 429, which a separate client would not do.
+
+Cost of single throttling check is measured separately with throttle cache holding buckets of many distinct clients.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from .bet_endpoint import create_players
+from .utils import benchmark_database, percentile, run_threads
+
+
+def run(users, abusers, seconds, throttle, interval):
+    from django.core.cache import caches
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import override_settings
+    from django.urls import reverse
+    path, body = reverse('api-bet'), json.dumps({'amount': '1.00'})
+    fair, abusive = users[:-1], users[-1]
+    latencies = []
+    statuses = {'fair': Counter(), 'abusive': Counter()}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def play(index):
+        client = Client()
+        is_fair = index < len(fair)
+        client.force_login(fair[index] if is_fair else abusive)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = client.post(path, body, content_type='application/json').status_code
+            except Exception as e:
+                status = type(e).__name__
+            latency = time.perf_counter() - start
+            with lock:
+                statuses['fair' if is_fair else 'abusive'][status] += 1
+                if is_fair:
+                    latencies.append(latency)
+            if is_fair:
+                time.sleep(max(0, interval - latency))
+        connection.close()
+
+    caches['throttle'].clear()
+    # Single process stands for all workers
+    with override_settings(THROTTLE_ENABLED=throttle, THROTTLE_WORKERS=1):
+        run_threads(play, len(fair) + abusers)
+    return latencies, statuses
+
+
+def consume_latencies(clients):
+    """Latencies of second check of every client, taken when cache holds buckets of all of them"""
+    from django.core.cache import caches
+    from casino import throttling
+    bucket = throttling.get_bucket('bet')
+    keys = ['throttle:bet:user:{}'.format(index) for index in range(clients)]
+    caches['throttle'].clear()
+    for key in keys:
+        bucket.consume(key)
+    latencies = []
+    for key in keys:
+        start = time.perf_counter()
+        bucket.consume(key)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=4, help='Fair players')
+    parser.add_argument('--abusers', type=int, default=4, help='Threads of abusive client')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--clients', type=int, nargs='*', default=[1000, 10000, 100000],
+                        help='Distinct clients for cost of single check')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with benchmark_database(test_name=os.path.join(directory, 'bench.sqlite3')):
+            from django.conf import settings
+            rate, burst = settings.THROTTLE_RATES['bet']
+            # Fair players stay below rate, so they are never throttled themselves
+            interval = 1.5 / rate
+            users = create_players(args.players + 1)
+            print('bet rate {}/s, burst {}, fair player bets every {:.2f}s'.format(rate, burst, interval))
+            for name, throttle, abusers in [('no abuser', False, 0), ('unthrottled', False, args.abusers),
+                                            ('throttled', True, args.abusers)]:
+                latencies, statuses = run(users, abusers, args.seconds, throttle, interval)
+                print('{:<12} fair: {:>5} bets  median {:>7.2f} ms  p99 {:>7.2f} ms  statuses {}   '
+                      'abusive: {:>6} requests  statuses {}'.format(
+                          name, len(latencies), percentile(latencies, 0.5) * 1000,
+                          percentile(latencies, 0.99) * 1000, dict(statuses['fair']),
+                          sum(statuses['abusive'].values()), dict(statuses['abusive'])))
+            for clients in args.clients:
+                latencies = consume_latencies(clients)
+                print('{:>7} clients: check median {:>6.3f} ms  p99 {:>6.3f} ms  max {:>6.3f} ms'.format(
+                    clients, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+                    max(latencies) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Helpers shared by benchmark scripts
+
+Each benchmark runs against a throwaway test database, created the same way as in the test runner.
+"""
+import contextlib
+import os
+import statistics
+import time
+
+import django
+
+
+@contextlib.contextmanager
+def benchmark_database(keepdb=False, test_name=None):
+    """Create test database, test_name allows file based SQLite database shared by threads"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'igaming.settings')
+    os.environ.setdefault('DEBUG', 'True')
+    django.setup()
+    from django.db import connection
+    old_name = connection.settings_dict['NAME']
+    if test_name:
+        connection.settings_dict['TEST']['NAME'] = test_name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def measure(func, repeat=100):
+    """Run func repeatedly, returns timings in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def run_threads(target, count):
+    """Run target(index) in count threads, returns wall time in seconds"""
+    import threading
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summary(timings):
+    return 'median {:.3f} ms, p99 {:.3f} ms, min {:.3f} ms'.format(
+        statistics.median(timings), percentile(timings, 0.99), min(timings))
+
+
+def capture_selects(connection, func):
+    """Return SQL of SELECT queries executed by func"""
+    from django.test.utils import CaptureQueriesContext
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    return [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+
+
+def explain(connection, sql):
+    """Return database query plan for SQL"""
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
@@ -0,0 +1,86 @@
+"""Query plans and timings of WalletManager hot queries
+
+Usage: python -m benchmarks.wallet_queries --wallets 1000000
+
+Runs the queries on the current schema, then migrates casino back to the baseline migration
+(0001_initial by default, i.e. without composite indexes) and runs them again.
+"""
+import argparse
+import random
+from decimal import Decimal
+
+from .utils import benchmark_database, capture_selects, explain, measure, summary
+
+
+def populate(wallets_count, wallets_per_customer, batch_size=10000):
+    from django.contrib.auth.models import User
+    from casino.models import Customer, Wallet
+
+    customers_count = wallets_count // wallets_per_customer
+    for start in range(1, customers_count + 1, batch_size):
+        ids = range(start, min(start + batch_size, customers_count + 1))
+        User.objects.bulk_create(User(pk=i, username='user{}'.format(i)) for i in ids)
+        Customer.objects.bulk_create(Customer(pk=i, user_id=i, overall_spent_money=1000) for i in ids)
+
+    rnd = random.Random(0)
+    batch = []
+    for customer_id in range(1, customers_count + 1):
+        batch.append(Wallet(customer_id=customer_id, currency=Wallet.EURO, amount=Decimal(rnd.randint(0, 100)),
+                            wagering_requirement=0))
+        for _ in range(wallets_per_customer - 1):
+            depleted = rnd.random() < 0.8
+            batch.append(Wallet(customer_id=customer_id, currency=Wallet.BONUS, wagering_requirement=rnd.randint(1, 50),
+                                amount=0 if depleted else Decimal(rnd.randint(1, 100)), depleted=depleted,
+                                spent_money_on_start=Decimal(rnd.randint(0, 1000))))
+        if len(batch) >= batch_size:
+            Wallet.objects.bulk_create(batch)
+            batch = []
+    Wallet.objects.bulk_create(batch)
+    return customers_count
+
+
+def run(connection, customers_count, repeat):
+    from casino.models import Customer, Wallet
+
+    customers = [Customer.objects.get(pk=pk) for pk in random.Random(1).sample(range(1, customers_count + 1), 10)]
+    queries = [
+        ('with_amount_first', lambda c: Wallet.objects.with_amount_first(c, 50)),
+        ('ready_to_wage_all', lambda c: list(Wallet.objects.ready_to_wage_all(c))),
+        ('sorted_all', lambda c: list(Wallet.objects.sorted_all(c))),
+    ]
+    for name, query in queries:
+        statements = [sql for c in customers for sql in capture_selects(connection, lambda: query(c))]
+        plans = [explain(connection, sql) for sql in capture_selects(connection, lambda: query(customers[0]))]
+        print('{} plan:\n{}'.format(name, '\n'.join(plans)))
+
+        def execute():
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+                    cursor.fetchall()
+
+        print('{} ORM (10 customers): {}'.format(name, summary(measure(lambda: [query(c) for c in customers], repeat))))
+        print('{} SQL (10 customers): {}\n'.format(name, summary(measure(execute, repeat))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--wallets', type=int, default=1000000)
+    parser.add_argument('--wallets-per-customer', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--baseline-migration', default='0001_initial')
+    args = parser.parse_args()
+
+    with benchmark_database() as connection:
+        from django.core.management import call_command
+        customers_count = populate(args.wallets, args.wallets_per_customer)
+        print('== current schema, {} wallets, {} customers\n'.format(args.wallets, customers_count))
+        run(connection, customers_count, args.repeat)
+
+        call_command('migrate', 'casino', args.baseline_migration, verbosity=0)
+        print('== schema at casino {}\n'.format(args.baseline_migration))
+        run(connection, customers_count, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
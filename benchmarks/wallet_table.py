@@ -0,0 +1,75 @@
+"""Render time of wallet table pages with and without cached table fragment
+
+Usage: python -m benchmarks.wallet_table --active 20 --depleted 1000
+
+Measures GET of table page and rendering of the wallet table template alone, first with dummy fragment cache
+(table rendered on every request), then with the configured template_fragments cache.
+"""
+import argparse
+from decimal import Decimal
+
+from .utils import benchmark_database, measure, summary
+
+
+def create_customer(active, depleted):
+    from django.contrib.auth.models import User
+    from casino.models import Customer, Wallet
+    user = User.objects.create_user('player')
+    customer = Customer.objects.create(user=user)
+    Wallet.objects.euro_wallet_get(customer)
+    Wallet.objects.bulk_create(
+        Wallet(customer=customer, currency=Wallet.BONUS, wagering_requirement=10, amount=Decimal(0 if i < depleted else 5),
+               depleted=i < depleted)
+        for i in range(active + depleted)
+    )
+    Customer.objects.refresh_summary(customer)
+    return user
+
+
+def run(user, repeat):
+    from django.template import engines
+    from django.test import Client, RequestFactory
+    from casino.services import WalletService
+    from casino.tables import WalletTable
+
+    client = Client()
+    client.force_login(user)
+    print('GET table page: {}'.format(summary(measure(lambda: client.get('/'), repeat))))
+
+    template = engines['django'].from_string(
+        '{% load cache %}{% load render_table from django_tables2 %}'
+        '{% cache 600 wallets customer.pk customer.wallet_version request.GET.urlencode %}'
+        '{% render_table wallets %}{% endcache %}'
+    )
+    request = RequestFactory().get('/')
+    request.user = user
+
+    def render():
+        wallet_service = WalletService(user)
+        template.render({'wallets': WalletTable.prepare(request, wallet_service),
+                         'customer': wallet_service.customer}, request)
+    print('render table:   {}'.format(summary(measure(render, repeat))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--active', type=int, default=20, help='Active bonus wallets of customer')
+    parser.add_argument('--depleted', type=int, default=1000, help='Depleted bonus wallets of customer')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with benchmark_database():
+        from django.test.utils import override_settings
+        from django.conf import settings
+        user = create_customer(args.active, args.depleted)
+
+        dummy = dict(settings.CACHES, template_fragments={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})
+        with override_settings(CACHES=dummy):
+            print('== without fragment cache')
+            run(user, args.repeat)
+        print('\n== with fragment cache')
+        run(user, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Concurrent withdrawals from single Euro wallet, previous read-check-write against conditional update
+
+Usage: python -m benchmarks.withdraw_stress --threads 8 --withdrawals 100
+
+Every thread withdraws 1 EUR repeatedly through its own WalletService created before the run, like requests of one
+player served by different workers. Scarce scenario starts with less money than is requested in total and checks
+that wallet is never overdrawn, ample scenario compares throughput. Uses file based SQLite database.
+"""
+import argparse
+import os
+import tempfile
+import threading
+from decimal import Decimal
+
+from .utils import benchmark_database, run_threads
+
+
+def previous_withdraw(wallet_service, amount):
+    """WalletService.withdraw before conditional update: check of cached amount, then unconditional update"""
+    from django.db import transaction
+    from django.db.models import F
+    from casino.models import Customer, LedgerEntry, Wallet
+    with transaction.atomic():
+        wallet = wallet_service.euro_wallet
+        if wallet.amount < amount:
+            return False
+        Wallet.objects.filter(pk=wallet.pk).update(amount=F('amount') - amount)
+        wallet.amount = Wallet.objects.filter(pk=wallet.pk).values_list('amount', flat=True).get()
+        LedgerEntry.objects.create(wallet=wallet, kind=LedgerEntry.WITHDRAW, delta=-amount, balance=wallet.amount)
+        Customer.objects.add_to(wallet.customer_id, euro_balance=-amount, wallet_version=1)
+        return True
+
+
+def current_withdraw(wallet_service, amount):
+    return wallet_service.withdraw(amount)
+
+
+def run(user, withdraw, balance, threads, withdrawals):
+    from django.db import connection
+    from casino.models import Customer, LedgerEntry, Wallet
+    from casino.services import WalletService
+
+    customer = Customer.objects.get(user=user)
+    wallet = Wallet.objects.euro_wallet_get(customer)
+    LedgerEntry.objects.filter(wallet=wallet).delete()
+    Wallet.objects.filter(pk=wallet.pk).update(amount=balance)
+    LedgerEntry.objects.create(wallet=wallet, kind=LedgerEntry.OPEN, delta=balance, balance=balance)
+    services = [WalletService(user) for _ in range(threads)]
+    for wallet_service in services:
+        wallet_service.euro_wallet
+    lock = threading.Lock()
+    counts = {'succeeded': 0, 'refused': 0, 'errors': 0}
+
+    def play(index):
+        for _ in range(withdrawals):
+            try:
+                result = 'succeeded' if withdraw(services[index], Decimal(1)) else 'refused'
+            except Exception:
+                result = 'errors'
+            with lock:
+                counts[result] += 1
+        connection.close()
+
+    wall = run_threads(play, threads)
+    amount = Wallet.objects.get(pk=wallet.pk).amount
+    ledger = LedgerEntry.objects.balances([wallet.pk])[wallet.pk]
+    return wall, counts, amount, ledger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--withdrawals', type=int, default=100, help='Withdrawals per thread')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with benchmark_database(test_name=os.path.join(directory, 'bench.sqlite3')):
+            from django.contrib.auth.models import User
+            from casino.models import Customer
+            user = User.objects.create_user('player')
+            Customer.objects.create(user=user)
+            requested = args.threads * args.withdrawals
+            for scenario, balance in [('scarce', Decimal(requested // 2)), ('ample', Decimal(requested * 2))]:
+                for name, withdraw in [('read-check-write', previous_withdraw), ('conditional', current_withdraw)]:
+                    wall, counts, amount, ledger = run(user, withdraw, balance, args.threads, args.withdrawals)
+                    print('{:<7} {:<17} {:>7.1f} withdrawals/s  start {:>5}  succeeded {:>5}  refused {:>5}  '
+                          'errors {:>3}  final amount {:>6}  ledger {:>6}  overdraft {}'.format(
+                              scenario, name, requested / wall, balance, counts['succeeded'], counts['refused'],
+                              counts['errors'], amount, ledger, max(0, counts['succeeded'] - balance)))
+
+
+if __name__ == '__main__':
+    main()
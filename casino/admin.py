@@ -1,7 +1,51 @@
 from django.contrib import admin
+from django.contrib.admin.actions import delete_selected as delete_selected_action
+from django.db import transaction
 from . import models
 
 
+@admin.register(models.Wallet)
+class WalletAdmin(admin.ModelAdmin):
+    """Edited wallets bypass WalletManager, so summary of their customers is recomputed"""
+    actions = ['delete_selected']
+
+    def save_model(self, request, obj, form, change):
+        customer_pks = {obj.customer_id, form.initial.get('customer')} - {None}
+        with transaction.atomic():
+            self._lock(customer_pks)
+            super().save_model(request, obj, form, change)
+            self._refresh(customer_pks)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            self._lock({obj.customer_id})
+            super().delete_model(request, obj)
+            self._refresh({obj.customer_id})
+
+    def delete_selected(self, request, queryset):
+        customer_pks = set(queryset.values_list('customer_id', flat=True))
+        with transaction.atomic():
+            self._lock(customer_pks)
+            response = delete_selected_action(self, request, queryset)
+            # Response is confirmation page until deletion is confirmed
+            if response is None:
+                self._refresh(customer_pks)
+        return response
+    delete_selected.short_description = delete_selected_action.short_description
+
+    @staticmethod
+    def _lock(customer_pks):
+        # Customers are locked before wallets, see CustomerManager.lock
+        for pk in sorted(customer_pks):
+            models.Customer.objects.lock(pk)
+
+    @staticmethod
+    def _refresh(customer_pks):
+        for customer in models.Customer.objects.filter(pk__in=customer_pks):
+            models.Customer.objects.refresh_summary(customer)
+
+
 admin.site.register(models.Bonus)
+admin.site.register(models.BonusEvent)
 admin.site.register(models.Customer)
-admin.site.register(models.Wallet)
+admin.site.register(models.WalletArchive)
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CasinoConfig(AppConfig):
@@ -7,3 +8,6 @@ class CasinoConfig(AppConfig):
 
     def ready(self):
         import casino.signal_handlers  # noqa: F401
+        if settings.METRICS_ENABLED:
+            from .metrics import instrument_backends
+            instrument_backends()
@@ -0,0 +1,55 @@
+"""Per-process cache of authenticated users, see CachedAuthenticationMiddleware
+
+Users are keyed by user id, backend and session auth hash stored in session, so session of changed password never
+matches cached user. Entries expire after AUTH_USER_CACHE_TIMEOUT seconds, users saved or deleted in this process
+are dropped immediately, changes done in other processes take effect after timeout.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib import auth
+
+MAX_ENTRIES = 10000
+
+_users = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_user(request):
+    """Return user of request session like django.contrib.auth.get_user, from cache when possible"""
+    timeout = settings.AUTH_USER_CACHE_TIMEOUT
+    session = request.session
+    key = (session.get(auth.SESSION_KEY), session.get(auth.BACKEND_SESSION_KEY), session.get(auth.HASH_SESSION_KEY))
+    if not timeout or None in key:
+        return auth.get_user(request)
+
+    now = time.monotonic()
+    with _lock:
+        entry = _users.get(key)
+    if entry is not None and entry[1] > now:
+        # Copy, so request never changes user shared with other requests
+        return copy.copy(entry[0])
+
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        with _lock:
+            _users[key] = (copy.copy(user), now + timeout)
+            _users.move_to_end(key)
+            while len(_users) > MAX_ENTRIES:
+                _users.popitem(last=False)
+    return user
+
+
+def invalidate(user_id):
+    """Drop cached sessions of user"""
+    user_id = str(user_id)
+    with _lock:
+        for key in [key for key in _users if str(key[0]) == user_id]:
+            del _users[key]
+
+
+def clear():
+    with _lock:
+        _users.clear()
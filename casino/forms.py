@@ -1,13 +1,56 @@
+import uuid
 from django import forms
-from django.forms.widgets import RadioSelect
+from django.conf import settings
+from django.forms.widgets import HiddenInput, RadioSelect
 
 
-class BetForm(forms.Form):
+class IdempotentForm(forms.Form):
+    """Form with key identifying submission, so resubmitted form is processed once"""
+    HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+    idempotency_key = forms.CharField(max_length=64, required=False, widget=HiddenInput,
+                                      initial=lambda: uuid.uuid4().hex)
+
+    def __init__(self, data=None, *args, request=None, **kwargs):
+        if data is not None and request is not None and request.META.get(self.HEADER):
+            data = data.copy()
+            data['idempotency_key'] = request.META[self.HEADER]
+        super().__init__(data, *args, **kwargs)
+
+    def get_idempotency_key(self):
+        return self.cleaned_data.get('idempotency_key') or None
+
+
+class BetForm(IdempotentForm):
     """Placing a bet"""
     amount = forms.DecimalField(max_digits=10, decimal_places=2, min_value=1)
 
 
-class TransactionForm(forms.Form):
+class BetListField(forms.Field):
+    """List of bet amounts, each validated as BetForm amount"""
+    def to_python(self, value):
+        if value in self.empty_values:
+            return []
+        if not isinstance(value, list):
+            raise forms.ValidationError('Expected list of amounts')
+        if len(value) > settings.BET_MANY_MAX:
+            raise forms.ValidationError('At most {} bets are allowed'.format(settings.BET_MANY_MAX))
+        field = BetForm.base_fields['amount']
+        amounts = []
+        for index, amount in enumerate(value):
+            try:
+                amounts.append(field.clean(amount))
+            except forms.ValidationError as e:
+                raise forms.ValidationError('Bet {}: {}'.format(index + 1, ' '.join(e.messages)))
+        return amounts
+
+
+class BetManyForm(IdempotentForm):
+    """Placing many bets at once"""
+    amounts = BetListField()
+
+
+class TransactionForm(IdempotentForm):
     """Depositing/withdrawing money from main wallet"""
     DEPOSIT = 'D'
     WITHDRAW = 'W'
@@ -0,0 +1,286 @@
+"""Replay of load test scenarios against WSGI application of this process or uWSGI socket
+
+Scenario is JSON lines file of steps every synthetic user performs in order, e.g.
+{"action": "register"}
+{"action": "login"}
+{"action": "deposit", "amount": "100.00"}
+{"action": "bet", "amount": "1.00", "repeat": 50}
+Actions are register, login, logout, table, deposit, withdraw, bet (table form) and bet_api (JSON API). Users are
+played in parallel by concurrency threads, each user with own client and session.
+"""
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import defaultdict
+from http.client import HTTPResponse
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlparse
+from django.conf import settings
+from django.db import connection
+from django.urls import reverse
+from . import metrics
+
+PASSWORD = 'Correct-Horse-8'
+FORM = 'application/x-www-form-urlencoded'
+
+
+# Every action returns method, path, data, content type and expected status with redirect location
+
+
+def _register(username, step):
+    data = {'username': username, 'password1': PASSWORD, 'password2': PASSWORD}
+    return 'POST', reverse('accounts-register'), data, FORM, (302, settings.LOGIN_REDIRECT_URL)
+
+
+def _login(username, step):
+    data = {'username': username, 'password': PASSWORD}
+    return 'POST', reverse('accounts-login'), data, FORM, (302, settings.LOGIN_REDIRECT_URL)
+
+
+def _logout(username, step):
+    return 'GET', reverse('accounts-logout'), None, None, (200, None)
+
+
+def _table(username, step):
+    return 'GET', reverse('table'), None, None, (200, None)
+
+
+def _transaction(direction):
+    def request(username, step):
+        data = {'amount': step['amount'], 'direction': direction}
+        return 'POST', reverse('bank'), data, FORM, (302, reverse('bank'))
+    return request
+
+
+def _bet(username, step):
+    return 'POST', reverse('table'), {'amount': step['amount']}, FORM, (302, reverse('table'))
+
+
+def _bet_api(username, step):
+    return 'POST', reverse('api-bet'), json.dumps({'amount': step['amount']}), 'application/json', (200, None)
+
+
+ACTIONS = {
+    'register': _register,
+    'login': _login,
+    'logout': _logout,
+    'table': _table,
+    'deposit': _transaction('D'),
+    'withdraw': _transaction('W'),
+    'bet': _bet,
+    'bet_api': _bet_api,
+}
+
+
+def load_scenario(lines):
+    """Parse scenario lines into list of steps, raises ValueError for invalid step"""
+    steps = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            step = json.loads(line)
+        except ValueError as e:
+            raise ValueError('Line {}: {}'.format(number, e))
+        if not isinstance(step, dict) or step.get('action') not in ACTIONS:
+            raise ValueError('Line {}: action must be one of {}'.format(number, ', '.join(sorted(ACTIONS))))
+        if step['action'] in ('deposit', 'withdraw', 'bet', 'bet_api') and 'amount' not in step:
+            raise ValueError('Line {}: {} requires amount'.format(number, step['action']))
+        steps.append(step)
+    return steps
+
+
+class WsgiClient(object):
+    """Requests through WSGI handler of this process"""
+    def __init__(self):
+        from django.test import Client
+        self.client = Client()
+
+    def start(self):
+        pass
+
+    def request(self, method, path, data=None, content_type=None):
+        if method == 'GET':
+            response = self.client.get(path)
+        elif content_type == FORM:
+            # Test client encodes dictionaries as multipart form only
+            response = self.client.post(path, data)
+        else:
+            response = self.client.post(path, data, content_type=content_type)
+        return response.status_code, response.get('Location')
+
+
+class UwsgiClient(object):
+    """Requests over uwsgi protocol to uWSGI socket, unix socket path or host:port, with cookies and CSRF token"""
+    def __init__(self, address, host='localhost'):
+        self.address = address
+        self.host = host
+        self.cookies = {}
+
+    def start(self):
+        # Login form sets CSRF cookie required by POST requests
+        self.request('GET', reverse('accounts-login'))
+
+    def _connect(self):
+        if ':' in self.address:
+            host, port = self.address.rsplit(':', 1)
+            return socket.create_connection((host, int(port)))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.address)
+        return sock
+
+    def _packet(self, method, path, body, content_type):
+        variables = {
+            'REQUEST_METHOD': method,
+            'REQUEST_URI': path,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': self.host,
+            'CONTENT_LENGTH': str(len(body)),
+        }
+        if content_type:
+            variables['CONTENT_TYPE'] = content_type
+        if self.cookies:
+            variables['HTTP_COOKIE'] = '; '.join('{}={}'.format(k, v) for k, v in self.cookies.items())
+        if settings.CSRF_COOKIE_NAME in self.cookies:
+            variables['HTTP_X_CSRFTOKEN'] = self.cookies[settings.CSRF_COOKIE_NAME]
+        payload = b''.join(
+            struct.pack('<H', len(part)) + part
+            for key, value in variables.items() for part in (key.encode('latin-1'), value.encode('latin-1'))
+        )
+        return struct.pack('<BHB', 0, len(payload), 0) + payload + body
+
+    def request(self, method, path, data=None, content_type=None):
+        if data is None:
+            body = b''
+        elif isinstance(data, str):
+            body = data.encode('utf-8')
+        else:
+            body = urlencode(data).encode('utf-8')
+        with self._connect() as sock:
+            sock.sendall(self._packet(method, path, body, content_type or (FORM if data is not None else None)))
+            response = HTTPResponse(sock)
+            response.begin()
+            response.read()
+        for header in response.msg.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, response.getheader('Location')
+
+
+class ActionStats(object):
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.queries = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        self.queries += other.queries
+
+
+class LoadTestResult(object):
+    def __init__(self, actions, seconds):
+        self.actions = actions
+        self.seconds = seconds
+
+    @property
+    def requests(self):
+        return sum(len(stats.latencies) for stats in self.actions.values())
+
+    @property
+    def errors(self):
+        return sum(stats.errors for stats in self.actions.values())
+
+    @property
+    def throughput(self):
+        return self.requests / self.seconds if self.seconds else 0
+
+    def as_dict(self):
+        """Summary with latencies in milliseconds, suitable for comparing runs"""
+        actions = {}
+        for action, stats in sorted(self.actions.items()):
+            latencies = sorted(stats.latencies)
+            actions[action] = {
+                'requests': len(latencies),
+                'errors': stats.errors,
+                'p50': _percentile(latencies, 0.5) * 1000,
+                'p90': _percentile(latencies, 0.9) * 1000,
+                'p99': _percentile(latencies, 0.99) * 1000,
+                'max': latencies[-1] * 1000,
+                'queries': stats.queries / len(latencies),
+            }
+        return {'requests': self.requests, 'errors': self.errors, 'seconds': self.seconds,
+                'throughput': self.throughput, 'actions': actions}
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def play(client, username, steps, stats):
+    """Perform scenario steps as user, recording latency, queries counted in this process and unexpected statuses"""
+    client.start()
+    for step in steps:
+        method, path, data, content_type, expected = ACTIONS[step['action']](username, step)
+        action_stats = stats[step['action']]
+        for _ in range(step.get('repeat', 1)):
+            start = time.perf_counter()
+            with metrics.measure('loadtest', step['action']) as scope:
+                try:
+                    status, location = client.request(method, path, data, content_type)
+                except Exception:
+                    status = location = None
+            action_stats.latencies.append(time.perf_counter() - start)
+            action_stats.queries += scope.queries
+            if (status, location and urlparse(location).path) != expected:
+                action_stats.errors += 1
+
+
+def run(steps, users, concurrency, client_factory, prefix='load'):
+    """Play scenario as users named prefix0, prefix1... in concurrency threads, returns LoadTestResult"""
+    pending = queue.Queue()
+    for index in range(users):
+        pending.put('{}{}'.format(prefix, index))
+    results = []
+
+    def worker():
+        stats = defaultdict(ActionStats)
+        while True:
+            try:
+                username = pending.get_nowait()
+            except queue.Empty:
+                break
+            play(client_factory(), username, steps, stats)
+        results.append(stats)
+
+    def thread_worker():
+        try:
+            worker()
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=thread_worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    seconds = time.perf_counter() - start
+
+    actions = defaultdict(ActionStats)
+    for stats in results:
+        for action, action_stats in stats.items():
+            actions[action].merge(action_stats)
+    return LoadTestResult(dict(actions), seconds)
@@ -0,0 +1,30 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...models import Wallet
+
+
+class Command(BaseCommand):
+    help = 'Move old depleted wallets to wallet archive in batches, safe to interrupt and run again'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.WALLET_ARCHIVE_DAYS,
+                            help='Archive depleted wallets created more than days ago')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        created_before = timezone.now() - timedelta(days=options['days'])
+        archived = last_pk = 0
+        while True:
+            count, last_pk = Wallet.objects.archive_depleted(created_before, options['batch_size'], last_pk)
+            if not count:
+                break
+            archived += count
+            if options['verbosity'] > 1:
+                self.stdout.write('Archived {} wallets up to id {}'.format(archived, last_pk))
+            time.sleep(options['sleep'])
+
+        self.stdout.write('Archived {} wallets created before {:%Y-%m-%d}'.format(archived, created_before))
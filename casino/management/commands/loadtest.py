@@ -0,0 +1,88 @@
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from ... import loadtest
+from ...metrics import instrument_backends
+
+
+class Command(BaseCommand):
+    help = 'Replay scenario of user actions with concurrent users and report throughput, latency and queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', help='JSON lines file of steps, e.g. benchmarks/scenarios/session.jsonl')
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of users played at the same time')
+        parser.add_argument('--socket', help='uWSGI socket, unix socket path or host:port, instead of application '
+                                             'of this process')
+        parser.add_argument('--host', default='localhost', help='Host header of requests sent to uWSGI socket')
+        parser.add_argument('--fixture', action='append', default=[],
+                            help='Fixture loaded before replay in this process, e.g. casino/fixtures/bonuses.yaml')
+        parser.add_argument('--use-database', action='store_true',
+                            help='Replay in this process against configured database instead of throwaway one')
+        parser.add_argument('--throttle', action='store_true',
+                            help='Keep THROTTLE_RATES when replaying in this process, all users share one address')
+        parser.add_argument('--output', help='File to write JSON summary to, for comparing runs')
+
+    @contextlib.contextmanager
+    def database(self, use_database):
+        """Throwaway database created with migrations, SQLite one is a file so threads share it"""
+        if use_database:
+            yield
+            return
+        old_name = connection.settings_dict['NAME']
+        directory = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'loadtest.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(directory)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['scenario']) as stream:
+                steps = loadtest.load_scenario(stream)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        prefix = 'load-{}-'.format(uuid.uuid4().hex[:8])
+
+        if options['socket']:
+            result = loadtest.run(steps, options['users'], options['concurrency'],
+                                  lambda: loadtest.UwsgiClient(options['socket'], options['host']), prefix)
+        else:
+            # Queries of each request are counted by cursor wrappers of metrics
+            instrument_backends()
+            with self.database(options['use_database']), \
+                    override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver'],
+                                      THROTTLE_ENABLED=settings.THROTTLE_ENABLED and options['throttle']):
+                for fixture in options['fixture']:
+                    call_command('loaddata', fixture, verbosity=0)
+                result = loadtest.run(steps, options['users'], options['concurrency'], loadtest.WsgiClient, prefix)
+
+        summary = result.as_dict()
+        self.stdout.write('Requests: {}, errors: {}, {:.2f}s, {:.1f} requests/s'.format(
+            summary['requests'], summary['errors'], summary['seconds'], summary['throughput']))
+        self.stdout.write('{:<10} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+            'action', 'requests', 'errors', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'queries'))
+        for action, stats in summary['actions'].items():
+            if options['socket']:
+                # Queries run in uWSGI workers, not counted here
+                stats['queries'] = None
+            self.stdout.write('{:<10} {requests:>8} {errors:>7} {p50:>9.2f} {p90:>9.2f} {p99:>9.2f} {max:>9.2f} '
+                              '{:>8}'.format(action, '-' if stats['queries'] is None else
+                                             '{:.1f}'.format(stats['queries']), **stats))
+        if options['output']:
+            summary.update(scenario=options['scenario'], users=options['users'],
+                           concurrency=options['concurrency'], socket=options['socket'])
+            with open(options['output'], 'w') as stream:
+                json.dump(summary, stream, indent=2, sort_keys=True)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from ...models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys older than IDEMPOTENCY_KEY_TTL setting in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        deleted = 0
+        while True:
+            pks = list(IdempotencyKey.objects.expired().values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            IdempotencyKey.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+
+        self.stdout.write('Deleted {} expired idempotency keys'.format(deleted))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ...models import Customer, LedgerEntry, Wallet
+
+
+class Command(BaseCommand):
+    help = 'Compare wallet amounts with balances rebuilt from ledger, processing wallets in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--fix', action='store_true',
+                            help='Overwrite mismatched wallet amounts with ledger balances and refresh customer summary')
+
+    def handle(self, *args, **options):
+        checked = mismatched = 0
+        last_pk = 0
+        while True:
+            wallets = list(
+                Wallet.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'amount')[:options['batch_size']]
+            )
+            if not wallets:
+                break
+            balances = LedgerEntry.objects.balances([pk for pk, _ in wallets])
+            for pk, amount in wallets:
+                balance = balances.get(pk, 0)
+                if balance != amount:
+                    mismatched += 1
+                    self.stdout.write('Wallet {}: amount {}, ledger balance {}'.format(pk, amount, balance))
+                    if options['fix']:
+                        self._fix(pk)
+            checked += len(wallets)
+            last_pk = wallets[-1][0]
+
+        self.stdout.write('Checked {} wallets, {} mismatched'.format(checked, mismatched))
+
+    @staticmethod
+    @transaction.atomic
+    def _fix(pk):
+        # Customer is locked before wallet, see CustomerManager.lock
+        customer = Customer.objects.select_for_update().get(wallet=pk)
+        wallet = Wallet.objects.select_for_update().get(pk=pk)
+        wallet.amount = LedgerEntry.objects.balances([pk]).get(pk, 0)
+        wallet.save(update_fields=['amount', 'depleted'])
+        Customer.objects.refresh_summary(customer)
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from ...services import BonusWorker
+
+
+class Command(BaseCommand):
+    help = 'Apply login and deposit bonuses recorded in outbox when BONUS_OUTBOX is enabled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--sleep', type=float, default=1, help='Seconds to wait when there are no pending events')
+        parser.add_argument('--stats-interval', type=float, default=60, help='Seconds between backlog reports')
+        parser.add_argument('--once', action='store_true', help='Exit when there are no pending events')
+
+    def report(self, worker, processed, failed):
+        stats = worker.stats()
+        self.stdout.write('Processed {} events, {} failed, {} pending, {} given up, lag {:.1f}s'.format(
+            processed, failed, stats['pending'], stats['failed'], stats['lag']))
+
+    def handle(self, *args, **options):
+        worker = BonusWorker(options['batch_size'])
+        processed = failed = 0
+        reported = time.monotonic()
+        while True:
+            batch_processed, batch_failed = worker.process_batch()
+            processed += batch_processed
+            failed += batch_failed
+            if time.monotonic() - reported >= options['stats_interval']:
+                self.report(worker, processed, failed)
+                reported = time.monotonic()
+            if batch_processed + batch_failed < options['batch_size']:
+                if options['once']:
+                    break
+                worker.purge()
+                time.sleep(options['sleep'])
+
+        self.report(worker, processed, failed)
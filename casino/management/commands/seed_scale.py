@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...seeding import Distribution, seed_customers
+
+
+class Command(BaseCommand):
+    help = 'Generate large synthetic dataset of customers with bonus wallets in streaming batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=100000)
+        parser.add_argument('--bonus-wallets', type=float, default=5, help='Mean number of bonus wallets of customer')
+        parser.add_argument('--depleted-ratio', type=float, default=0.8, help='Share of depleted bonus wallets')
+        parser.add_argument('--median-spent', type=float, default=200, help='Median overall spent money in EUR')
+        parser.add_argument('--median-balance', type=float, default=20, help='Median Euro wallet amount in EUR')
+        parser.add_argument('--days', type=int, default=365, help='Customers joined and wallets were created within '
+                                                                  'days before end date')
+        parser.add_argument('--end-date', type=lambda value: datetime.strptime(value, '%Y-%m-%d'),
+                            help='Last day of generated history as YYYY-MM-DD, today by default')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10000, help='Customers inserted in one transaction')
+        parser.add_argument('--prefix', default='seed', help='Prefix of usernames, followed by user id')
+        parser.add_argument('--password', help='Password of all users, unusable password by default')
+        parser.add_argument('--no-ledger', action='store_false', dest='ledger',
+                            help='Skip opening balance ledger entries of wallets with money')
+
+    def handle(self, *args, **options):
+        end = options['end_date'] or datetime.combine(timezone.now().date(), datetime.min.time())
+        end += timedelta(days=1)
+        distribution = Distribution(options['bonus_wallets'], options['depleted_ratio'], options['median_spent'],
+                                    options['median_balance'], options['days'])
+        start = time.perf_counter()
+        customers = wallets = entries = 0
+        for chunk_customers, chunk_wallets, chunk_entries in seed_customers(
+                options['customers'], distribution, end, options['seed'], options['batch_size'], options['prefix'],
+                options['password'], options['ledger']):
+            customers += chunk_customers
+            wallets += chunk_wallets
+            entries += chunk_entries
+            if options['verbosity'] > 1:
+                self.stdout.write('Created {:,} customers, {:,} wallets, {:,.0f} rows/s'.format(
+                    customers, wallets, (customers * 2 + wallets + entries) / (time.perf_counter() - start)))
+
+        self.stdout.write('Created {:,} customers, {:,} wallets and {:,} ledger entries in {:.1f}s'.format(
+            customers, wallets, entries, time.perf_counter() - start))
@@ -0,0 +1,43 @@
+import os
+from decimal import Decimal
+from django.core import serializers
+from django.core.management.base import BaseCommand
+from ...models import Bonus
+from ...simulation import simulate
+
+
+class Command(BaseCommand):
+    help = 'Simulate players of game with bonus catalogue and report RTP and bonus wagering, without database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', default='casino.services.SimpleGame', help='Dotted path to BaseGameService')
+        parser.add_argument('--bonuses', help='Fixture file with bonus catalogue, e.g. casino/fixtures/bonuses.yaml')
+        parser.add_argument('--players', type=int, default=100000)
+        parser.add_argument('--rounds', type=int, default=100, help='Maximal number of bets per player')
+        parser.add_argument('--deposit', type=Decimal, default=Decimal('20'))
+        parser.add_argument('--bet', type=Decimal, default=Decimal('1'))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--processes', type=int, help='Worker processes, number of cores by default')
+
+    def handle(self, *args, **options):
+        catalogue = []
+        if options['bonuses']:
+            with open(options['bonuses']) as stream:
+                format = os.path.splitext(options['bonuses'])[1][1:]
+                catalogue = [
+                    obj.object for obj in serializers.deserialize(format, stream) if isinstance(obj.object, Bonus)
+                ]
+            catalogue.sort(key=lambda bonus: (bonus.min_amount, bonus.pk))
+
+        result = simulate(options['game'], catalogue, options['players'], options['rounds'], options['deposit'],
+                          options['bet'], seed=options['seed'], processes=options['processes'])
+
+        self.stdout.write('Players: {:,}, bets: {:,}'.format(result.players, result.bets))
+        self.stdout.write('Wagered: {:,.2f} EUR, returned: {:,.2f} EUR'.format(
+            result.wagered / 100, result.returned / 100))
+        self.stdout.write('RTP: {:.4%}, house edge: {:.4%}'.format(result.rtp, result.house_edge))
+        self.stdout.write('Euro bonuses credited: {:,.2f} EUR'.format(result.euro_bonuses / 100))
+        self.stdout.write('Bonus wallets: {:,} created, {:,} released ({:.2%}), {:,.2f} EUR released'.format(
+            result.bonus_wallets, result.released, result.release_rate, result.released_amount / 100))
+        self.stdout.write('Players out of money: {:,}, money left: {:,.2f} EUR'.format(
+            result.busted, result.balance / 100))
@@ -0,0 +1,186 @@
+"""Query count, database time and latency histograms of views and service methods
+
+Cursors of database connections count queries and their time into scopes measured in current thread.
+Histograms are kept per process and rendered in Prometheus text format with pid label. Every observation is also
+logged to casino.metrics logger when it is enabled for INFO, see METRICS_LOG setting.
+"""
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram(object):
+    LABELS = ('kind', 'name')
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def get(self, *labels):
+        """Return count and sum of observations with labels"""
+        with self._lock:
+            counts, total = self._series.get(labels, ((), 0))
+            return sum(counts), total
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        pid = os.getpid()
+        for labels, counts, total in series:
+            text = ','.join('{}="{}"'.format(k, v) for k, v in zip(self.LABELS + ('pid',), labels + (pid,)))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (None,), counts):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    self.name, text, '+Inf' if bound is None else bound, cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, text, total))
+            lines.append('{}_count{{{}}} {}'.format(self.name, text, cumulative))
+        return lines
+
+
+LATENCY = Histogram('casino_latency_seconds', 'Total time of view or service call', LATENCY_BUCKETS)
+DB_TIME = Histogram('casino_db_seconds', 'Time of database queries of view or service call', LATENCY_BUCKETS)
+QUERIES = Histogram('casino_queries', 'Number of database queries of view or service call', QUERY_BUCKETS)
+HISTOGRAMS = (LATENCY, DB_TIME, QUERIES)
+
+_local = threading.local()
+
+
+class Scope(object):
+    __slots__ = ('kind', 'name', 'queries', 'db_time', '_start')
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.queries = 0
+        self.db_time = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        scopes = getattr(_local, 'scopes', None)
+        if scopes is None:
+            scopes = _local.scopes = []
+        scopes.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        latency = time.perf_counter() - self._start
+        _local.scopes.remove(self)
+        observe(self.kind, self.name, self.queries, self.db_time, latency)
+
+
+def measure(kind, name=None):
+    """Context manager observing queries, database time and latency of block, name can be set inside of block"""
+    return Scope(kind, name)
+
+
+def observe(kind, name, queries, db_time, latency):
+    labels = (kind, name)
+    LATENCY.observe(labels, latency)
+    DB_TIME.observe(labels, db_time)
+    QUERIES.observe(labels, queries)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info('%s %s queries=%d db=%.6f latency=%.6f', kind, name, queries, db_time, latency)
+
+
+def instrumented(method):
+    """Decorator observing service method under its name"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not settings.METRICS_ENABLED:
+            return method(*args, **kwargs)
+        with measure('service', method.__name__):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def render():
+    """All histograms in Prometheus text exposition format"""
+    return '\n'.join(line for histogram in HISTOGRAMS for line in histogram.render()) + '\n'
+
+
+class QueryCounterMixin(object):
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            _count(time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, param_list)
+        finally:
+            _count(time.perf_counter() - start)
+
+
+class QueryCounterCursorWrapper(QueryCounterMixin, CursorWrapper):
+    pass
+
+
+class QueryCounterCursorDebugWrapper(QueryCounterMixin, CursorDebugWrapper):
+    pass
+
+
+def _count(duration):
+    for scope in getattr(_local, 'scopes', ()):
+        scope.queries += 1
+        scope.db_time += duration
+
+
+# Cursor factories of Django, used for connections not counted by instrument_backends
+_make_cursor = BaseDatabaseWrapper.make_cursor
+_make_debug_cursor = BaseDatabaseWrapper.make_debug_cursor
+
+
+def instrument_backends(aliases=None):
+    """Make cursors of connections to databases in aliases, METRICS_DATABASES by default, count queries into scopes
+
+    Cursor factories are replaced on BaseDatabaseWrapper, because Django resolves make_cursor before opening
+    connection, so patching connection from connection_created would miss its first query. Connections to other
+    aliases get cursors of their backend unchanged. Calling it again replaces aliases rather than wrapping twice.
+    """
+    aliases = frozenset(settings.METRICS_DATABASES if aliases is None else aliases)
+
+    def make_cursor(self, cursor):
+        if self.alias in aliases:
+            return QueryCounterCursorWrapper(cursor, self)
+        return _make_cursor(self, cursor)
+
+    def make_debug_cursor(self, cursor):
+        if self.alias in aliases:
+            return QueryCounterCursorDebugWrapper(cursor, self)
+        return _make_debug_cursor(self, cursor)
+
+    BaseDatabaseWrapper.make_cursor = make_cursor
+    BaseDatabaseWrapper.make_debug_cursor = make_debug_cursor
+
@@ -0,0 +1,70 @@
+import math
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, JsonResponse
+from django.utils.functional import SimpleLazyObject
+from . import auth, metrics, throttling
+from .services import WalletService
+
+
+class MetricsMiddleware(object):
+    """Observes queries, database time and latency of requests under name of resolved view
+
+    Queries are counted by cursors of METRICS_DATABASES connections, which casino app installs on start by patching
+    make_cursor and make_debug_cursor of BaseDatabaseWrapper, see metrics.instrument_backends.
+    """
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with metrics.measure('view') as scope:
+            response = self.get_response(request)
+            match = getattr(request, 'resolver_match', None)
+            scope.name = match.view_name if match else 'unresolved'
+        return response
+
+
+class WalletServiceMiddleware(object):
+    """Attaches lazily created WalletService to request, so customer and Euro wallet are fetched once per request"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.wallet_service = SimpleLazyObject(lambda: WalletService(request.user))
+        return self.get_response(request)
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """AuthenticationMiddleware taking users from per-process cache, see AUTH_USER_CACHE_TIMEOUT setting"""
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: auth.get_user(request))
+
+
+class ThrottleMiddleware(object):
+    """Answers 429 to POST requests exceeding THROTTLE_RATES of their endpoint, before view runs any transaction
+
+    THROTTLE_ENABLED is read on every request, so it can be switched with override_settings.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.THROTTLE_ENABLED or request.method != 'POST':
+            return None
+        wait = throttling.throttle(request, request.resolver_match.view_name)
+        if not wait:
+            return None
+        message = 'Too many requests, retry in {} s'.format(math.ceil(wait))
+        if request.content_type == 'application/json':
+            response = JsonResponse({'errors': {'__all__': [message]}}, status=429)
+        else:
+            response = HttpResponse(message, status=429, content_type='text/plain')
+        response['Retry-After'] = math.ceil(wait)
+        return response
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, F
+import django.db.models.deletion
+
+
+def merge_euro_wallets(apps, schema_editor):
+    """Merge duplicated active Euro wallets into the oldest one"""
+    Wallet = apps.get_model('casino', 'Wallet')
+    active_euro = Wallet.objects.filter(currency='EUR', depleted=False)
+    duplicated = active_euro.values('customer').annotate(count=Count('id')).filter(count__gt=1)
+    for row in duplicated:
+        wallets = list(active_euro.filter(customer=row['customer']).order_by('pk'))
+        Wallet.objects.filter(pk=wallets[0].pk).update(amount=F('amount') + sum(w.amount for w in wallets[1:]))
+        Wallet.objects.filter(pk__in=[w.pk for w in wallets[1:]]).update(amount=0, depleted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casino', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='wallet',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='wallet',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='casino.Customer'),
+        ),
+        migrations.AlterIndexTogether(
+            name='wallet',
+            index_together=set([('customer', 'depleted', 'created'), ('customer', 'created')]),
+        ),
+        migrations.RunPython(merge_euro_wallets, migrations.RunPython.noop),
+        migrations.RunSQL(
+            ["CREATE UNIQUE INDEX casino_wallet_active_euro_uniq ON casino_wallet (customer_id) "
+             "WHERE currency = 'EUR' AND NOT depleted"],
+            ["DROP INDEX casino_wallet_active_euro_uniq"],
+        ),
+    ]
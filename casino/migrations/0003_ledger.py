@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_balances(apps, schema_editor, batch_size=10000):
+    """Record current amounts of existing wallets as opening ledger entries"""
+    Wallet = apps.get_model('casino', 'Wallet')
+    LedgerEntry = apps.get_model('casino', 'LedgerEntry')
+    last_pk = 0
+    while True:
+        wallets = list(Wallet.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'amount')[:batch_size])
+        if not wallets:
+            break
+        LedgerEntry.objects.bulk_create(
+            LedgerEntry(wallet_id=pk, kind='open', delta=amount, balance=amount) for pk, amount in wallets if amount
+        )
+        last_pk = wallets[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casino', '0002_wallet_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('open', 'Opening balance'), ('deposit', 'Deposit'), ('withdraw', 'Withdraw'), ('bet', 'Bet'), ('bonus', 'Bonus'), ('wage', 'Bonus wagered')], max_length=8)),
+                ('delta', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('wallet', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='casino.Wallet')),
+            ],
+            options={
+                'verbose_name_plural': 'ledger entries',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='ledgerentry',
+            index_together=set([('wallet', 'id')]),
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
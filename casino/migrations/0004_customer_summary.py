@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+
+
+def fill_summary(apps, schema_editor):
+    """Compute summary of active wallets for existing customers"""
+    Customer = apps.get_model('casino', 'Customer')
+    Wallet = apps.get_model('casino', 'Wallet')
+
+    def amount_of(currency):
+        return Sum(Case(When(currency=currency, then=F('amount')), default=Value(0),
+                        output_field=DecimalField(max_digits=20, decimal_places=2)))
+
+    summaries = Wallet.objects.filter(depleted=False).values('customer').annotate(
+        euro=amount_of('EUR'),
+        bonus=amount_of('BNS'),
+        count=Count(Case(When(currency='BNS', then=F('pk')))),
+    ).order_by()
+    for summary in summaries.iterator():
+        Customer.objects.filter(pk=summary['customer']).update(
+            euro_balance=summary['euro'] or 0, bonus_balance=summary['bonus'] or 0,
+            active_bonus_wallets=summary['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casino', '0003_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='active_bonus_wallets',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='bonus_balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='euro_balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casino', '0004_customer_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='wallet_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
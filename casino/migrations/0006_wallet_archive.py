@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casino', '0005_customer_wallet_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletArchive',
+            fields=[
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('currency', models.CharField(choices=[('EUR', 'Euro'), ('BNS', 'Bonus')], max_length=3)),
+                ('wagering_requirement', models.IntegerField()),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField()),
+                ('spent_money_on_start', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='casino.Customer')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='wallet',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='casino.Wallet'),
+        ),
+        migrations.AlterIndexTogether(
+            name='walletarchive',
+            index_together=set([('customer', 'created')]),
+        ),
+    ]
@@ -1,12 +1,88 @@
+import bisect
+import hashlib
+import json
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.exceptions import ValidationError
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.sql import DeleteQuery
+from django.utils import timezone
+
+HALF_CENT = Decimal('0.005')
+
+
+class CustomerManager(models.Manager):
+    def lock(self, pk):
+        """Lock customer row until end of transaction
+
+        Lock order is customer first, then its wallets. Every transaction changing wallets and summary of customer
+        takes customer lock before any wallet row, so bets, bank operations and bonuses of the same customer queue on
+        it instead of deadlocking on wallet and customer rows locked in opposite order.
+        """
+        self.select_for_update().values_list('pk', flat=True).get(pk=pk)
+
+    def add_to(self, pk, **deltas):
+        """Add deltas to numeric fields of customer with single update"""
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if deltas:
+            self.filter(pk=pk).update(**{field: models.F(field) + delta for field, delta in deltas.items()})
+
+    def refresh_summary(self, customer):
+        """Recompute summary of active wallets from wallets, customer is updated in place
+
+        For wallets changed outside of WalletManager and game services, e.g. in admin. Customer is locked before
+        wallets are aggregated, so summary deltas of concurrent operations are not overwritten.
+        """
+        def amount_of(currency):
+            return models.Sum(models.Case(
+                models.When(currency=currency, then=models.F('amount')),
+                default=models.Value(0),
+                output_field=models.DecimalField(max_digits=20, decimal_places=2),
+            ))
+
+        with transaction.atomic():
+            self.lock(customer.pk)
+            summary = Wallet.objects.filter(customer=customer, depleted=False).aggregate(
+                euro_balance=amount_of(Wallet.EURO),
+                bonus_balance=amount_of(Wallet.BONUS),
+                active_bonus_wallets=models.Count(models.Case(models.When(currency=Wallet.BONUS,
+                                                                          then=models.F('pk')))),
+            )
+            for field, value in summary.items():
+                setattr(customer, field, value or 0)
+            self.filter(pk=customer.pk).update(wallet_version=models.F('wallet_version') + 1,
+                                               **{field: getattr(customer, field) for field in summary})
 
 
 class Customer(models.Model):
-    """Additional data for user"""
+    """Additional data for user
+
+    Summary of active wallets is maintained by WalletManager and game services, so pages do not load wallets.
+    Wallet version is bumped by every wallet change and keys cached wallet table.
+    """
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     overall_spent_money = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    euro_balance = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    bonus_balance = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    active_bonus_wallets = models.IntegerField(default=0)
+    wallet_version = models.IntegerField(default=0)
+
+    objects = CustomerManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_spent_money = dict(zip(field_names, values)).get('overall_spent_money')
+        return instance
+
+    @property
+    def spent_money_changed(self):
+        """Whether overall spent money differs from value loaded from database"""
+        return self.overall_spent_money != getattr(self, '_loaded_spent_money', None)
 
     def __str__(self):
         return self.user.get_username()
@@ -49,33 +125,122 @@ class WalletManager(models.Manager):
             defaults={'amount': 0, 'wagering_requirement': 0},
         )[0]
 
-    def with_amount_first(self, customer, amount):
-        """Return first wallet containing amount"""
-        euro_wallet = self.euro_wallet_get(customer)
-        if euro_wallet.amount >= amount:
-            return euro_wallet
-        return self._bonus_wallets_qs(customer).filter(depleted=False, amount__gte=amount).order_by('created').first()
+    @staticmethod
+    def _euro_first():
+        return models.Case(
+            models.When(currency=Wallet.EURO, then=models.Value(0)),
+            default=models.Value(1),
+            output_field=models.IntegerField(),
+        )
+
+    def in_bet_order(self, customer, for_update=False):
+        """Return active wallets in order bets take money from them, Euro wallet first"""
+        queryset = self.select_for_update() if for_update else self.all()
+        return queryset.filter(customer=customer, depleted=False).order_by(self._euro_first(), 'created')
+
+    def with_amount_first(self, customer, amount, for_update=False):
+        """Return first wallet containing amount, Euro wallet takes precedence"""
+        return self.in_bet_order(customer, for_update).filter(amount__gte=amount).first()
 
     def ready_to_wage_all(self, customer):
         """Return wallets qualified for wagering"""
-        spent_money_q = customer.overall_spent_money - models.F('amount') * models.F('wagering_requirement')
+        # Half a cent absorbs floating point arithmetic of SQLite, so wallet is ready exactly at its threshold
+        spent_money = customer.overall_spent_money + HALF_CENT
+        spent_money_q = spent_money - models.F('amount') * models.F('wagering_requirement')
         return self._bonus_wallets_qs(customer).filter(depleted=False, spent_money_on_start__lte=spent_money_q).all()
 
-    def sorted_all(self, customer):
+    def add_amount(self, wallet, amount, kind, **summary):
+        """Add amount to wallet and record it in ledger, returns whether wallet had enough money
+
+        Negative amount is taken by conditional update only when wallet still has it, so concurrent withdrawals
+        never overdraw wallet. Wallet amount is refreshed in place in both cases. Customer summary is updated with
+        amount and extra summary deltas in the same query, caller holds customer lock, see CustomerManager.lock.
+        """
+        with transaction.atomic(savepoint=False):
+            queryset = self.filter(pk=wallet.pk)
+            updated = (queryset.filter(amount__gte=-amount) if amount < 0 else queryset) \
+                .update(amount=models.F('amount') + amount)
+            wallet.amount = queryset.values_list('amount', flat=True).get()
+            if not updated:
+                return False
+            LedgerEntry.objects.create(wallet=wallet, kind=kind, delta=amount, balance=wallet.amount)
+            balance_field = 'bonus_balance' if wallet.is_bonus else 'euro_balance'
+            summary[balance_field] = summary.get(balance_field, 0) + amount
+            Customer.objects.add_to(wallet.customer_id, wallet_version=1, **summary)
+        return True
+
+    def create_from_bonuses(self, customer, bonuses):
+        """Create wallets with money from bonuses and record them in ledger"""
+        with transaction.atomic(savepoint=False):
+            wallets = self.bulk_create([Wallet.from_bonus(bonus, customer) for bonus in bonuses])
+            if wallets and wallets[0].pk is None:
+                # Backends like SQLite do not return ids of bulk inserted rows, these are the latest ones
+                wallets = list(reversed(self.filter(customer=customer).order_by('-pk')[:len(wallets)]))
+            LedgerEntry.objects.bulk_create(
+                LedgerEntry(wallet=wallet, kind=LedgerEntry.BONUS, delta=wallet.amount, balance=wallet.amount)
+                for wallet in wallets
+            )
+            if wallets:
+                Customer.objects.add_to(customer.pk, bonus_balance=sum(wallet.amount for wallet in wallets),
+                                        active_bonus_wallets=len(wallets), wallet_version=1)
+        return wallets
+
+    def wage_all(self, customer):
+        """Move money from wallets qualified for wagering to Euro wallet, returns moved amount"""
+        with transaction.atomic(savepoint=False):
+            wallets = list(self.ready_to_wage_all(customer).select_for_update().values_list('pk', 'amount'))
+            if not wallets:
+                return 0
+            total = sum(amount for _, amount in wallets)
+            self.filter(pk__in=[pk for pk, _ in wallets]).update(amount=0, depleted=True)
+            LedgerEntry.objects.bulk_create(
+                LedgerEntry(wallet_id=pk, kind=LedgerEntry.WAGE, delta=-amount, balance=0) for pk, amount in wallets
+            )
+            self.add_amount(self.euro_wallet_get(customer), total, LedgerEntry.WAGE,
+                            bonus_balance=-total, active_bonus_wallets=-len(wallets))
+        return total
+
+    def archive_depleted(self, created_before, batch_size=1000, after_pk=0):
+        """Move batch of depleted wallets created before date and after pk to archive
+
+        Returns number of archived wallets and pk to continue after, every batch runs in own short transaction.
+        """
+        with transaction.atomic():
+            batch = self.filter(pk__gt=after_pk, depleted=True, created__lt=created_before).order_by('pk')
+            wallets = list(batch.select_for_update().values_list('pk', 'customer_id')[:batch_size])
+            if not wallets:
+                return 0, after_pk
+            WalletArchive.objects.copy_from(batch.filter(pk__lte=wallets[-1][0]))
+            # Delete without collector, which would load wallets again and send post_delete for each of them
+            DeleteQuery(self.model).delete_batch([pk for pk, _ in wallets], self.db)
+            Customer.objects.filter(pk__in={customer_id for _, customer_id in wallets}) \
+                .update(wallet_version=models.F('wallet_version') + 1)
+        return len(wallets), wallets[-1][0]
+
+    def sorted_all(self, customer, include_depleted=False):
         """Get wallets, Euro is always first"""
-        yield self.euro_wallet_get(customer)
-        for wallet in self._bonus_wallets_qs(customer).order_by('created').all():
-            yield wallet
+        self.euro_wallet_get(customer)
+        queryset = self.filter(customer=customer)
+        if not include_depleted:
+            queryset = queryset.filter(depleted=False)
+        return queryset.order_by(self._euro_first(), 'created')
 
 
 class Wallet(BaseWallet):
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
     created = models.DateTimeField(auto_now_add=True)
     spent_money_on_start = models.DecimalField(max_digits=20, decimal_places=2, default=0)
     depleted = models.BooleanField(default=False)
 
     objects = WalletManager()
 
+    class Meta:
+        # Single active Euro wallet per customer is enforced by partial unique index created in migration 0002
+        index_together = [
+            ('customer', 'depleted', 'created'),
+            ('customer', 'created'),
+        ]
+
     def clean_amount(self):
         if self.amount < 0:
             raise ValidationError({'amount': 'Cannot be negative'})
@@ -88,10 +253,190 @@ class Wallet(BaseWallet):
             self.spent_money_on_start = self.customer.overall_spent_money
         return super().save(*args, **kwargs)
 
+    @classmethod
+    def from_bonus(cls, bonus, customer):
+        """Unsaved wallet with money from bonus"""
+        wallet = cls(customer=customer, spent_money_on_start=customer.overall_spent_money)
+        for field in BaseWallet._meta.fields:
+            setattr(wallet, field.name, getattr(bonus, field.name))
+        return wallet
+
+
+class WalletArchiveManager(models.Manager):
+    COPIED_FIELDS = ('id', 'amount', 'currency', 'wagering_requirement', 'customer_id', 'created',
+                     'spent_money_on_start')
+
+    def copy_from(self, wallets):
+        """Copy wallets queryset to archive with single INSERT ... SELECT, rows are not loaded to Python"""
+        archived = models.Value(timezone.now(), output_field=models.DateTimeField())
+        sql, params = wallets.annotate(archived_at=archived).values_list(*self.COPIED_FIELDS + ('archived_at',)) \
+            .order_by().query.sql_with_params()
+        connection = connections[self.db]
+        columns = [self.model._meta.get_field(name).column for name in self.COPIED_FIELDS + ('archived',)]
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO {} ({}) {}'.format(
+                connection.ops.quote_name(self.model._meta.db_table),
+                ', '.join(connection.ops.quote_name(column) for column in columns),
+                sql,
+            ), params)
+
+
+class WalletArchive(BaseWallet):
+    """Depleted wallet moved out of Wallet table by compact_wallets command, keeps id of wallet"""
+    id = models.IntegerField(primary_key=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
+    created = models.DateTimeField()
+    spent_money_on_start = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    archived = models.DateTimeField(auto_now_add=True)
+
+    objects = WalletArchiveManager()
+
+    class Meta:
+        index_together = [
+            ('customer', 'created'),
+        ]
+
+    def __str__(self):
+        return "{}: {} {} (archived)".format(self.customer.user.get_username(), self.amount, self.currency)
+
+
+
+class LedgerEntryManager(models.Manager):
+    def balances(self, wallet_ids):
+        """Return wallet balances computed from ledger"""
+        return dict(
+            self.filter(wallet_id__in=wallet_ids).values('wallet_id').annotate(total=models.Sum('delta'))
+            .values_list('wallet_id', 'total')
+        )
+
+
+class LedgerEntry(models.Model):
+    """Append-only record of wallet amount change"""
+    OPEN = 'open'
+    DEPOSIT = 'deposit'
+    WITHDRAW = 'withdraw'
+    BET = 'bet'
+    BONUS = 'bonus'
+    WAGE = 'wage'
+    KIND_CHOICES = (
+        (OPEN, 'Opening balance'),
+        (DEPOSIT, 'Deposit'),
+        (WITHDRAW, 'Withdraw'),
+        (BET, 'Bet'),
+        (BONUS, 'Bonus'),
+        (WAGE, 'Bonus wagered'),
+    )
+
+    # Entries of archived wallets are kept, their wallet_id is id of WalletArchive
+    wallet = models.ForeignKey(Wallet, on_delete=models.DO_NOTHING, db_index=False, db_constraint=False)
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    delta = models.DecimalField(max_digits=20, decimal_places=2)
+    balance = models.DecimalField(max_digits=20, decimal_places=2)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = LedgerEntryManager()
+
+    class Meta:
+        index_together = [
+            ('wallet', 'id'),
+        ]
+        verbose_name_plural = 'ledger entries'
+
+    def __str__(self):
+        return "{}: {} {}".format(self.kind, self.delta, self.wallet.currency)
+
+
+class IdempotencyKeyReused(Exception):
+    """Idempotency key of operation was already used with different arguments"""
+
+
+class IdempotencyKeyManager(models.Manager):
+    def expired(self):
+        return self.filter(created__lt=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL))
+
+    @staticmethod
+    def arguments_hash(arguments):
+        return hashlib.sha256(json.dumps(arguments, cls=DjangoJSONEncoder, sort_keys=True).encode()).hexdigest()
+
+    def run(self, customer, operation, key, arguments, func, decode=None):
+        """Call func once for customer, operation and key, until key expires repeated calls return stored result
+
+        Key row is inserted before func runs, concurrent call with the same key waits for it on unique index.
+        Result is stored as JSON with hash of arguments, decode converts it back to func return value. Repeated
+        call with different arguments raises IdempotencyKeyReused.
+        """
+        arguments_hash = self.arguments_hash(arguments)
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    entry = self.create(customer=customer, operation=operation, key=key,
+                                        arguments_hash=arguments_hash)
+            except IntegrityError:
+                entry = self.select_for_update().get(customer=customer, operation=operation, key=key)
+                if entry.created >= timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL):
+                    if entry.arguments_hash != arguments_hash:
+                        raise IdempotencyKeyReused(key)
+                    result = json.loads(entry.result)
+                    return decode(result) if decode else result
+                entry.created = timezone.now()
+                entry.arguments_hash = arguments_hash
+            result = func()
+            entry.result = json.dumps(result, cls=DjangoJSONEncoder)
+            entry.save()
+        return result
+
+
+class IdempotencyKey(models.Model):
+    """Result of operation requested with client provided key, so retried request does not repeat it"""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
+    operation = models.CharField(max_length=32)
+    key = models.CharField(max_length=64)
+    arguments_hash = models.CharField(max_length=64)
+    result = models.TextField(default='null')
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = IdempotencyKeyManager()
+
+    class Meta:
+        unique_together = [
+            ('customer', 'operation', 'key'),
+        ]
+
+    def __str__(self):
+        return "{}: {}".format(self.key, self.result)
+
 
 class BonusManager(models.Manager):
+    VERSION_CACHE_KEY = 'casino:bonus:version'
+
+    def __init__(self):
+        super().__init__()
+        self._rules = None
+
+    def _rules_index(self):
+        """Bonuses grouped by action and sorted by min_amount, rebuilt when shared version changes"""
+        version = cache.get(self.VERSION_CACHE_KEY)
+        if version is None:
+            cache.add(self.VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+            version = cache.get(self.VERSION_CACHE_KEY)
+        rules = self._rules
+        if rules is None or rules[0] != version:
+            index = {}
+            for bonus in self.order_by('min_amount', 'pk'):
+                min_amounts, bonuses = index.setdefault(bonus.action, ([], []))
+                min_amounts.append(bonus.min_amount)
+                bonuses.append(bonus)
+            rules = self._rules = (version, index)
+        return rules[1]
+
+    def invalidate(self):
+        """Force rebuilding bonus rules in all processes"""
+        cache.set(self.VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
     def for_action(self, name, amount):
-        return self.filter(action=name, min_amount__lte=amount)
+        """Return list of bonuses for action with min_amount up to amount"""
+        min_amounts, bonuses = self._rules_index().get(name, ((), ()))
+        return bonuses[:bisect.bisect_right(min_amounts, amount)]
 
 
 class Bonus(BaseWallet):
@@ -120,3 +465,38 @@ class Bonus(BaseWallet):
 
     class Meta:
         verbose_name_plural = 'bonuses'
+
+
+class BonusEventManager(models.Manager):
+    def pending(self, max_attempts):
+        """Events waiting for bonus worker, oldest first"""
+        return self.filter(processed=None, attempts__lt=max_attempts).order_by('pk')
+
+    def stats(self, max_attempts):
+        """Backlog of bonus worker: counts of pending and failed events, age of oldest pending event in seconds"""
+        oldest = self.pending(max_attempts).values_list('created', flat=True).first()
+        return {
+            'pending': self.pending(max_attempts).count(),
+            'failed': self.filter(processed=None, attempts__gte=max_attempts).count(),
+            'lag': (timezone.now() - oldest).total_seconds() if oldest else 0,
+        }
+
+
+class BonusEvent(models.Model):
+    """Outbox of actions qualifying for bonuses, recorded in transaction of action and applied by bonus worker"""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
+    action = models.CharField(max_length=7, choices=Bonus.ACTION_CHOICES)
+    amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+
+    objects = BonusEventManager()
+
+    class Meta:
+        index_together = [
+            ('processed', 'id'),
+        ]
+
+    def __str__(self):
+        return "{}: {} {}".format(self.action, self.amount, 'processed' if self.processed else 'pending')
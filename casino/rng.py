@@ -0,0 +1,97 @@
+"""Random number generators for game outcomes
+
+Generators serve bits from a buffer refilled in bulk. Buffer is shared by threads of a process and guarded by lock.
+Buffers of non-reproducible generators are dropped after fork, so preforked workers never share outcomes.
+"""
+import abc
+import os
+import random
+import threading
+from django.conf import settings
+
+
+class BufferedRandom(metaclass=abc.ABCMeta):
+    """Base class for generators, subclasses provide _fill returning size random bytes"""
+    BUFFER_SIZE = 64 * 1024
+    reset_after_fork = True
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._buffer = b''
+        self._position = 0
+        self._pid = os.getpid()
+
+    @abc.abstractmethod
+    def _fill(self, size):
+        pass
+
+    def _after_fork(self):
+        pass
+
+    def getrandbits(self, k):
+        """Return non-negative int with k random bits"""
+        if not 0 < k <= self.buffer_size * 8:
+            raise ValueError('Number of bits must be between 1 and {}'.format(self.buffer_size * 8))
+        with self._lock:
+            if self.reset_after_fork and self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._buffer = b''
+                self._position = 0
+                self._after_fork()
+            if self._position + k > len(self._buffer) * 8:
+                self._buffer = self._fill(self.buffer_size)
+                self._position = 0
+            buffer, start = self._buffer, self._position
+            self._position += k
+        value = int.from_bytes(buffer[start >> 3:(start + k + 7) >> 3], 'little') >> (start & 7)
+        return value & ((1 << k) - 1)
+
+
+class StdlibRandom(BufferedRandom):
+    """Mersenne Twister from random module, reseeded from os.urandom in every process"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._random = random.Random()
+
+    def _after_fork(self):
+        self._random.seed()
+
+    def _fill(self, size):
+        return self._random.getrandbits(size * 8).to_bytes(size, 'little')
+
+
+class SystemRandom(BufferedRandom):
+    """Operating system entropy source, as used by secrets module"""
+    def _fill(self, size):
+        return os.urandom(size)
+
+
+class SeededRandom(StdlibRandom):
+    """Reproducible Mersenne Twister for replays, state is kept across fork so use it in single process only"""
+    reset_after_fork = False
+
+    def __init__(self, seed, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._random.seed(seed)
+
+
+BACKENDS = {
+    'stdlib': StdlibRandom,
+    'system': SystemRandom,
+    'seeded': SeededRandom,
+}
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_rng():
+    """Return process wide generator configured with GAME_RNG and GAME_RNG_SEED settings"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                backend = BACKENDS[settings.GAME_RNG]
+                _default = backend(settings.GAME_RNG_SEED) if backend is SeededRandom else backend()
+    return _default
@@ -0,0 +1,122 @@
+"""Generator of large synthetic datasets of users, customers and wallets for scale testing
+
+Rows are generated in chunks of customers and loaded with executemany, or COPY on PostgreSQL, so memory use does not
+depend on size of dataset. Models are bypassed: created dates are generated instead of auto_now_add and no signals
+are sent. Same seed, size and end date produce the same dataset.
+"""
+import csv
+import io
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from .models import Customer, LedgerEntry, Wallet
+
+USER_FIELDS = ('id', 'password', 'last_login', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+               'is_staff', 'is_active', 'date_joined')
+CUSTOMER_FIELDS = ('id', 'user', 'overall_spent_money', 'euro_balance', 'bonus_balance', 'active_bonus_wallets',
+                   'wallet_version')
+WALLET_FIELDS = ('id', 'customer', 'amount', 'currency', 'wagering_requirement', 'created', 'spent_money_on_start',
+                 'depleted')
+LEDGER_FIELDS = ('wallet', 'kind', 'delta', 'balance', 'created')
+
+BONUS_AMOUNTS = (5, 10, 10, 20, 20, 50, 100)
+WAGERING_REQUIREMENTS = (1, 5, 10, 20, 35)
+CENT = Decimal('0.01')
+
+
+class Distribution(object):
+    """Parameters of generated customers"""
+    def __init__(self, bonus_wallets=5, depleted_ratio=0.8, median_spent=200, median_balance=20, days=365):
+        self.bonus_wallets = bonus_wallets
+        self.depleted_ratio = depleted_ratio
+        self.median_spent = median_spent
+        self.median_balance = median_balance
+        self.days = days
+
+
+def _money(value):
+    return Decimal(value).quantize(CENT)
+
+
+def _next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def generate_customer(rnd, distribution, end):
+    """Return joined date, overall spent money and list of wallets (created, currency, amount, wagering requirement,
+    spent money on start, depleted), first one is Euro wallet"""
+    joined = end - timedelta(seconds=rnd.uniform(0, distribution.days * 24 * 3600))
+    spent = _money(rnd.lognormvariate(math.log(distribution.median_spent), 1.5))
+    wallets = [(joined, Wallet.EURO, _money(rnd.lognormvariate(math.log(distribution.median_balance), 1.2)), 0,
+                Decimal(0), False)]
+    # Exponential number of bonus wallets, most customers have few and some have hundreds
+    count = min(int(rnd.expovariate(1 / distribution.bonus_wallets)), 50 * distribution.bonus_wallets) \
+        if distribution.bonus_wallets else 0
+    lifetime = (end - joined).total_seconds()
+    for created in sorted(joined + timedelta(seconds=rnd.uniform(0, lifetime)) for _ in range(count)):
+        depleted = rnd.random() < distribution.depleted_ratio
+        wallets.append((created, Wallet.BONUS, Decimal(0) if depleted else Decimal(rnd.choice(BONUS_AMOUNTS)),
+                        rnd.choice(WAGERING_REQUIREMENTS), _money(rnd.uniform(0, float(spent))), depleted))
+    return joined, spent, wallets
+
+
+def _insert(cursor, model, fields, rows):
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    model_fields = [model._meta.get_field(name) for name in fields]
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(field.column) for field in model_fields)
+    if connection.vendor == 'postgresql':
+        stream = io.StringIO()
+        csv.writer(stream, quoting=csv.QUOTE_ALL).writerows(rows)
+        stream.seek(0)
+        nullable = [quote(field.column) for field in model_fields if field.null]
+        options = ', FORCE_NULL ({})'.format(', '.join(nullable)) if nullable else ''
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv{})'.format(table, columns, options), stream)
+    else:
+        cursor.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+            table, columns, ', '.join(['%s'] * len(fields))), rows)
+
+
+def seed_customers(customers, distribution, end, seed=0, batch_size=10000, prefix='seed', password=None,
+                   ledger=True):
+    """Create customers with users and wallets, yields numbers of customers, wallets and ledger entries of chunks"""
+    rnd = random.Random(seed)
+    password = make_password(password)
+    user_id, customer_id, wallet_id = _next_id(User), _next_id(Customer), _next_id(Wallet)
+
+    for start in range(0, customers, batch_size):
+        users, customer_rows, wallets, entries = [], [], [], []
+        for _ in range(min(batch_size, customers - start)):
+            joined, spent, customer_wallets = generate_customer(rnd, distribution, end)
+            users.append((user_id, password, None, False, '{}{}'.format(prefix, user_id), '', '', '', False, True,
+                          joined))
+            active = [amount for _, currency, amount, _, _, depleted in customer_wallets[1:] if not depleted]
+            customer_rows.append((customer_id, user_id, spent, customer_wallets[0][2], sum(active), len(active), 0))
+            for created, currency, amount, wagering, spent_on_start, depleted in customer_wallets:
+                wallets.append((wallet_id, customer_id, amount, currency, wagering, created, spent_on_start,
+                                depleted))
+                if ledger and amount:
+                    entries.append((wallet_id, LedgerEntry.OPEN, amount, amount, created))
+                wallet_id += 1
+            user_id += 1
+            customer_id += 1
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            _insert(cursor, User, USER_FIELDS, users)
+            _insert(cursor, Customer, CUSTOMER_FIELDS, customer_rows)
+            _insert(cursor, Wallet, WALLET_FIELDS, wallets)
+            _insert(cursor, LedgerEntry, LEDGER_FIELDS, entries)
+        yield len(customer_rows), len(wallets), len(entries)
+
+    # Explicit ids leave PostgreSQL sequences behind, SQLite follows inserted ids itself
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [User, Customer, Wallet, LedgerEntry]):
+            cursor.execute(sql)
@@ -1,88 +1,291 @@
 import abc
-import random
+import functools
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
 from django.db import transaction
-from .models import BaseWallet, Customer, Wallet
-from .signals import deposit
+from django.db.models import F
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .metrics import instrumented
+from .models import Bonus, BonusEvent, Customer, IdempotencyKey, LedgerEntry, Wallet
+from .rng import get_rng
+from .signals import deposit, spent
+
+
+logger = logging.getLogger(__name__)
+
+
+def idempotent(decode=None):
+    """Service method accepts idempotency_key argument, repeated call with the same key returns stored result
+
+    Keys are scoped by method name, repeated call with different arguments raises IdempotencyKeyReused.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, idempotency_key=None, **kwargs):
+            if idempotency_key is None:
+                return method(self, *args, **kwargs)
+            with transaction.atomic():
+                # Inserted key row references customer, so customer is locked first, see CustomerManager.lock
+                Customer.objects.lock(self.customer.pk)
+                return IdempotencyKey.objects.run(self.customer, method.__name__, idempotency_key, [args, kwargs],
+                                                  lambda: method(self, *args, **kwargs), decode)
+        return wrapper
+    return decorator
 
 
 class WalletService(object):
     """Service for operation on all user wallets"""
-    def __init__(self, user):
-        self.customer, _ = Customer.objects.get_or_create(user=user)
-        self.euro_wallet = Wallet.objects.euro_wallet_get(self.customer)
+    def __init__(self, user, customer=None):
+        self.customer = customer or Customer.objects.get_or_create(user=user)[0]
+
+    @cached_property
+    def euro_wallet(self):
+        return Wallet.objects.euro_wallet_get(self.customer)
 
+    @instrumented
     @transaction.atomic
+    def create_bonuses(self, bonuses):
+        """Add Euro bonuses to Euro wallet and create wallets for other bonuses"""
+        Customer.objects.lock(self.customer.pk)
+        euro_amount = sum(bonus.amount for bonus in bonuses if bonus.currency == Wallet.EURO)
+        if euro_amount:
+            Wallet.objects.add_amount(self.euro_wallet, euro_amount, LedgerEntry.BONUS)
+        Wallet.objects.create_from_bonuses(self.customer, [b for b in bonuses if b.currency != Wallet.EURO])
+
     def create_bonus(self, bonus):
-        if bonus.currency == Wallet.EURO:
-            self.euro_wallet.amount += bonus.amount
-            self.euro_wallet.save(update_fields=['amount'])
-        else:
-            wallet = Wallet(customer=self.customer)
-            for field in BaseWallet._meta.fields:
-                setattr(wallet, field.name, getattr(bonus, field.name))
-            wallet.save()
+        self.create_bonuses([bonus])
 
+    @instrumented
     @transaction.atomic
     def bonus_to_euro(self, bonus_wallet):
-        self.euro_wallet.amount += bonus_wallet.amount
+        Customer.objects.lock(self.customer.pk)
+        amount = bonus_wallet.amount
         bonus_wallet.depleted = True
         bonus_wallet.amount = 0
         bonus_wallet.save(update_fields=['amount', 'depleted'])
-        self.euro_wallet.save(update_fields=['amount'])
+        LedgerEntry.objects.create(wallet=bonus_wallet, kind=LedgerEntry.WAGE, delta=-amount, balance=0)
+        Wallet.objects.add_amount(self.euro_wallet, amount, LedgerEntry.WAGE,
+                                  bonus_balance=-amount, active_bonus_wallets=-1)
 
+    @instrumented
+    @idempotent()
     @transaction.atomic
     def deposit(self, amount):
-        self.euro_wallet.amount += amount
-        self.euro_wallet.save(update_fields=['amount'])
+        Customer.objects.lock(self.customer.pk)
+        Wallet.objects.add_amount(self.euro_wallet, amount, LedgerEntry.DEPOSIT)
         deposit.send(sender=self.__class__, wallet_service=self, amount=amount)
 
+    @instrumented
+    @idempotent()
     @transaction.atomic
     def withdraw(self, amount):
-        if self.euro_wallet.amount < amount:
-            return False
-        self.euro_wallet.amount -= amount
-        self.euro_wallet.save(update_fields=['amount'])
-        return True
+        """Take amount from Euro wallet unless it has less, checked by database rather than cached wallet"""
+        Customer.objects.lock(self.customer.pk)
+        return Wallet.objects.add_amount(self.euro_wallet, -amount, LedgerEntry.WITHDRAW)
 
     def ready_to_wage_all(self):
         return Wallet.objects.ready_to_wage_all(self.customer)
 
-    def sorted_all(self):
-        return Wallet.objects.sorted_all(self.customer)
+    def sorted_all(self, include_depleted=False):
+        return Wallet.objects.sorted_all(self.customer, include_depleted)
+
+
+class BonusWorker(object):
+    """Applies bonuses for events from outbox, see BONUS_OUTBOX setting
+
+    Events are marked processed in transaction applying their bonuses, so every event is applied once even when
+    worker is restarted or runs in many processes. Failed event is retried until it reaches max attempts.
+    """
+    def __init__(self, batch_size=100, max_attempts=None):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts or settings.BONUS_EVENT_MAX_ATTEMPTS
+
+    @transaction.atomic
+    def process_batch(self):
+        """Apply bonuses for batch of pending events, returns number of processed and failed events"""
+        events = list(BonusEvent.objects.pending(self.max_attempts).select_for_update().select_related('customer')
+                      [:self.batch_size])
+        processed, failed = [], []
+        for event in events:
+            try:
+                with transaction.atomic():
+                    bonuses = Bonus.objects.for_action(event.action, event.amount)
+                    if bonuses:
+                        WalletService(None, customer=event.customer).create_bonuses(bonuses)
+                processed.append(event.pk)
+            except Exception:
+                logger.exception('Applying bonuses for event %s failed', event.pk)
+                failed.append(event.pk)
+        BonusEvent.objects.filter(pk__in=processed).update(processed=timezone.now())
+        BonusEvent.objects.filter(pk__in=failed).update(attempts=F('attempts') + 1)
+        return len(processed), len(failed)
+
+    def purge(self):
+        """Delete events processed longer than BONUS_EVENT_RETENTION_DAYS ago"""
+        before = timezone.now() - timedelta(days=settings.BONUS_EVENT_RETENTION_DAYS)
+        return BonusEvent.objects.filter(processed__lt=before).delete()[0]
+
+    def stats(self):
+        return BonusEvent.objects.stats(self.max_attempts)
 
 
 class BaseGameService(metaclass=abc.ABCMeta):
-    """Base class for future games"""
-    def __init__(self, user):
-        self.customer, _ = Customer.objects.get_or_create(user=user)
+    """Base class for future games, game_logic should draw random numbers from rng"""
+    _rng = None
 
+    def __init__(self, user, customer=None, rng=None):
+        self.customer = customer or Customer.objects.get_or_create(user=user)[0]
+        self._rng = rng
+
+    @property
+    def rng(self):
+        return self._rng or get_rng()
+
+    @instrumented
+    @idempotent(decode=lambda result: (Decimal(result[0]), result[1]))
     @transaction.atomic
     def bet(self, amount):
-        wallet = Wallet.objects.with_amount_first(self.customer, amount)
+        # Customer is locked before wallets, see CustomerManager.lock
+        self.customer = Customer.objects.select_for_update().get(pk=self.customer.pk)
+        wallet = Wallet.objects.with_amount_first(self.customer, amount, for_update=True)
         if wallet is None:
             return 0, "Not enough money"
 
         amount_change, status = self.game_logic(amount)
         wallet.amount += amount_change
-        wallet.save()
-        self.customer.overall_spent_money += amount
-        self.customer.save()
+        wallet.depleted = wallet.is_bonus and wallet.amount <= 0
+        Wallet.objects.filter(pk=wallet.pk).update(amount=F('amount') + amount_change, depleted=wallet.depleted)
+        LedgerEntry.objects.create(wallet=wallet, kind=LedgerEntry.BET, delta=amount_change, balance=wallet.amount)
+        summary = {
+            'overall_spent_money': amount,
+            'bonus_balance' if wallet.is_bonus else 'euro_balance': amount_change,
+            'active_bonus_wallets': -1 if wallet.depleted else 0,
+            'wallet_version': 1,
+        }
+        Customer.objects.add_to(self.customer.pk, **summary)
+        for field, delta in summary.items():
+            setattr(self.customer, field, getattr(self.customer, field) + delta)
+        spent.send(sender=self.__class__, customer=self.customer, amount=amount)
 
         return amount_change, status
 
+    @instrumented
+    @idempotent(decode=lambda results: [(Decimal(change), status) for change, status in results])
+    @transaction.atomic
+    def bet_many(self, amounts):
+        """Place bets in order in single transaction, returns list of bet results
+
+        Wallets are loaded once and walked in memory by rules of with_amount_first and ready_to_wage_all, outcomes
+        are drawn only for placed bets, so results, wallets and ledger match sequential bet calls. Changed wallets,
+        ledger entries and customer summary are written at the end, spent is sent once with total amount.
+        """
+        # Customer is locked before wallets, see CustomerManager.lock
+        self.customer = Customer.objects.select_for_update().get(pk=self.customer.pk)
+        wallets = list(Wallet.objects.in_bet_order(self.customer, for_update=True))
+        euro_wallet = wallets[0] if wallets and not wallets[0].is_bonus else None
+        loaded = {wallet.pk: wallet.amount for wallet in wallets}
+        changed = {}
+        spent_money = self.customer.overall_spent_money
+        summary = dict.fromkeys(
+            ('overall_spent_money', 'euro_balance', 'bonus_balance', 'active_bonus_wallets', 'wallet_version'), 0)
+        entries, results = [], []
+
+        def release_at(wallet):
+            # Spent money from which ready_to_wage_all includes wallet
+            return wallet.spent_money_on_start + wallet.amount * wallet.wagering_requirement
+
+        next_release = min((release_at(w) for w in wallets if w.is_bonus), default=None)
+        for amount in amounts:
+            wallet = next((w for w in wallets if w.amount >= amount), None)
+            if wallet is None:
+                results.append((0, "Not enough money"))
+                continue
+
+            amount_change, status = self.game_logic(amount)
+            results.append((amount_change, status))
+            wallet.amount += amount_change
+            wallet.depleted = wallet.is_bonus and wallet.amount <= 0
+            changed[wallet.pk] = wallet
+            entries.append(LedgerEntry(wallet=wallet, kind=LedgerEntry.BET, delta=amount_change,
+                                       balance=wallet.amount))
+            spent_money += amount
+            summary['overall_spent_money'] += amount
+            summary['bonus_balance' if wallet.is_bonus else 'euro_balance'] += amount_change
+            summary['wallet_version'] += 1
+            if wallet.depleted:
+                summary['active_bonus_wallets'] -= 1
+                wallets.remove(wallet)
+            if wallet.is_bonus:
+                next_release = min((release_at(w) for w in wallets if w.is_bonus), default=None)
+
+            # Same as Wallet.objects.wage_all called on spent signal
+            if next_release is None or spent_money < next_release:
+                continue
+            ready = [w for w in wallets if w.is_bonus and spent_money >= release_at(w)]
+            total = sum(w.amount for w in ready)
+            for bonus_wallet in ready:
+                entries.append(LedgerEntry(wallet=bonus_wallet, kind=LedgerEntry.WAGE, delta=-bonus_wallet.amount,
+                                           balance=0))
+                bonus_wallet.amount = 0
+                bonus_wallet.depleted = True
+                changed[bonus_wallet.pk] = bonus_wallet
+                wallets.remove(bonus_wallet)
+            if euro_wallet is None:
+                euro_wallet = Wallet.objects.euro_wallet_get(self.customer)
+                loaded[euro_wallet.pk] = euro_wallet.amount
+                wallets.insert(0, euro_wallet)
+            euro_wallet.amount += total
+            changed[euro_wallet.pk] = euro_wallet
+            entries.append(LedgerEntry(wallet=euro_wallet, kind=LedgerEntry.WAGE, delta=total,
+                                       balance=euro_wallet.amount))
+            summary['euro_balance'] += total
+            summary['bonus_balance'] -= total
+            summary['active_bonus_wallets'] -= len(ready)
+            summary['wallet_version'] += 1
+            next_release = min((release_at(w) for w in wallets if w.is_bonus), default=None)
+
+        for wallet in changed.values():
+            Wallet.objects.filter(pk=wallet.pk).update(amount=F('amount') + (wallet.amount - loaded[wallet.pk]),
+                                                       depleted=wallet.depleted)
+        LedgerEntry.objects.bulk_create(entries)
+        Customer.objects.add_to(self.customer.pk, **summary)
+        for field, delta in summary.items():
+            setattr(self.customer, field, getattr(self.customer, field) + delta)
+        if summary['overall_spent_money']:
+            spent.send(sender=self.__class__, customer=self.customer, amount=summary['overall_spent_money'])
+
+        return results
+
     @abc.abstractmethod
     def game_logic(self, amount):
         pass
 
+    def simulate_outcomes(self, amounts, random_state):
+        """Return array of amount changes for array of bets, used by casino.simulation
+
+        Default implementation calls game_logic for every bet, games should override it with vectorized draws
+        from numpy random_state.
+        """
+        changes = amounts.copy()
+        for index, amount in enumerate(amounts):
+            changes[index] = self.game_logic(amount)[0]
+        return changes
+
 
 class SimpleGame(BaseGameService):
     """Game class example"""
-    @staticmethod
-    def _check_win():
-        return bool(random.getrandbits(1))
+    def _check_win(self):
+        return bool(self.rng.getrandbits(1))
 
     def game_logic(self, amount):
         if self._check_win():
             return amount, 'You won'
         else:
             return -amount, 'You lose'
+
+    def simulate_outcomes(self, amounts, random_state):
+        wins = random_state.randint(0, 2, size=len(amounts))
+        return amounts * (2 * wins - 1)
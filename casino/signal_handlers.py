@@ -1,24 +1,38 @@
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in
-from django.db.models.signals import pre_save, post_save
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_migrate, pre_save
 from django.dispatch import receiver
+from . import auth
 from .services import WalletService
-from .models import Bonus, Customer, Wallet
-from .signals import deposit
+from .models import Bonus, BonusEvent, Customer, Wallet
+from .signals import deposit, spent
 
 
 @receiver(user_logged_in)
 def on_logged_in(sender, user, request, **kwargs):
-    """Event user logged in"""
-    wallet_service = WalletService(user)
-    for bonus in Bonus.objects.for_action(Bonus.LOGIN, 0).all():
-        wallet_service.create_bonus(bonus)
+    """Event user logged in, bonuses are applied or left for bonus worker"""
+    if settings.BONUS_OUTBOX:
+        wallet_service = getattr(request, 'wallet_service', None) or WalletService(user)
+        BonusEvent.objects.create(customer=wallet_service.customer, action=Bonus.LOGIN)
+        return
+    bonuses = Bonus.objects.for_action(Bonus.LOGIN, 0)
+    if bonuses:
+        wallet_service = getattr(request, 'wallet_service', None) or WalletService(user)
+        wallet_service.create_bonuses(bonuses)
 
 
 @receiver(deposit)
 def on_deposit(sender, wallet_service, amount, **kwargs):
-    """Event user deposited money"""
-    for bonus in Bonus.objects.for_action(Bonus.DEPOSIT, amount).all():
-        wallet_service.create_bonus(bonus)
+    """Event user deposited money, bonuses are applied or left for bonus worker in transaction of deposit"""
+    if settings.BONUS_OUTBOX:
+        BonusEvent.objects.create(customer=wallet_service.customer, action=Bonus.DEPOSIT, amount=amount)
+        return
+    bonuses = Bonus.objects.for_action(Bonus.DEPOSIT, amount)
+    if bonuses:
+        wallet_service.create_bonuses(bonuses)
 
 
 @receiver(pre_save, sender=Wallet)
@@ -28,9 +42,70 @@ def on_wallet_update(sender, instance, **kwargs):
         instance.depleted = True
 
 
+@receiver(post_save, sender=Wallet)
+@receiver(post_delete, sender=Wallet)
+def on_wallet_saved(sender, instance, raw=False, **kwargs):
+    """On wallet saved or deleted outside of WalletManager updates make cached wallet table of customer stale"""
+    if not raw:
+        Customer.objects.add_to(instance.customer_id, wallet_version=1)
+
+
 @receiver(post_save, sender=Customer)
-def on_customer_update(sender, instance, **kwargs):
-    """On customer update checks if any bonus wallet can be waged"""
-    wallet_service = WalletService(instance.user)
-    for wallet in wallet_service.ready_to_wage_all():
-        wallet_service.bonus_to_euro(wallet)
+def on_customer_update(sender, instance, created=False, raw=False, **kwargs):
+    """On customer spent money change moves waged bonus wallets to Euro wallet"""
+    if created or raw or not instance.spent_money_changed:
+        return
+    Wallet.objects.wage_all(instance)
+    instance._loaded_spent_money = instance.overall_spent_money
+
+
+@receiver(spent)
+def on_spent(sender, customer, amount, **kwargs):
+    """Event customer placed a bet, moves waged bonus wallets to Euro wallet"""
+    Wallet.objects.wage_all(customer)
+
+
+@receiver(post_save, sender=Bonus)
+@receiver(post_delete, sender=Bonus)
+def on_bonus_update(sender, instance, **kwargs):
+    """On bonus change invalidates cached bonus rules, again after commit so no process caches old rows"""
+    Bonus.objects.invalidate()
+    transaction.on_commit(Bonus.objects.invalidate)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def on_user_saved(sender, instance, **kwargs):
+    """On user change drops user from cache of authenticated users of this process"""
+    auth.invalidate(instance.pk)
+
+
+@receiver(connection_created)
+def on_connection_created(sender, connection, **kwargs):
+    """On SQLite connection applies SQLITE_PRAGMAS setting"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def _set_legacy_alter_table(using, value):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA legacy_alter_table = {}'.format(value))
+
+
+@receiver(pre_migrate)
+def on_pre_migrate(sender, using, **kwargs):
+    """Before SQLite migrations keeps table rebuilds from pointing foreign keys of other tables to renamed table
+
+    Django 1.10 renames rebuilt table to __old, SQLite 3.26+ rewrites references to it in other tables.
+    """
+    _set_legacy_alter_table(using, 'ON')
+
+
+@receiver(post_migrate)
+def on_post_migrate(sender, using, **kwargs):
+    """After SQLite migrations returns connection to default table renaming"""
+    _set_legacy_alter_table(using, 'OFF')
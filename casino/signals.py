@@ -2,3 +2,6 @@ from django.dispatch import Signal
 
 deposit = Signal(providing_args=['wallet_service', 'amount'])
 """Signal emitted after user deposits money on wallet"""
+
+spent = Signal(providing_args=['customer', 'amount'])
+"""Signal emitted after customer placed a bet"""
@@ -0,0 +1,108 @@
+"""Monte Carlo simulation of games and bonus wagering, runs in memory without database
+
+Every simulated player logs in, deposits money, receives matching bonuses (login bonuses first) and places equal
+bets until rounds run out or money is gone. Wallet selection follows WalletManager.with_amount_first and bonus
+release follows WalletManager.ready_to_wage_all. Money is kept in integer cents.
+"""
+from multiprocessing import Pool
+import numpy as np
+from django.utils.module_loading import import_string
+from .models import Bonus, Customer
+from .rng import SeededRandom
+
+
+class SimulationResult(object):
+    FIELDS = ('players', 'bets', 'wagered', 'returned', 'euro_bonuses', 'bonus_wallets', 'released',
+              'released_amount', 'balance', 'busted')
+
+    def __init__(self, **kwargs):
+        for field in self.FIELDS:
+            setattr(self, field, int(kwargs.get(field, 0)))
+
+    def __add__(self, other):
+        return SimulationResult(**{field: getattr(self, field) + getattr(other, field) for field in self.FIELDS})
+
+    @property
+    def rtp(self):
+        """Return to player, money returned from bets divided by money wagered"""
+        return self.returned / self.wagered if self.wagered else 0
+
+    @property
+    def house_edge(self):
+        return 1 - self.rtp if self.wagered else 0
+
+    @property
+    def release_rate(self):
+        return self.released / self.bonus_wallets if self.bonus_wallets else 0
+
+
+def _cents(value):
+    return int(round(value * 100))
+
+
+def simulate_chunk(game_path, catalogue, players, rounds, deposit, bet, seed):
+    """Simulate group of players with vectorized draws, returns SimulationResult"""
+    random_state = np.random.RandomState(seed)
+    game = import_string(game_path)(None, customer=Customer(), rng=SeededRandom(seed))
+    bonuses = [b for b in catalogue if b.action == Bonus.LOGIN and b.min_amount <= 0] + \
+        [b for b in catalogue if b.action == Bonus.DEPOSIT and b.min_amount <= deposit]
+    euro_bonus = sum(_cents(b.amount) for b in bonuses if b.currency == Bonus.EURO)
+    wallet_bonuses = [b for b in bonuses if b.currency != Bonus.EURO]
+
+    bet = _cents(bet)
+    euro = np.full(players, _cents(deposit) + euro_bonus, dtype=np.int64)
+    amounts = np.tile(np.array([_cents(b.amount) for b in wallet_bonuses], dtype=np.int64), (players, 1))
+    wagering = np.array([b.wagering_requirement for b in wallet_bonuses], dtype=np.int64)
+    depleted = np.zeros(amounts.shape, dtype=bool)
+    spent = np.zeros(players, dtype=np.int64)
+    rows = np.arange(players)
+    result = SimulationResult(players=players, euro_bonuses=players * euro_bonus, bonus_wallets=amounts.size)
+
+    for _ in range(rounds):
+        from_euro = euro >= bet
+        from_bonus = ~depleted & (amounts >= bet)
+        active = from_euro | from_bonus.any(axis=1)
+        count = int(active.sum())
+        if not count:
+            break
+
+        changes = np.zeros(players, dtype=np.int64)
+        changes[active] = game.simulate_outcomes(np.full(count, bet, dtype=np.int64), random_state)
+        euro += np.where(from_euro, changes, 0)
+        spent += np.where(active, bet, 0)
+        result.bets += count
+        result.wagered += count * bet
+        result.returned += count * bet + int(changes.sum())
+
+        if amounts.size:
+            on_bonus = active & ~from_euro
+            amounts[rows[on_bonus], from_bonus.argmax(axis=1)[on_bonus]] += changes[on_bonus]
+            depleted |= amounts <= 0
+            # Bonus wallets are created before first bet, so spent_money_on_start is 0
+            ready = ~depleted & (spent[:, np.newaxis] - amounts * wagering >= 0)
+            released = np.where(ready, amounts, 0)
+            euro += released.sum(axis=1)
+            result.released += int(ready.sum())
+            result.released_amount += int(released.sum())
+            amounts[ready] = 0
+            depleted |= ready
+
+    active_amounts = np.where(depleted, 0, amounts)
+    can_bet = (euro >= bet) | (active_amounts >= bet).any(axis=1)
+    result.balance = int(euro.sum() + active_amounts.sum())
+    result.busted = int((~can_bet).sum())
+    return result
+
+
+def simulate(game_path, catalogue, players, rounds, deposit, bet, seed=0, processes=None, chunk_size=100000):
+    """Simulate players split into chunks, chunks run in pool of processes unless processes is 1"""
+    chunks = [
+        (game_path, catalogue, min(chunk_size, players - start), rounds, deposit, bet, seed + index)
+        for index, start in enumerate(range(0, players, chunk_size))
+    ]
+    if processes == 1:
+        results = [simulate_chunk(*chunk) for chunk in chunks]
+    else:
+        with Pool(processes) as pool:
+            results = pool.starmap(simulate_chunk, chunks)
+    return sum(results, SimulationResult())
@@ -9,6 +9,7 @@ class WalletTable(Table):
 
     @classmethod
     def prepare(cls, request, wallet_service):
-        table = cls(wallet_service.sorted_all())
+        include_depleted = bool(request.GET.get('depleted'))
+        table = cls(wallet_service.sorted_all(include_depleted).select_related('customer__user'))
         RequestConfig(request).configure(table)
         return table
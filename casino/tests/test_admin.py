@@ -0,0 +1,34 @@
+from unittest.mock import Mock, patch
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+
+from .. import models
+
+
+class WalletAdminCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        self.admin = site._registry[models.Wallet]
+        self.request = RequestFactory().post('/', {'post': 'yes'})
+        self.request.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def _summary(self):
+        return models.Customer.objects.values_list('euro_balance', 'bonus_balance', 'active_bonus_wallets').get()
+
+    def test_save_refreshes_summary(self):
+        wallet = models.Wallet.objects.get(pk=3)
+        wallet.amount = 1
+        self.admin.save_model(self.request, wallet, Mock(initial={'customer': wallet.customer_id}), True)
+        self.assertEquals(self._summary(), (5, 11, 2))
+
+    def test_delete_refreshes_summary(self):
+        self.admin.delete_model(self.request, models.Wallet.objects.get(pk=3))
+        self.assertEquals(self._summary(), (5, 10, 1))
+
+    def test_delete_selected_refreshes_summary(self):
+        self.assertEquals(self.admin.get_actions(self.request)['delete_selected'][0], type(self.admin).delete_selected)
+        with patch.object(self.admin, 'message_user'):
+            self.assertIsNone(self.admin.delete_selected(self.request, models.Wallet.objects.filter(pk__in=[1, 3])))
+        self.assertEquals(self._summary(), (0, 10, 1))
@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .. import models
+
+
+class ReconcileLedgerCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def _reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_ledger', *args, batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_reconcile(self):
+        models.LedgerEntry.objects.bulk_create(
+            models.LedgerEntry(wallet=wallet, kind=models.LedgerEntry.OPEN, delta=wallet.amount, balance=wallet.amount)
+            for wallet in models.Wallet.objects.all()
+        )
+        self.assertIn('Checked 4 wallets, 0 mismatched', self._reconcile())
+
+    def test_reconcile_fix(self):
+        wallet = models.Wallet.objects.get(pk=3)
+        models.LedgerEntry.objects.create(wallet=wallet, kind=models.LedgerEntry.OPEN, delta=1, balance=1)
+
+        self.assertIn('Checked 4 wallets, 3 mismatched', self._reconcile('--fix'))
+        self.assertEquals(models.Wallet.objects.get(pk=3).amount, Decimal('1'))
+        self.assertIn('Checked 4 wallets, 0 mismatched', self._reconcile())
+        customer = models.Customer.objects.get()
+        self.assertEquals((customer.euro_balance, customer.bonus_balance, customer.active_bonus_wallets), (0, 1, 1))
+
+
+class CompactWalletsCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def _compact(self, *args):
+        out = StringIO()
+        call_command('compact_wallets', *args, batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def test_compact(self):
+        models.Wallet.objects.filter(pk=4).update(depleted=True)
+        models.Wallet.objects.create(customer_id=1, amount=0, currency=models.Wallet.BONUS, wagering_requirement=1,
+                                     depleted=True)
+        wallet = models.Wallet.objects.get(pk=2)
+        models.LedgerEntry.objects.create(wallet=wallet, kind=models.LedgerEntry.BONUS, delta=1, balance=1)
+        version = models.Customer.objects.get().wallet_version
+
+        self.assertIn('Archived 2 wallets', self._compact('--days', '30'))
+        self.assertEquals(sorted(models.Wallet.objects.values_list('pk', flat=True)), [1, 3, 5])
+        archive = models.WalletArchive.objects.get(pk=2)
+        self.assertEquals((archive.currency, archive.spent_money_on_start, archive.created),
+                          (wallet.currency, wallet.spent_money_on_start, wallet.created))
+        self.assertEquals(models.LedgerEntry.objects.balances([2]), {2: Decimal('1')})
+        self.assertEquals(models.Customer.objects.get().wallet_version, version + 2)
+
+        self.assertIn('Archived 0 wallets', self._compact('--days', '30'))
+
+
+class PurgeIdempotencyKeysCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml']
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_purge(self):
+        now = timezone.now()
+        models.IdempotencyKey.objects.bulk_create(
+            models.IdempotencyKey(customer_id=1, key=str(age), created=now - timedelta(seconds=age))
+            for age in (0, 30, 90, 120, 150)
+        )
+        out = StringIO()
+        call_command('purge_idempotency_keys', batch_size=2, stdout=out)
+        self.assertIn('Deleted 3 expired idempotency keys', out.getvalue())
+        self.assertEquals(sorted(models.IdempotencyKey.objects.values_list('key', flat=True)), ['0', '30'])
+
+
+class RunBonusWorkerCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'bonuses.yaml']
+
+    def tearDown(self):
+        models.Bonus.objects.invalidate()
+
+    def test_run_once(self):
+        models.BonusEvent.objects.create(customer_id=1, action=models.Bonus.LOGIN)
+        models.BonusEvent.objects.create(customer_id=1, action=models.Bonus.DEPOSIT, amount=10)
+        out = StringIO()
+        call_command('run_bonus_worker', '--once', batch_size=1, stdout=out)
+
+        self.assertIn('Processed 2 events, 0 failed, 0 pending, 0 given up, lag 0.0s', out.getvalue())
+        self.assertEquals(models.Wallet.objects.count(), 2)
+
+
+class LoadtestCase(TestCase):
+    def test_loadtest(self):
+        directory = tempfile.mkdtemp()
+        scenario, output = os.path.join(directory, 'scenario.jsonl'), os.path.join(directory, 'result.json')
+        with open(scenario, 'w') as stream:
+            stream.write('{"action": "register"}\n{"action": "login"}\n{"action": "bet_api", "amount": "1.00"}\n')
+        out = StringIO()
+        call_command('loadtest', scenario, '--use-database', users=2, concurrency=1, output=output, stdout=out)
+
+        self.assertIn('Requests: 6, errors: 0', out.getvalue())
+        self.assertRegex(out.getvalue(), r'bet_api +2 +0 ')
+        with open(output) as stream:
+            self.assertEquals(json.load(stream)['actions']['login']['requests'], 2)
+        for name in (scenario, output):
+            os.unlink(name)
+        os.rmdir(directory)
+
+
+class SeedScaleCase(TestCase):
+    def _seed(self, *args):
+        out = StringIO()
+        call_command('seed_scale', '--customers', '50', '--batch-size', '20', '--end-date', '2016-11-01', *args,
+                     stdout=out)
+        return out.getvalue()
+
+    def test_seed(self):
+        self.assertRegex(self._seed(), r'Created 50 customers, \d+ wallets and \d+ ledger entries')
+
+        self.assertEquals(models.Wallet.objects.filter(currency=models.Wallet.EURO).count(), 50)
+        self.assertGreater(models.Wallet.objects.filter(currency=models.Wallet.BONUS, depleted=True).count(), 0)
+        self.assertLess(models.Wallet.objects.latest('created').created, datetime(2016, 11, 2))
+        for customer in models.Customer.objects.all():
+            summary = (customer.euro_balance, customer.bonus_balance, customer.active_bonus_wallets)
+            models.Customer.objects.refresh_summary(customer)
+            self.assertEquals(summary, (customer.euro_balance, customer.bonus_balance, customer.active_bonus_wallets))
+        out = StringIO()
+        call_command('reconcile_ledger', stdout=out)
+        self.assertIn('0 mismatched', out.getvalue())
+
+        # Ids continue after seeded rows
+        customer = models.Customer.objects.create(user=User.objects.create(username='player'))
+        models.Wallet.objects.euro_wallet_get(customer)
+
+    def test_seed_repeatable(self):
+        self._seed('--prefix', 'first', '--no-ledger')
+        first = list(models.Wallet.objects.order_by('pk').values_list('amount', 'created', 'depleted'))
+        self.assertFalse(models.LedgerEntry.objects.exists())
+        models.Customer.objects.all().delete()
+
+        self._seed('--prefix', 'second', '--no-ledger')
+        self.assertEquals(list(models.Wallet.objects.order_by('pk').values_list('amount', 'created', 'depleted')),
+                          first)
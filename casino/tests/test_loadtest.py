@@ -0,0 +1,119 @@
+import os
+import socket
+import struct
+import tempfile
+import threading
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .. import loadtest, models
+
+SCENARIO = [
+    '{"action": "register"}',
+    '{"action": "login"}',
+    '',
+    '{"action": "deposit", "amount": "20.00"}',
+    '{"action": "bet", "amount": "1.00", "repeat": 2}',
+    '{"action": "bet_api", "amount": "1.00"}',
+    '{"action": "withdraw", "amount": "1.00"}',
+    '{"action": "table"}',
+    '{"action": "logout"}',
+]
+
+
+class LoadScenarioCase(SimpleTestCase):
+    def test_load(self):
+        steps = loadtest.load_scenario(SCENARIO)
+        self.assertEquals(len(steps), 8)
+        self.assertEquals(steps[3], {'action': 'bet', 'amount': '1.00', 'repeat': 2})
+
+    def test_invalid(self):
+        for lines, message in [(['{"action": "jump"}'], 'Line 1: action must be one of'),
+                               (['', '{"action": "bet"}'], 'Line 2: bet requires amount'),
+                               (['[]'], 'Line 1: action'),
+                               (['{'], 'Line 1: ')]:
+            with self.assertRaisesRegex(ValueError, message):
+                loadtest.load_scenario(lines)
+
+
+class UwsgiClientCase(SimpleTestCase):
+    """Client against fake uWSGI server recording request variables and answering with redirect setting cookie"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'uwsgi.socket')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.address)
+        self.server.listen(1)
+        self.requests = []
+
+    def tearDown(self):
+        self.server.close()
+        os.unlink(self.address)
+        os.rmdir(self.directory)
+
+    def _serve(self, response):
+        sock, _ = self.server.accept()
+        with sock, sock.makefile('rb') as stream:
+            modifier1, size, modifier2 = struct.unpack('<BHB', stream.read(4))
+            payload = stream.read(size)
+            variables = {}
+            while payload:
+                key_size, = struct.unpack('<H', payload[:2])
+                key, payload = payload[2:2 + key_size].decode(), payload[2 + key_size:]
+                value_size, = struct.unpack('<H', payload[:2])
+                variables[key], payload = payload[2:2 + value_size].decode(), payload[2 + value_size:]
+            body = stream.read(int(variables['CONTENT_LENGTH']))
+            self.requests.append((modifier1, modifier2, variables, body))
+            sock.sendall(response)
+
+    def _request(self, client, response, *args):
+        thread = threading.Thread(target=self._serve, args=(response,))
+        thread.start()
+        result = client.request(*args)
+        thread.join()
+        return result
+
+    def test_request(self):
+        client = loadtest.UwsgiClient(self.address, host='casino.test')
+        self.assertEquals(self._request(
+            client, b'HTTP/1.1 200 OK\r\nSet-Cookie: csrftoken=token; Path=/\r\nContent-Length: 2\r\n\r\nok',
+            'GET', '/accounts/login/'), (200, None))
+        self.assertEquals(self._request(
+            client, b'HTTP/1.1 302 Found\r\nLocation: /bank/\r\nContent-Length: 0\r\n\r\n',
+            'POST', '/bank/', {'amount': '1.00'}, loadtest.FORM), (302, '/bank/'))
+
+        modifier1, modifier2, variables, body = self.requests[0]
+        self.assertEquals((modifier1, modifier2, body), (0, 0, b''))
+        self.assertEquals((variables['REQUEST_METHOD'], variables['PATH_INFO'], variables['HTTP_HOST']),
+                          ('GET', '/accounts/login/', 'casino.test'))
+        self.assertNotIn('HTTP_COOKIE', variables)
+
+        modifier1, modifier2, variables, body = self.requests[1]
+        self.assertEquals(body, b'amount=1.00')
+        self.assertEquals((variables['REQUEST_METHOD'], variables['CONTENT_TYPE'], variables['CONTENT_LENGTH']),
+                          ('POST', loadtest.FORM, '11'))
+        self.assertEquals((variables['HTTP_COOKIE'], variables['HTTP_X_CSRFTOKEN']), ('csrftoken=token', 'token'))
+
+
+@override_settings(THROTTLE_ENABLED=False)
+class RunCase(TestCase):
+    fixtures = ['bonuses.yaml']
+
+    def tearDown(self):
+        models.Bonus.objects.invalidate()
+
+    def test_run(self):
+        result = loadtest.run(loadtest.load_scenario(SCENARIO), 2, 1, loadtest.WsgiClient, prefix='player')
+        summary = result.as_dict()
+
+        self.assertEquals((summary['requests'], summary['errors']), (18, 0))
+        self.assertEquals(summary['actions']['bet']['requests'], 4)
+        self.assertGreater(summary['actions']['deposit']['queries'], 0)
+        self.assertEquals(sorted(User.objects.values_list('username', flat=True)), ['player0', 'player1'])
+        # Login and deposit bonuses were applied
+        self.assertEquals(models.Wallet.objects.filter(currency=models.Wallet.BONUS).count(), 2)
+
+    def test_run_unexpected_status(self):
+        steps = loadtest.load_scenario(['{"action": "login"}', '{"action": "table"}'])
+        summary = loadtest.run(steps, 1, 1, loadtest.WsgiClient).as_dict()
+        self.assertEquals((summary['requests'], summary['errors']), (2, 2))
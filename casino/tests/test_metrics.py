@@ -0,0 +1,100 @@
+import threading
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .. import metrics, models, services
+
+
+class HistogramCase(SimpleTestCase):
+    def test_render(self):
+        histogram = metrics.Histogram('test_queries', 'Test', (1, 5))
+        for value in (0, 1, 3, 10):
+            histogram.observe(('view', 'table'), value)
+
+        self.assertEquals(histogram.get('view', 'table'), (4, 14))
+        self.assertEquals(histogram.get('view', 'bank'), (0, 0))
+        labels = 'kind="view",name="table",pid="{}"'.format(metrics.os.getpid())
+        self.assertEquals(histogram.render(), [
+            '# HELP test_queries Test',
+            '# TYPE test_queries histogram',
+            'test_queries_bucket{{{},le="1"}} 2'.format(labels),
+            'test_queries_bucket{{{},le="5"}} 3'.format(labels),
+            'test_queries_bucket{{{},le="+Inf"}} 4'.format(labels),
+            'test_queries_sum{{{}}} 14'.format(labels),
+            'test_queries_count{{{}}} 4'.format(labels),
+        ])
+
+
+class MeasureCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+
+    def test_measure_nested(self):
+        with metrics.measure('test', 'outer') as outer:
+            connection.cursor().execute('SELECT 1')
+            with metrics.measure('test', 'inner') as inner:
+                list(models.Wallet.objects.all())
+        self.assertEquals((outer.queries, inner.queries), (2, 1))
+        self.assertGreater(outer.db_time, inner.db_time)
+        self.assertEquals(metrics.QUERIES.get('test', 'outer'), (1, 2))
+        self.assertEquals(metrics.LATENCY.get('test', 'inner')[0], 1)
+
+    def test_measure_new_connection(self):
+        queries = []
+
+        def query():
+            connection.force_debug_cursor = True
+            with metrics.measure('test', 'thread') as scope:
+                connection.cursor().execute('SELECT 1')
+            queries.append((scope.queries, len(connection.queries)))
+            connection.close()
+
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+        self.assertEquals(queries[0][0], queries[0][1])
+
+    def test_service(self):
+        wallet_service = services.WalletService(User.objects.get())
+        wallet_service.deposit(Decimal('1.00'))
+        self.assertEquals(metrics.LATENCY.get('service', 'deposit')[0], 1)
+        self.assertGreater(metrics.QUERIES.get('service', 'deposit')[1], 0)
+
+    def test_other_database_not_counted(self):
+        metrics.instrument_backends(aliases=['other'])
+        try:
+            with metrics.measure('test') as scope:
+                User.objects.count()
+        finally:
+            metrics.instrument_backends()
+        self.assertEquals(scope.queries, 0)
+        with metrics.measure('test') as scope:
+            User.objects.count()
+        self.assertEquals(scope.queries, 1)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_service_disabled(self):
+        services.WalletService(User.objects.get()).deposit(Decimal('1.00'))
+        self.assertEquals(metrics.LATENCY.get('service', 'deposit'), (0, 0))
+
+    def test_view(self):
+        self.client.force_login(User.objects.get())
+        self.client.get(reverse('table'))
+        self.client.get('/missing/')
+
+        self.assertEquals(metrics.LATENCY.get('view', 'table')[0], 1)
+        self.assertGreater(metrics.QUERIES.get('view', 'table')[1], 0)
+        self.assertEquals(metrics.LATENCY.get('view', 'unresolved')[0], 1)
+
+    def test_metrics_view(self):
+        self.client.get(reverse('health'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEquals(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertContains(response, 'casino_queries_count{{kind="view",name="health",pid="{}"}} 1'.format(
+            metrics.os.getpid()))
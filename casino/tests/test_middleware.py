@@ -0,0 +1,79 @@
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from .. import auth, models
+from ..middleware import WalletServiceMiddleware
+
+
+class WalletServiceMiddlewareCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.user = User.objects.get()
+        self.middleware = WalletServiceMiddleware(lambda request: request)
+
+    def test_lazy(self):
+        with self.assertNumQueries(0):
+            self.middleware(self.request)
+
+    def test_shared(self):
+        customer = models.Customer.objects.get()
+        self.middleware(self.request)
+        with self.assertNumQueries(2):
+            self.assertEquals(self.request.wallet_service.customer, customer)
+            self.assertEquals(self.request.wallet_service.euro_wallet.currency, models.Wallet.EURO)
+            self.assertEquals(self.request.wallet_service.euro_wallet.amount, 5)
+
+
+@override_settings(AUTH_USER_CACHE_TIMEOUT=60, SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+class CachedAuthenticationMiddlewareCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        auth.clear()
+        self.user = User.objects.get()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        auth.clear()
+
+    def _get_user(self):
+        response = self.client.get(reverse('bank'))
+        return response.context['user'] if response.status_code == 200 else None
+
+    def test_cached(self):
+        self.assertEquals(self._get_user(), self.user)
+        # Customer of page only, no session or user
+        with self.assertNumQueries(1):
+            self.assertEquals(self._get_user(), self.user)
+
+    def test_copy(self):
+        self._get_user().first_name = 'changed'
+        self.assertEquals(self._get_user().first_name, '')
+
+    def test_invalidated_on_save(self):
+        self._get_user()
+        self.user.first_name = 'changed'
+        self.user.save()
+        self.assertEquals(self._get_user().first_name, 'changed')
+
+    def test_password_change(self):
+        self._get_user()
+        self.user.set_password('changed-password')
+        self.user.save()
+        self.assertIsNone(self._get_user())
+
+    def test_other_process_password_change(self):
+        self._get_user()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEquals(self._get_user(), self.user)
+        auth.clear()
+        self.assertIsNone(self._get_user())
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self._get_user()
+        with self.assertNumQueries(2):
+            self._get_user()
@@ -1,6 +1,8 @@
 from decimal import Decimal
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
 from nose_parameterized import parameterized
 
 from .. import models
@@ -78,12 +80,16 @@ class WalletManagerEmptyCase(TestCase):
         self.assertEquals(len(self.wallets.ready_to_wage_all(self.customer)), 0)
 
     def test_sorted_all(self):
-        wallets = list(self.wallets.sorted_all(self.customer))
+        wallets = list(self.wallets.sorted_all(self.customer, include_depleted=True))
+        self.assertEquals(len(wallets), 3)
         self.assertEquals(wallets[0].currency, models.Wallet.EURO)
         self.assertEqual(wallets[1:], sorted(wallets[1:], key=lambda w: w.created))
         for w in wallets[1:]:
             self.assertTrue(w.is_bonus)
 
+    def test_sorted_all_hides_depleted(self):
+        self.assertEquals([w.currency for w in self.wallets.sorted_all(self.customer)], [models.Wallet.EURO])
+
 
 class WalletManagerCase(TestCase):
     fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
@@ -115,6 +121,88 @@ class WalletManagerCase(TestCase):
         ready_to_wage = self.wallets.ready_to_wage_all(self.customer)
         self.assertEquals(len(ready_to_wage), 1)
 
+    def test_sorted_all(self):
+        self.assertEquals([w.pk for w in self.wallets.sorted_all(self.customer)], [1, 4, 3])
+        self.assertEquals(self.wallets.sorted_all(self.customer, include_depleted=True).count(), 4)
+
+    def test_wage_all(self):
+        models.Customer.objects.refresh_summary(self.customer)
+        self.assertEquals(self.wallets.wage_all(self.customer), Decimal('10.00'))
+        self.assertEquals(self.wallets.euro_wallet_get(self.customer).amount, Decimal('15.00'))
+        wallet = self.wallets.get(pk=4)
+        self.assertEquals(wallet.amount, 0)
+        self.assertTrue(wallet.depleted)
+        customer = models.Customer.objects.get()
+        self.assertEquals((customer.euro_balance, customer.bonus_balance, customer.active_bonus_wallets),
+                          (Decimal('15.00'), Decimal('15.00'), 1))
+
+        with self.assertNumQueries(1):
+            self.assertEquals(self.wallets.wage_all(self.customer), 0)
+
+
+class WalletArchiveCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets_empty.yaml']
+
+    def test_archive_depleted(self):
+        created_before = timezone.now()
+        self.assertEquals(models.Wallet.objects.archive_depleted(created_before, batch_size=1), (1, 1))
+        self.assertEquals(models.Wallet.objects.archive_depleted(created_before, batch_size=1, after_pk=1), (1, 2))
+        self.assertEquals(models.Wallet.objects.archive_depleted(created_before, batch_size=1, after_pk=2), (0, 2))
+        self.assertFalse(models.Wallet.objects.exists())
+        self.assertEquals(list(models.WalletArchive.objects.values_list('pk', flat=True)), [1, 2])
+
+    def test_archive_depleted_keeps_newer(self):
+        wallet = models.Wallet.objects.euro_wallet_get(models.Customer.objects.get())
+        models.Wallet.objects.filter(pk=wallet.pk).update(depleted=True)
+        self.assertEquals(models.Wallet.objects.archive_depleted(wallet.created)[0], 2)
+        self.assertEquals(list(models.Wallet.objects.values_list('pk', flat=True)), [wallet.pk])
+
+
+class CustomerManagerCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        self.customer = models.Customer.objects.get()
+
+    def _summary(self):
+        customer = models.Customer.objects.get()
+        return customer.euro_balance, customer.bonus_balance, customer.active_bonus_wallets
+
+    def test_refresh_summary(self):
+        models.Customer.objects.refresh_summary(self.customer)
+        self.assertEquals(self.customer.bonus_balance, Decimal('25.00'))
+        self.assertEquals(self._summary(), (Decimal('5.00'), Decimal('25.00'), 2))
+
+    def test_add_to(self):
+        with self.assertNumQueries(1):
+            models.Customer.objects.add_to(self.customer.pk, euro_balance=Decimal('1.50'), active_bonus_wallets=2)
+        self.assertEquals(self._summary(), (Decimal('1.50'), 0, 2))
+
+        with self.assertNumQueries(0):
+            models.Customer.objects.add_to(self.customer.pk, euro_balance=0)
+
+
+class CustomerCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml']
+
+    def test_spent_money_changed(self):
+        customer = models.Customer.objects.get()
+        self.assertFalse(customer.spent_money_changed)
+        customer.overall_spent_money += 1
+        self.assertTrue(customer.spent_money_changed)
+
+    def test_save_wages_bonus(self):
+        customer = models.Customer.objects.get()
+        wallet = models.Wallet.objects.create(customer=customer, amount=10, currency=models.Wallet.BONUS,
+                                              wagering_requirement=1)
+        customer.overall_spent_money += 20
+        customer.save()
+
+        wallet.refresh_from_db()
+        self.assertTrue(wallet.depleted)
+        self.assertEquals(models.Wallet.objects.euro_wallet_get(customer).amount, Decimal('10.00'))
+        self.assertFalse(customer.spent_money_changed)
+
 
 class WalletCase(TestCase):
     fixtures = ['user.yaml', 'customer.yaml']
@@ -142,6 +230,14 @@ class WalletCase(TestCase):
         )
         self.assertRaises(ValidationError, wallet.clean_amount)
 
+    def test_single_active_euro(self):
+        models.Wallet.objects.euro_wallet_get(self.customer)
+        with transaction.atomic():
+            self.assertRaises(IntegrityError, models.Wallet.objects.create, customer=self.customer, amount=0,
+                              currency=models.Wallet.EURO, wagering_requirement=0)
+        models.Wallet.objects.create(customer=self.customer, amount=0, currency=models.Wallet.EURO,
+                                     wagering_requirement=0, depleted=True)
+
 
 class BonusManagerCase(TestCase):
     fixtures = ['bonuses.yaml']
@@ -149,13 +245,34 @@ class BonusManagerCase(TestCase):
     def setUp(self):
         self.bonuses = models.Bonus.objects
 
+    def tearDown(self):
+        self.bonuses.invalidate()
+
     @parameterized.expand([
         ("deposit low", models.Bonus.DEPOSIT, 9, 0),
         ("deposit hith", models.Bonus.DEPOSIT, 10, 1),
         ("login", models.Bonus.LOGIN, 0, 1),
     ])
     def test_for_action(self, _, action, amount, count):
-        self.assertEquals(self.bonuses.for_action(action, amount).count(), count)
+        self.assertEquals(len(self.bonuses.for_action(action, amount)), count)
+
+    def test_for_action_cached(self):
+        self.bonuses.for_action(models.Bonus.DEPOSIT, 10)
+        with self.assertNumQueries(0):
+            self.assertEquals(len(self.bonuses.for_action(models.Bonus.DEPOSIT, 100)), 1)
+
+    def test_for_action_sorted(self):
+        models.Bonus.objects.create(action=models.Bonus.DEPOSIT, min_amount=50, amount=5,
+                                    currency=models.Bonus.EURO, wagering_requirement=0)
+        models.Bonus.objects.create(action=models.Bonus.DEPOSIT, min_amount=5, amount=5,
+                                    currency=models.Bonus.EURO, wagering_requirement=0)
+        bonuses = self.bonuses.for_action(models.Bonus.DEPOSIT, 20)
+        self.assertEquals([b.min_amount for b in bonuses], [5, 10])
+
+    def test_invalidate_on_change(self):
+        self.assertEquals(len(self.bonuses.for_action(models.Bonus.LOGIN, 0)), 1)
+        models.Bonus.objects.filter(action=models.Bonus.LOGIN).get().delete()
+        self.assertEquals(len(self.bonuses.for_action(models.Bonus.LOGIN, 0)), 0)
 
 
 class BonusCase(SimpleTestCase):
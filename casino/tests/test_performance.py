@@ -0,0 +1,95 @@
+from decimal import Decimal
+from django.contrib.auth import user_logged_in
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from nose_parameterized import parameterized
+
+from .. import auth, models, services
+from ..rng import SeededRandom
+
+SCALES = [(1,), (50,), (500,)]
+
+
+class QueryBudgetCase(TestCase):
+    """Upper bounds of queries of services and views, independent of number of bonus wallets of customer"""
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml', 'bonuses.yaml']
+
+    def tearDown(self):
+        models.Bonus.objects.invalidate()
+
+    def _create_wallets(self, count, ready=False):
+        """Create count active and count depleted bonus wallets, active ones are released by next bet when ready"""
+        customer = models.Customer.objects.get()
+        models.Wallet.objects.bulk_create(
+            models.Wallet(customer=customer, currency=models.Wallet.BONUS, amount=Decimal(0 if depleted else 1),
+                          wagering_requirement=1 if ready else 1000, depleted=depleted,
+                          spent_money_on_start=0 if ready else customer.overall_spent_money)
+            for depleted in (False, True) for _ in range(count)
+        )
+        models.Customer.objects.refresh_summary(customer)
+
+    def assertQueriesAtMost(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            result = func(*args, **kwargs)
+        self.assertLessEqual(len(queries), budget, '\n'.join(query['sql'] for query in queries))
+        return result
+
+    @parameterized.expand(SCALES)
+    def test_deposit(self, wallets):
+        self._create_wallets(wallets)
+        wallet_service = services.WalletService(User.objects.get())
+        self.assertQueriesAtMost(16, wallet_service.deposit, Decimal('10.00'))
+        self.assertEquals(models.Customer.objects.get().active_bonus_wallets, wallets + 3)
+
+    @parameterized.expand(SCALES)
+    def test_withdraw(self, wallets):
+        self._create_wallets(wallets)
+        wallet_service = services.WalletService(User.objects.get())
+        self.assertTrue(self.assertQueriesAtMost(8, wallet_service.withdraw, Decimal('1.00')))
+
+    @parameterized.expand(SCALES)
+    def test_bet(self, wallets):
+        self._create_wallets(wallets)
+        game = services.SimpleGame(User.objects.get(), rng=SeededRandom(0))
+        self.assertQueriesAtMost(15, game.bet, Decimal('1.00'))
+
+    @parameterized.expand(SCALES)
+    def test_bet_wage_all(self, wallets):
+        self._create_wallets(wallets, ready=True)
+        game = services.SimpleGame(User.objects.get(), rng=SeededRandom(0))
+        # Ledger entries of released wallets are inserted in batches limited by SQLite query variables
+        self.assertQueriesAtMost(15 + wallets // 200, game.bet, Decimal('1.00'))
+        self.assertEquals(models.Customer.objects.get().active_bonus_wallets, 1)
+
+    @parameterized.expand(SCALES)
+    def test_login_bonus(self, wallets):
+        self._create_wallets(wallets)
+        user = User.objects.get()
+        self.assertQueriesAtMost(11, user_logged_in.send, None, user=user, request=None)
+        self.assertEquals(models.Customer.objects.get().euro_balance, Decimal('15.00'))
+
+    @parameterized.expand(SCALES)
+    def test_table_view(self, wallets):
+        self._create_wallets(wallets)
+        self.client.force_login(User.objects.get())
+        caches['template_fragments'].clear()
+        response = self.assertQueriesAtMost(6, self.client.get, reverse('table'), {'depleted': '1'})
+        self.assertEquals(len(response.context['wallets'].rows), 2 * wallets + 4)
+
+    @parameterized.expand([('cached_db',), ('signed_cookies',)])
+    def test_session_overhead(self, mode):
+        """Authenticated page with warm session, user and wallet table caches loads customer only"""
+        self._create_wallets(50)
+        engine = 'django.contrib.sessions.backends.' + mode
+        with override_settings(SESSION_ENGINE=engine, AUTH_USER_CACHE_TIMEOUT=60):
+            self.client.force_login(User.objects.get())
+            try:
+                for name in ('table', 'bank'):
+                    self.client.get(reverse(name))
+                    self.assertQueriesAtMost(1, self.client.get, reverse(name))
+            finally:
+                auth.clear()
@@ -0,0 +1,56 @@
+import threading
+from unittest.mock import patch
+from django.test import SimpleTestCase
+from nose_parameterized import parameterized
+
+from .. import rng
+
+
+class BufferedRandomCase(SimpleTestCase):
+    @parameterized.expand([
+        (rng.StdlibRandom,),
+        (rng.SystemRandom,),
+    ])
+    def test_getrandbits(self, backend):
+        generator = backend(buffer_size=16)
+        for k in (1, 3, 8, 13, 64, 128):
+            for _ in range(20):
+                self.assertTrue(0 <= generator.getrandbits(k) < 2 ** k)
+        self.assertRaises(ValueError, generator.getrandbits, 0)
+        self.assertRaises(ValueError, generator.getrandbits, 129)
+
+    def test_fill_required(self):
+        class IncompleteRandom(rng.BufferedRandom):
+            pass
+
+        self.assertRaises(TypeError, IncompleteRandom)
+
+    def test_seeded_reproducible(self):
+        first, second = rng.SeededRandom(42, buffer_size=16), rng.SeededRandom(42, buffer_size=16)
+        self.assertEquals([first.getrandbits(7) for _ in range(100)], [second.getrandbits(7) for _ in range(100)])
+
+    def test_bits_from_buffer(self):
+        generator = rng.SystemRandom(buffer_size=2)
+        with patch.object(rng.SystemRandom, '_fill', return_value=bytes([0b10110010, 0b00000001])) as fill:
+            self.assertEquals([generator.getrandbits(1) for _ in range(9)], [0, 1, 0, 0, 1, 1, 0, 1, 1])
+            self.assertEquals(generator.getrandbits(7), 0)
+            self.assertEquals(generator.getrandbits(8), 0b10110010)
+        self.assertEquals(fill.call_count, 2)
+
+    def test_reset_after_fork(self):
+        generator = rng.SystemRandom(buffer_size=2)
+        generator.getrandbits(1)
+        with patch.object(rng.SystemRandom, '_fill', return_value=b'\xff\xff') as fill, \
+                patch('os.getpid', return_value=-1):
+            self.assertEquals(generator.getrandbits(1), 1)
+        fill.assert_called_once_with(2)
+
+    def test_threads(self):
+        generator = rng.StdlibRandom(buffer_size=8)
+        with patch.object(rng.StdlibRandom, '_fill', side_effect=lambda size: b'\xff' * size) as fill:
+            threads = [threading.Thread(target=lambda: [generator.getrandbits(1) for _ in range(64)]) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEquals(fill.call_count, 4)
@@ -1,10 +1,15 @@
+from datetime import timedelta
 from decimal import Decimal
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from django.contrib.auth.models import User
-from django.test import SimpleTestCase, TestCase
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from nose_parameterized import parameterized
 
 from .. import models, services
+from ..rng import SeededRandom
 
 
 class WalletServiceCase(TestCase):
@@ -56,17 +61,210 @@ class WalletServiceCase(TestCase):
         ))
         self._assert_euro_amount(euro_amount + Decimal('10.00'))
 
+    def test_bonuses(self):
+        self.wallet_service.customer.overall_spent_money = Decimal('7.00')
+        euro_amount = self.wallet_service.euro_wallet.amount
+        bonuses = [
+            models.Bonus(amount=Decimal(amount), currency=currency, wagering_requirement=wagering_requirement)
+            for amount, currency, wagering_requirement in [
+                ('1.00', models.Bonus.EURO, 0),
+                ('2.00', models.Bonus.BONUS, 5),
+                ('3.00', models.Bonus.EURO, 0),
+                ('4.00', models.Bonus.BONUS, 10),
+            ]
+        ]
+        with self.assertNumQueries(11):
+            self.wallet_service.create_bonuses(bonuses)
+
+        self._assert_euro_amount(euro_amount + Decimal('4.00'))
+        self.assertEquals(self.wallet_service.euro_wallet.amount, euro_amount + Decimal('4.00'))
+        wallets = models.Wallet.objects.filter(currency=models.Wallet.BONUS).order_by('amount')
+        self.assertEquals([(w.amount, w.wagering_requirement) for w in wallets],
+                          [(Decimal('2.00'), 5), (Decimal('4.00'), 10)])
+        for wallet in wallets:
+            self.assertEquals(wallet.spent_money_on_start, Decimal('7.00'))
+
     def test_deposit(self):
         euro_amount = self._get_euro_wallet().amount
         self.wallet_service.deposit(Decimal('5'))
         self._assert_euro_amount(euro_amount + Decimal('5'))
 
+    def test_ledger(self):
+        self.wallet_service.deposit(Decimal('5'))
+        self.wallet_service.withdraw(Decimal('2'))
+        self.wallet_service.create_bonus(models.Bonus(amount=Decimal('10.00'), currency=models.Bonus.BONUS,
+                                                      wagering_requirement=1))
+        bonus_wallet = models.Wallet.objects.get(currency=models.Wallet.BONUS)
+        self.wallet_service.bonus_to_euro(bonus_wallet)
+
+        euro_wallet = self._get_euro_wallet()
+        entries = models.LedgerEntry.objects.filter(wallet=euro_wallet).order_by('pk')
+        self.assertEquals([(e.kind, e.delta, e.balance) for e in entries], [
+            (models.LedgerEntry.DEPOSIT, Decimal('5'), Decimal('5')),
+            (models.LedgerEntry.WITHDRAW, Decimal('-2'), Decimal('3')),
+            (models.LedgerEntry.WAGE, Decimal('10'), Decimal('13')),
+        ])
+        self.assertEquals(self.wallet_service.euro_wallet.amount, Decimal('13'))
+        self.assertEquals(models.LedgerEntry.objects.balances([euro_wallet.pk, bonus_wallet.pk]),
+                          {euro_wallet.pk: Decimal('13'), bonus_wallet.pk: Decimal('0')})
+
+    def _assert_summary(self, euro_balance, bonus_balance, active_bonus_wallets):
+        customer = models.Customer.objects.get(pk=self.wallet_service.customer.pk)
+        summary = (customer.euro_balance, customer.bonus_balance, customer.active_bonus_wallets)
+        self.assertEquals(summary, (euro_balance, bonus_balance, active_bonus_wallets))
+        models.Customer.objects.refresh_summary(customer)
+        self.assertEquals((customer.euro_balance, customer.bonus_balance, customer.active_bonus_wallets), summary)
+
+    def test_summary(self):
+        self.wallet_service.deposit(Decimal('5'))
+        self.wallet_service.withdraw(Decimal('2'))
+        self._assert_summary(Decimal('3'), 0, 0)
+
+        self.wallet_service.create_bonuses([
+            models.Bonus(amount=Decimal(amount), currency=currency, wagering_requirement=1)
+            for amount, currency in [('1.00', models.Bonus.EURO), ('2.00', models.Bonus.BONUS),
+                                     ('4.00', models.Bonus.BONUS)]
+        ])
+        self._assert_summary(Decimal('4'), Decimal('6'), 2)
+
+        self.wallet_service.bonus_to_euro(models.Wallet.objects.get(currency=models.Wallet.BONUS, amount=4))
+        self._assert_summary(Decimal('8'), Decimal('2'), 1)
+
     def test_withdraw(self):
         euro_amount = self._get_euro_wallet().amount
         self.assertFalse(self.wallet_service.withdraw(euro_amount + 1))
         self.assertTrue(self.wallet_service.withdraw(euro_amount))
         self._assert_euro_amount(0)
 
+    def test_withdraw_stale(self):
+        self.wallet_service.deposit(Decimal('10'))
+        other_service = services.WalletService(self.user)
+        self.assertEquals(other_service.euro_wallet.amount, Decimal('10'))
+
+        self.assertTrue(self.wallet_service.withdraw(Decimal('8')))
+        with self.assertNumQueries(5):
+            self.assertFalse(other_service.withdraw(Decimal('8')))
+        self.assertEquals(other_service.euro_wallet.amount, Decimal('2'))
+        self.assertTrue(other_service.withdraw(Decimal('2')))
+
+        self._assert_euro_amount(0)
+        self._assert_summary(0, 0, 0)
+        self.assertEquals(models.LedgerEntry.objects.filter(kind=models.LedgerEntry.WITHDRAW).count(), 2)
+
+    @parameterized.expand([
+        ('deposit', lambda service: service.deposit(Decimal('5'))),
+        ('withdraw', lambda service: service.withdraw(Decimal('5'))),
+        ('deposit_idempotent', lambda service: service.deposit(Decimal('5'), idempotency_key='a')),
+        ('create_bonuses', lambda service: service.create_bonuses([models.Bonus(
+            amount=Decimal('5'), currency=models.Bonus.EURO, wagering_requirement=1, action=models.Bonus.DEPOSIT)])),
+    ])
+    def test_customer_locked_first(self, name, operation):
+        self.wallet_service.euro_wallet
+        with CaptureQueriesContext(connection) as queries:
+            operation(self.wallet_service)
+        statements = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertTrue(statements[0].startswith('SELECT "casino_customer"."id" FROM "casino_customer"'))
+
+    def test_deposit_idempotent(self):
+        self.wallet_service.deposit(Decimal('5'), idempotency_key='a')
+        self.wallet_service.deposit(Decimal('5'), idempotency_key='a')
+        self.wallet_service.deposit(Decimal('5'), idempotency_key='b')
+        self._assert_euro_amount(Decimal('10'))
+
+    def test_withdraw_idempotent(self):
+        self.wallet_service.deposit(Decimal('5'))
+        self.assertTrue(self.wallet_service.withdraw(Decimal('3'), idempotency_key='a'))
+        self.assertTrue(self.wallet_service.withdraw(Decimal('3'), idempotency_key='a'))
+        self.assertFalse(self.wallet_service.withdraw(Decimal('3'), idempotency_key='b'))
+        self.assertFalse(self.wallet_service.withdraw(Decimal('3'), idempotency_key='b'))
+        self._assert_euro_amount(Decimal('2'))
+
+    def test_idempotency_key_other_arguments(self):
+        self.wallet_service.deposit(Decimal('5'), idempotency_key='a')
+        self.assertRaises(models.IdempotencyKeyReused, self.wallet_service.deposit, Decimal('6'),
+                          idempotency_key='a')
+        self._assert_euro_amount(Decimal('5'))
+
+    def test_idempotency_key_per_operation(self):
+        self.wallet_service.deposit(Decimal('5'), idempotency_key='a')
+        self.assertTrue(self.wallet_service.withdraw(Decimal('5'), idempotency_key='a'))
+        self._assert_euro_amount(Decimal('0'))
+        self.assertEquals(models.IdempotencyKey.objects.count(), 2)
+
+    def test_idempotency_key_expired(self):
+        self.wallet_service.deposit(Decimal('5'), idempotency_key='a')
+        with override_settings(IDEMPOTENCY_KEY_TTL=-1):
+            self.wallet_service.deposit(Decimal('5'), idempotency_key='a')
+        self.wallet_service.deposit(Decimal('5'), idempotency_key='a')
+        self._assert_euro_amount(Decimal('10'))
+        self.assertEquals(models.IdempotencyKey.objects.count(), 1)
+
+    def test_idempotency_key_per_customer(self):
+        other_user = User.objects.create_user('other')
+        self.wallet_service.deposit(Decimal('5'), idempotency_key='a')
+        services.WalletService(other_user).deposit(Decimal('5'), idempotency_key='a')
+        self._assert_euro_amount(Decimal('5'))
+        self.assertEquals(services.WalletService(other_user).euro_wallet.amount, Decimal('5'))
+
+    def test_deposit_stale(self):
+        other_service = services.WalletService(self.user)
+        other_service.euro_wallet
+        self.wallet_service.deposit(Decimal('3'))
+        other_service.deposit(Decimal('4'))
+        self.assertEquals(other_service.euro_wallet.amount, Decimal('7'))
+        self._assert_summary(Decimal('7'), 0, 0)
+
+
+class BonusWorkerCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'bonuses.yaml']
+
+    def tearDown(self):
+        models.Bonus.objects.invalidate()
+
+    def _event(self, action, amount=0):
+        return models.BonusEvent.objects.create(customer_id=1, action=action, amount=amount)
+
+    def test_process_batch(self):
+        login, deposit, small = self._event(models.Bonus.LOGIN), self._event(models.Bonus.DEPOSIT, 10), \
+            self._event(models.Bonus.DEPOSIT, 5)
+        worker = services.BonusWorker(batch_size=2)
+
+        self.assertEquals(worker.process_batch(), (2, 0))
+        self.assertEquals(worker.stats()['pending'], 1)
+        self.assertEquals(worker.process_batch(), (1, 0))
+        self.assertEquals(worker.process_batch(), (0, 0))
+
+        self.assertEquals(models.BonusEvent.objects.filter(processed=None).count(), 0)
+        customer = models.Customer.objects.get()
+        self.assertEquals((customer.euro_balance, customer.bonus_balance), (Decimal('10'), Decimal('10')))
+        self.assertEquals(models.Wallet.objects.count(), 2)
+
+    def test_process_batch_failed(self):
+        self._event(models.Bonus.LOGIN)
+        worker = services.BonusWorker(max_attempts=2)
+        with patch.object(services.WalletService, 'create_bonuses', side_effect=ValueError), \
+                self.assertLogs('casino.services', 'ERROR'):
+            self.assertEquals(worker.process_batch(), (0, 1))
+            self.assertEquals(worker.process_batch(), (0, 1))
+            self.assertEquals(worker.process_batch(), (0, 0))
+
+        self.assertEquals(models.BonusEvent.objects.get().attempts, 2)
+        self.assertEquals(models.Wallet.objects.count(), 0)
+        stats = worker.stats()
+        self.assertEquals((stats['pending'], stats['failed'], stats['lag']), (0, 1, 0))
+
+    def test_stats_lag(self):
+        event = self._event(models.Bonus.LOGIN)
+        models.BonusEvent.objects.filter(pk=event.pk).update(created=event.created - timedelta(minutes=1))
+        self.assertGreaterEqual(services.BonusWorker().stats()['lag'], 60)
+
+    def test_purge(self):
+        event = self._event(models.Bonus.LOGIN)
+        services.BonusWorker().process_batch()
+        self.assertEquals(services.BonusWorker().purge(), 0)
+        models.BonusEvent.objects.filter(pk=event.pk).update(processed=timezone.now() - timedelta(days=8))
+        self.assertEquals(services.BonusWorker().purge(), 1)
+
 
 class BaseGameServiceCase(TestCase):
     fixtures = ['user.yaml', 'customer.yaml']
@@ -104,6 +302,131 @@ class BaseGameServiceCase(TestCase):
         self.assertEquals(amount_change, expected_change)
         self.assertEquals(wallet.amount, money + expected_change)
 
+    def test_bet_spent_money(self):
+        wallet = self._get_euro_wallet()
+        wallet.amount = 10
+        wallet.save()
+
+        self.game_lose.bet(Decimal('2.50'))
+        self.assertEquals(self.game_lose.customer.overall_spent_money, Decimal('125.95'))
+        self.assertEquals(models.Customer.objects.get().overall_spent_money, Decimal('125.95'))
+
+    def test_bet_depletes_bonus(self):
+        customer = models.Customer.objects.get()
+        wallet = models.Wallet.objects.create(customer=customer, amount=1, currency=models.Wallet.BONUS,
+                                              wagering_requirement=100)
+
+        self.game_lose.bet(1)
+        wallet.refresh_from_db()
+        self.assertEquals(wallet.amount, 0)
+        self.assertTrue(wallet.depleted)
+
+    def test_bet_idempotent(self):
+        wallet = self._get_euro_wallet()
+        wallet.amount = 10
+        wallet.save()
+
+        self.assertEquals(self.game_lose.bet(1, idempotency_key='a'), (-1, 'lose'))
+        self.assertEquals(self.game_win.bet(1, idempotency_key='a'), (Decimal(-1), 'lose'))
+        self.assertEquals(self._get_euro_wallet().amount, 9)
+        self.assertEquals(models.LedgerEntry.objects.filter(kind=models.LedgerEntry.BET).count(), 1)
+
+    def test_bet_failed_not_stored(self):
+        models.Wallet.objects.filter(pk=self._get_euro_wallet().pk).update(amount=10)
+        with patch.object(self.TestGameWin, 'game_logic', side_effect=ValueError):
+            self.assertRaises(ValueError, self.game_win.bet, 1, idempotency_key='a')
+        self.assertFalse(models.IdempotencyKey.objects.exists())
+
+    def test_bet_summary(self):
+        customer = models.Customer.objects.get()
+        services.WalletService(self.user, customer).create_bonus(models.Bonus(
+            amount=Decimal('1.00'), currency=models.Bonus.BONUS, wagering_requirement=100))
+
+        self.game_lose.bet(1)
+        self.assertEquals((self.game_lose.customer.bonus_balance, self.game_lose.customer.active_bonus_wallets), (0, 0))
+        customer.refresh_from_db()
+        self.assertEquals((customer.euro_balance, customer.bonus_balance, customer.active_bonus_wallets), (0, 0, 0))
+
+    def _count_bet_queries(self, bonus_wallets):
+        customer = models.Customer.objects.get()
+        models.Wallet.objects.euro_wallet_get(customer)
+        for _ in range(bonus_wallets):
+            models.Wallet.objects.create(customer=customer, amount=10, currency=models.Wallet.BONUS,
+                                         wagering_requirement=100)
+        with CaptureQueriesContext(connection) as queries:
+            self.game_win.bet(1)
+        models.Wallet.objects.filter(currency=models.Wallet.BONUS).update(depleted=True)
+        return len(queries)
+
+    def test_bet_queries_constant(self):
+        self.assertEquals(self._count_bet_queries(1), self._count_bet_queries(50))
+
+
+class BetManyCase(TestCase):
+    """bet_many compared with sequential bets of the same seeded game, both rolled back"""
+    maxDiff = None
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        self.user = User.objects.get()
+
+    @staticmethod
+    def _state():
+        def wallet_key(pk, currency):
+            # Euro wallet created during play may get different pk
+            return currency if currency == models.Wallet.EURO else pk
+
+        customer = models.Customer.objects.values('overall_spent_money', 'euro_balance', 'bonus_balance',
+                                                  'active_bonus_wallets', 'wallet_version').get()
+        wallets = [(wallet_key(pk, currency), amount, depleted) for pk, currency, amount, depleted in
+                   models.Wallet.objects.order_by('pk').values_list('pk', 'currency', 'amount', 'depleted')]
+        ledger = [(wallet_key(pk, currency), kind, delta, balance) for pk, currency, kind, delta, balance in
+                  models.LedgerEntry.objects.order_by('pk').values_list('wallet_id', 'wallet__currency', 'kind',
+                                                                         'delta', 'balance')]
+        return customer, wallets, ledger
+
+    def _play(self, play):
+        with transaction.atomic():
+            game = services.SimpleGame(self.user, rng=SeededRandom(7))
+            results = play(game)
+            state = self._state()
+            transaction.set_rollback(True)
+        return results, state
+
+    @parameterized.expand([
+        ('small', ['1.00'] * 40, False),
+        ('mixed', ['2.50', '5.00', '20.00', '1.00', '12.00'] * 8, False),
+        ('no_euro_wallet', ['3.00', '1.00', '4.00'] * 10, True),
+    ])
+    def test_matches_sequential(self, name, amounts, without_euro):
+        if without_euro:
+            models.Wallet.objects.filter(currency=models.Wallet.EURO).delete()
+        models.Customer.objects.refresh_summary(models.Customer.objects.get())
+        amounts = [Decimal(amount) for amount in amounts]
+
+        sequential = self._play(lambda game: [game.bet(amount) for amount in amounts])
+        batch = self._play(lambda game: game.bet_many(amounts))
+        self.assertEquals(batch, sequential)
+        self.assertIn(models.LedgerEntry.WAGE, [kind for _, kind, _, _ in batch[1][2]])
+
+    def test_idempotent(self):
+        game = services.SimpleGame(self.user, rng=SeededRandom(7))
+        results = game.bet_many([Decimal(1), Decimal(2)], idempotency_key='a')
+        self.assertEquals(game.bet_many([Decimal(1), Decimal(2)], idempotency_key='a'), results)
+        self.assertRaises(models.IdempotencyKeyReused, game.bet_many, [Decimal(3)], idempotency_key='a')
+        self.assertEquals(models.LedgerEntry.objects.filter(kind=models.LedgerEntry.BET).count(), 2)
+
+    def test_queries_constant(self):
+        game = services.SimpleGame(self.user, rng=SeededRandom(7))
+        models.Wallet.objects.filter(pk=1).update(amount=1000)
+        # Release bonus wallets first, ledger entries stay within single insert batch
+        game.bet_many([Decimal(1)] * 20)
+        with CaptureQueriesContext(connection) as few:
+            game.bet_many([Decimal(1)] * 5)
+        with CaptureQueriesContext(connection) as many:
+            game.bet_many([Decimal(1)] * 150)
+        self.assertEquals(len(few), len(many))
+
 
 class SimpleGameServiceCase(SimpleTestCase):
     def setUp(self):
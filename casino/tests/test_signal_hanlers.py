@@ -1,11 +1,13 @@
 from unittest.mock import MagicMock, Mock, patch
 from django.contrib.auth import user_logged_in
 from django.contrib.auth.models import User
-from django.db.models.signals import pre_save, post_save
-from django.test import SimpleTestCase, TestCase
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_delete, post_save
+from django.test import SimpleTestCase, TestCase, override_settings
 from nose_parameterized import parameterized
 
-from .. import models, services
+from .. import models, services, signal_handlers
 from .. import signals
 
 
@@ -14,25 +16,23 @@ class SignalHandlersCase(TestCase):
 
     @staticmethod
     def _on_logged_in(return_value):
-        queryset = MagicMock(spec=models.Bonus.objects)
-        with patch.object(models.BonusManager, 'for_action', return_value=queryset) as for_action:
-            queryset.all.return_value = return_value
+        with patch.object(models.BonusManager, 'for_action', return_value=return_value) as for_action:
             user_logged_in.send(None, user=User.objects.get(), request=None)
         for_action.assert_called_with(models.Bonus.LOGIN, 0)
 
-    def _mock_create_bonus(self, value):
-        with patch.object(services.WalletService, 'create_bonus', return_value=None) as create_bonus:
+    def _mock_create_bonuses(self, value):
+        with patch.object(services.WalletService, 'create_bonuses', return_value=None) as create_bonuses:
             self._on_logged_in(value)
-        return create_bonus
+        return create_bonuses
 
     def test_on_logged_in(self):
         bonus = Mock()
-        create_bonus = self._mock_create_bonus([bonus])
-        create_bonus.assert_called_with(bonus)
+        create_bonuses = self._mock_create_bonuses([bonus])
+        create_bonuses.assert_called_with([bonus])
 
     def test_on_logged_in_no_bonus(self):
-        create_bonus = self._mock_create_bonus([])
-        create_bonus.assert_not_called()
+        create_bonuses = self._mock_create_bonuses([])
+        create_bonuses.assert_not_called()
 
 
 class SignalOnDepositCase(SimpleTestCase):
@@ -40,9 +40,7 @@ class SignalOnDepositCase(SimpleTestCase):
 
     @staticmethod
     def _on_deposit(wallet_service, return_value):
-        queryset = MagicMock(spec=models.Bonus.objects)
-        with patch.object(models.BonusManager, 'for_action', return_value=queryset) as for_action:
-            queryset.all.return_value = return_value
+        with patch.object(models.BonusManager, 'for_action', return_value=return_value) as for_action:
             signals.deposit.send(None, wallet_service=wallet_service, amount=10)
         for_action.assert_called_with(models.Bonus.DEPOSIT, 10)
 
@@ -50,35 +48,68 @@ class SignalOnDepositCase(SimpleTestCase):
         bonus = Mock()
         wallet_service = Mock()
         self._on_deposit(wallet_service, [bonus])
-        wallet_service.create_bonus.assert_called_with(bonus)
+        wallet_service.create_bonuses.assert_called_with([bonus])
 
     def test_on_deposit_no_bonus(self):
         wallet_service = Mock()
         self._on_deposit(wallet_service, [])
-        wallet_service.create_bonus.assert_not_called()
+        wallet_service.create_bonuses.assert_not_called()
 
 
-class SignalOnConsumerUpdateCase(TestCase):
-    fixtures = ['user.yaml']
+@override_settings(BONUS_OUTBOX=True)
+class SignalOutboxCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml']
 
-    def setUp(self):
-        self.instance = Mock()
-        self.instance.user = User.objects.get()
+    def test_on_logged_in(self):
+        with patch.object(models.BonusManager, 'for_action') as for_action:
+            user_logged_in.send(None, user=User.objects.get(), request=None)
+        for_action.assert_not_called()
+        event = models.BonusEvent.objects.get()
+        self.assertEquals((event.customer_id, event.action, event.processed), (1, models.Bonus.LOGIN, None))
 
-    def _mock_bonus_to_euro(self, value):
-        with patch.object(services.WalletService, 'ready_to_wage_all', return_value=value), \
-                patch.object(services.WalletService, 'bonus_to_euro', return_value=None) as bonus_to_euro:
-            post_save.send(models.Customer, instance=self.instance)
-        return bonus_to_euro
+    def test_on_deposit(self):
+        wallet_service = services.WalletService(None, customer=models.Customer.objects.get())
+        with patch.object(services.WalletService, 'create_bonuses') as create_bonuses:
+            signals.deposit.send(None, wallet_service=wallet_service, amount=10)
+        create_bonuses.assert_not_called()
+        event = models.BonusEvent.objects.get()
+        self.assertEquals((event.action, event.amount), (models.Bonus.DEPOSIT, 10))
 
-    def test_on_consumer_update_empty(self):
-        bonus_to_euro = self._mock_bonus_to_euro([])
-        bonus_to_euro.assert_not_called()
 
-    def test_on_consumer_update(self):
-        bonus = Mock()
-        bonus_to_euro = self._mock_bonus_to_euro([bonus])
-        bonus_to_euro.assert_called_with(bonus)
+class SignalOnConsumerUpdateCase(SimpleTestCase):
+    def _mock_wage_all(self, instance, **kwargs):
+        with patch.object(models.WalletManager, 'wage_all', return_value=0) as wage_all:
+            post_save.send(models.Customer, instance=instance, **kwargs)
+        return wage_all
+
+    @parameterized.expand([
+        (False, {}, False),
+        (True, {}, True),
+        (True, {'created': True}, False),
+        (True, {'raw': True}, False),
+    ])
+    def test_on_consumer_update(self, changed, kwargs, expected_called):
+        instance = Mock()
+        instance.spent_money_changed = changed
+        wage_all = self._mock_wage_all(instance, **kwargs)
+        self.assertEquals(wage_all.called, expected_called)
+
+    def test_on_spent(self):
+        customer = Mock()
+        with patch.object(models.WalletManager, 'wage_all', return_value=0) as wage_all:
+            signals.spent.send(None, customer=customer, amount=1)
+        wage_all.assert_called_with(customer)
+
+
+class SignalOnBonusUpdateCase(SimpleTestCase):
+    @parameterized.expand([
+        (post_save,),
+        (post_delete,),
+    ])
+    def test_on_bonus_update(self, signal):
+        with patch.object(models.BonusManager, 'invalidate') as invalidate:
+            signal.send(models.Bonus, instance=Mock())
+        invalidate.assert_called_with()
 
 
 class SignalOnWalletUpdateCase(SimpleTestCase):
@@ -96,3 +127,47 @@ class SignalOnWalletUpdateCase(SimpleTestCase):
 
         pre_save.send(models.Wallet, instance=instance)
         self.assertEquals(instance.depleted, expected_depleted)
+
+
+class SignalOnConnectionCreatedCase(SimpleTestCase):
+    @override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234, 'synchronous': 'OFF'})
+    def test_on_connection_created(self):
+        connection = MagicMock(vendor='sqlite')
+        cursor = connection.cursor.return_value.__enter__.return_value
+        connection_created.send(None, connection=connection)
+        self.assertEquals(sorted(c[0][0] for c in cursor.execute.call_args_list), [
+            'PRAGMA busy_timeout = 1234', 'PRAGMA synchronous = OFF',
+        ])
+
+    def test_on_connection_created_other_vendor(self):
+        connection = Mock(vendor='postgresql')
+        connection_created.send(None, connection=connection)
+        connection.cursor.assert_not_called()
+
+
+class SignalOnMigrateCase(TestCase):
+    def test_migrate_legacy_alter_table(self):
+        def legacy_alter_table():
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA legacy_alter_table')
+                return cursor.fetchone()[0]
+
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        self.assertEquals(legacy_alter_table(), 0)
+        signal_handlers.on_pre_migrate(None, using=connection.alias)
+        self.assertEquals(legacy_alter_table(), 1)
+        signal_handlers.on_post_migrate(None, using=connection.alias)
+        self.assertEquals(legacy_alter_table(), 0)
+
+
+class SignalOnWalletSavedCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def test_saved_wallet_bumps_version(self):
+        customer = models.Customer.objects.get()
+        wallet = models.Wallet.objects.get(pk=3)
+        wallet.amount = 1
+        wallet.save()
+        self.assertEquals(models.Customer.objects.values_list('bonus_balance', 'wallet_version').get(),
+                          (customer.bonus_balance, customer.wallet_version + 1))
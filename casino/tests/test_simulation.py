@@ -0,0 +1,63 @@
+from decimal import Decimal
+from django.test import SimpleTestCase
+from nose_parameterized import parameterized
+
+from .. import models, services, simulation
+
+
+class AlwaysWinGame(services.BaseGameService):
+    def game_logic(self, amount):
+        return amount, 'win'
+
+
+class AlwaysLoseGame(services.BaseGameService):
+    def game_logic(self, amount):
+        return -amount, 'lose'
+
+
+class LoopSimpleGame(services.SimpleGame):
+    simulate_outcomes = services.BaseGameService.simulate_outcomes
+
+
+def _bonus(action, currency, amount, wagering_requirement, min_amount=0):
+    return models.Bonus(action=action, currency=currency, amount=Decimal(amount),
+                        wagering_requirement=wagering_requirement, min_amount=Decimal(min_amount))
+
+
+class SimulationCase(SimpleTestCase):
+    catalogue = [
+        _bonus(models.Bonus.LOGIN, models.Bonus.BONUS, 5, 2),
+        _bonus(models.Bonus.DEPOSIT, models.Bonus.EURO, 3, 0, min_amount=10),
+        _bonus(models.Bonus.DEPOSIT, models.Bonus.BONUS, 7, 1, min_amount=100),
+    ]
+
+    def _simulate(self, game, rounds, **kwargs):
+        return simulation.simulate('{}.{}'.format(__name__, game.__name__), self.catalogue, 10, rounds, Decimal(10),
+                                   Decimal(1), processes=1, chunk_size=4, **kwargs)
+
+    def test_release(self):
+        result = self._simulate(AlwaysWinGame, 20)
+        self.assertEquals((result.players, result.bets, result.rtp), (10, 200, 2))
+        self.assertEquals((result.euro_bonuses, result.bonus_wallets, result.released), (3000, 10, 10))
+        self.assertEquals(result.balance, 10 * (1000 + 300 + 2000 + 500))
+
+    def test_release_before_bet(self):
+        result = self._simulate(AlwaysLoseGame, 30)
+        # Login bonus is released into Euro wallet after 10 EUR is spent, before it's ever bet on
+        self.assertEquals((result.bets, result.rtp, result.released, result.released_amount), (10 * 18, 0, 10, 5000))
+        self.assertEquals((result.balance, result.busted), (0, 10))
+
+    @parameterized.expand([
+        ('vectorized', 'casino.services.SimpleGame'),
+        ('game_logic', '{}.LoopSimpleGame'.format(__name__)),
+    ])
+    def test_simple_game(self, _, game_path):
+        result = simulation.simulate(game_path, [], 200, 50, Decimal(100), Decimal(1), processes=1)
+        self.assertEquals(result.bets, 200 * 50)
+        self.assertAlmostEqual(result.rtp, 1, delta=0.05)
+        self.assertEquals(result.balance, 200 * 10000 + result.returned - result.wagered)
+
+    def test_reproducible(self):
+        run = lambda: simulation.simulate('casino.services.SimpleGame', [], 100, 50, Decimal(5), Decimal(1),
+                                          seed=3, processes=1, chunk_size=30)
+        self.assertEquals(run().balance, run().balance)
@@ -0,0 +1,131 @@
+import json
+import threading
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .. import models, services, throttling
+
+
+class TokenBucketCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches['throttle']
+        self.cache.clear()
+
+    def test_burst_and_refill(self):
+        bucket = throttling.TokenBucket(2, 3, cache=self.cache)
+        self.assertEquals([bucket.consume('key', now=100) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEquals(bucket.consume('key', now=100), 0.5)
+        self.assertEquals(bucket.consume('key', now=100.5), 0)
+        self.assertAlmostEquals(bucket.consume('key', now=100.5), 0.5)
+        # Refill never exceeds burst
+        self.assertEquals([bucket.consume('key', now=200) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(bucket.consume('key', now=200), 0)
+
+    def test_keys_independent(self):
+        bucket = throttling.TokenBucket(1, 1, cache=self.cache)
+        self.assertEquals(bucket.consume('first', now=100), 0)
+        self.assertEquals(bucket.consume('second', now=100), 0)
+        self.assertGreater(bucket.consume('first', now=100), 0)
+
+    def test_cost(self):
+        bucket = throttling.TokenBucket(2, 10, cache=self.cache)
+        self.assertEquals(bucket.consume('key', cost=8, now=100), 0)
+        self.assertAlmostEquals(bucket.consume('key', cost=4, now=100), 1)
+        self.assertEquals(bucket.consume('key', cost=4, now=101), 0)
+
+    @patch.object(throttling, 'LocMemCache', ())
+    def test_lock_key(self):
+        # Local memory cache stands for shared one
+        cache = LocMemCache('throttle-test', {})
+        waits = []
+        threads = [
+            threading.Thread(target=lambda bucket: waits.extend(bucket.consume('key') for _ in range(10)),
+                             args=(throttling.TokenBucket(0.001, 20, cache=cache),))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(waits.count(0), 20)
+        self.assertIsNone(cache.get('key:lock'))
+
+    @override_settings(THROTTLE_RATES={'bet': (1, 1)}, THROTTLE_WORKERS=1)
+    def test_get_bucket(self):
+        self.assertIsNone(throttling.get_bucket('bank'))
+        bucket = throttling.get_bucket('bet')
+        self.assertIs(throttling.get_bucket('bet'), bucket)
+        with self.settings(THROTTLE_RATES={'bet': (2, 5)}):
+            self.assertEquals((throttling.get_bucket('bet').rate, throttling.get_bucket('bet').burst), (2, 5))
+
+    @override_settings(THROTTLE_RATES={'bet': (8, 20)}, THROTTLE_WORKERS=4)
+    def test_get_bucket_per_worker(self):
+        bucket = throttling.get_bucket('bet')
+        self.assertEquals((bucket.rate, bucket.burst), (2, 20))
+
+
+@override_settings(THROTTLE_ENABLED=True, THROTTLE_WORKERS=1,
+                   THROTTLE_RATES={'bet': (0.001, 2), 'bet-many': (0.001, 5), 'login': (0.001, 1)})
+class ThrottleMiddlewareCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.client.force_login(User.objects.get())
+
+    def test_bet(self):
+        for _ in range(2):
+            response = self.client.post(reverse('table'), {'amount': '1'})
+            self.assertEquals(response.status_code, 302)
+        entries = models.LedgerEntry.objects.count()
+        with patch.object(services.SimpleGame, 'bet') as bet:
+            response = self.client.post(reverse('table'), {'amount': '1'})
+        self.assertEquals(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertFalse(bet.called)
+        self.assertEquals(models.LedgerEntry.objects.count(), entries)
+
+    def test_shared_by_bet_endpoints(self):
+        self.client.post(reverse('table'), {'amount': '1'})
+        self.client.post(reverse('api-bet'), json.dumps({'amount': '1'}), content_type='application/json')
+        response = self.client.post(reverse('api-bet'), json.dumps({'amount': '1'}), content_type='application/json')
+        self.assertEquals(response.status_code, 429)
+        self.assertIn('__all__', response.json()['errors'])
+
+    def test_bet_many_per_bet(self):
+        def post(amounts):
+            return self.client.post(reverse('api-bet-many'), json.dumps({'amounts': amounts}),
+                                    content_type='application/json')
+
+        self.assertEquals(post(['1.00'] * 3).status_code, 200)
+        self.assertEquals(post(['1.00'] * 3).status_code, 429)
+        self.assertEquals(post(['1.00'] * 2).status_code, 200)
+        # Single bets have own bucket
+        self.assertEquals(self.client.post(reverse('table'), {'amount': '1'}).status_code, 302)
+
+    def test_get_not_throttled(self):
+        for _ in range(3):
+            self.assertEquals(self.client.get(reverse('table')).status_code, 200)
+
+    def test_bank_not_throttled(self):
+        for _ in range(3):
+            response = self.client.post(reverse('bank'), {'amount': '1', 'direction': 'D'})
+            self.assertEquals(response.status_code, 302)
+
+    def test_anonymous_by_address(self):
+        self.client.logout()
+        data = {'username': 'player', 'password': 'wrong'}
+        self.assertEquals(self.client.post(reverse('accounts-login'), data, REMOTE_ADDR='10.0.0.1').status_code, 200)
+        self.assertEquals(self.client.post(reverse('accounts-login'), data, REMOTE_ADDR='10.0.0.1').status_code, 429)
+        self.assertEquals(self.client.post(reverse('accounts-login'), data, REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_disabled(self):
+        with self.settings(THROTTLE_ENABLED=False):
+            for _ in range(3):
+                self.assertEquals(self.client.post(reverse('table'), {'amount': '1'}).status_code, 302)
+        statuses = [self.client.post(reverse('table'), {'amount': '1'}).status_code for _ in range(3)]
+        self.assertEquals(statuses, [302, 302, 429])
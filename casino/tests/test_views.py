@@ -0,0 +1,215 @@
+import json
+from decimal import Decimal
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from nose_parameterized import parameterized
+
+from .. import models, services
+
+
+@override_settings(THROTTLE_ENABLED=False)
+class BetApiViewCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get())
+
+    def _post(self, data, **extra):
+        return self.client.post(reverse('api-bet'), json.dumps(data), content_type='application/json', **extra)
+
+    def test_bet(self):
+        with patch.object(services.SimpleGame, 'game_logic', return_value=(Decimal('-2.00'), 'You lose')):
+            response = self._post({'amount': '2.00'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json(), {'change': '-2.00', 'status': 'You lose'})
+        self.assertEquals(models.Wallet.objects.get(pk=1).amount, Decimal('13.00'))  # bonus wallet 4 was waged
+
+    @parameterized.expand([
+        ({'amount': '0'},),
+        ({},),
+        (['1'],),
+    ])
+    def test_bet_invalid(self, data):
+        response = self._post(data)
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('errors', response.json())
+
+    def test_bet_idempotency_key(self):
+        with patch.object(services.SimpleGame, 'game_logic', side_effect=[(Decimal('-2.00'), 'You lose'),
+                                                                         (Decimal('2.00'), 'You won')]):
+            responses = [
+                self.client.post(reverse('api-bet'), json.dumps({'amount': '2.00'}), content_type='application/json',
+                                 HTTP_IDEMPOTENCY_KEY='retried')
+                for _ in range(2)
+            ]
+        self.assertEquals([r.json() for r in responses], [{'change': '-2.00', 'status': 'You lose'}] * 2)
+        self.assertEquals(models.Wallet.objects.get(pk=1).amount, Decimal('13.00'))
+
+    def test_bet_idempotency_key_reused(self):
+        self.assertEquals(self._post({'amount': '2.00'}, HTTP_IDEMPOTENCY_KEY='reused').status_code, 200)
+        response = self._post({'amount': '3.00'}, HTTP_IDEMPOTENCY_KEY='reused')
+        self.assertEquals(response.status_code, 422)
+        self.assertIn('idempotency_key', response.json()['errors'])
+        self.assertEquals(models.LedgerEntry.objects.filter(kind=models.LedgerEntry.BET).count(), 1)
+
+    def test_bet_anonymous(self):
+        self.client.logout()
+        self.assertEquals(self._post({'amount': '1'}).status_code, 403)
+
+
+@override_settings(THROTTLE_ENABLED=False)
+class BetManyApiViewCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get())
+
+    def _post(self, data, **extra):
+        return self.client.post(reverse('api-bet-many'), json.dumps(data), content_type='application/json', **extra)
+
+    def test_bet_many(self):
+        with patch.object(services.SimpleGame, 'game_logic', side_effect=[(Decimal('-2.00'), 'You lose'),
+                                                                         (Decimal('1.00'), 'You won')]):
+            response = self._post({'amounts': ['2.00', '1.00', '100.00']})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json(), {'results': [{'change': '-2.00', 'status': 'You lose'},
+                                                        {'change': '1.00', 'status': 'You won'},
+                                                        {'change': 0, 'status': 'Not enough money'}]})
+        self.assertEquals(models.Wallet.objects.get(pk=1).amount, Decimal('14.00'))
+
+    @parameterized.expand([
+        ({'amounts': []},),
+        ({'amounts': '1.00'},),
+        ({'amounts': ['1.00', '0']},),
+        ({'amount': '1.00'},),
+    ])
+    def test_bet_many_invalid(self, data):
+        response = self._post(data)
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('amounts', response.json()['errors'])
+
+    @override_settings(BET_MANY_MAX=2)
+    def test_bet_many_limit(self):
+        self.assertEquals(self._post({'amounts': ['1.00'] * 3}).status_code, 400)
+
+    def test_bet_many_idempotency_key(self):
+        responses = [self._post({'amounts': ['1.00'] * 5}, HTTP_IDEMPOTENCY_KEY='retried') for _ in range(2)]
+        self.assertEquals(responses[0].json(), responses[1].json())
+        self.assertEquals(models.LedgerEntry.objects.filter(kind=models.LedgerEntry.BET).count(), 5)
+
+
+@override_settings(THROTTLE_ENABLED=False)
+class TableViewCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get())
+        models.Customer.objects.refresh_summary(models.Customer.objects.get())
+        caches['template_fragments'].clear()
+
+    def _count_get_queries(self, depleted_wallets):
+        customer = models.Customer.objects.get()
+        models.Wallet.objects.bulk_create(
+            models.Wallet(customer=customer, amount=0, currency=models.Wallet.BONUS, wagering_requirement=1,
+                          depleted=True)
+            for _ in range(depleted_wallets)
+        )
+        caches['template_fragments'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('table'))
+        self.assertEquals(response.status_code, 200)
+        return len(queries)
+
+    def test_get(self):
+        response = self.client.get(reverse('table'))
+        self.assertContains(response, 'Balance: <strong>5.00 EUR</strong>')
+        self.assertContains(response, 'bonus: 25.00 in 2 wallets')
+        self.assertEquals(len(response.context['wallets'].rows), 3)
+
+    def test_get_depleted(self):
+        response = self.client.get(reverse('table'), {'depleted': '1'})
+        self.assertEquals(len(response.context['wallets'].rows), 4)
+
+    def test_get_queries_constant(self):
+        self.assertEquals(self._count_get_queries(1), self._count_get_queries(100))
+
+    def _get_wallet_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('table'))
+        return response.content.decode('utf-8').count('<tr'), len(queries)
+
+    def test_get_cached(self):
+        rows, queries = self._get_wallet_rows()
+        self.assertEquals(self._get_wallet_rows(), (rows, queries - 3))
+
+        services.WalletService(User.objects.get()).deposit(Decimal('1.00'))
+        response = self.client.get(reverse('table'))
+        self.assertContains(response, '<td class="amount">6.00</td>', html=True)
+
+    def test_bets_without_following_redirects(self):
+        models.Wallet.objects.filter(pk=1).update(amount=1000)
+        for _ in range(60):
+            self.assertEquals(self.client.post(reverse('table'), {'amount': '1'}).status_code, 302)
+        self.assertEquals(len(list(self.client.get(reverse('table')).context['messages'])), 60)
+
+    def test_wallet_saved_bumps_version(self):
+        version = models.Customer.objects.get().wallet_version
+        wallet = models.Wallet.objects.get(pk=3)
+        wallet.save()
+        wallet.delete()
+        self.assertEquals(models.Customer.objects.get().wallet_version, version + 2)
+
+
+@override_settings(THROTTLE_ENABLED=False)
+class BankViewCase(TestCase):
+    fixtures = ['user.yaml', 'customer.yaml', 'wallets.yaml']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get())
+
+    def test_deposit_resubmitted(self):
+        key = self.client.get(reverse('bank')).context['form']['idempotency_key'].value()
+        for _ in range(2):
+            response = self.client.post(reverse('bank'), {'amount': '3', 'direction': 'D', 'idempotency_key': key})
+            self.assertRedirects(response, reverse('bank'), fetch_redirect_response=False)
+        self.assertEquals(models.Wallet.objects.get(pk=1).amount, Decimal('8.00'))
+        self.assertNotEquals(self.client.get(reverse('bank')).context['form']['idempotency_key'].value(), key)
+
+    def test_withdraw_with_deposit_key(self):
+        key = self.client.get(reverse('bank')).context['form']['idempotency_key'].value()
+        self.client.post(reverse('bank'), {'amount': '3', 'direction': 'D', 'idempotency_key': key})
+        response = self.client.post(reverse('bank'), {'amount': '3', 'direction': 'W', 'idempotency_key': key})
+        self.assertRedirects(response, reverse('bank'), fetch_redirect_response=False)
+        self.assertEquals(models.Wallet.objects.get(pk=1).amount, Decimal('5.00'))
+
+    def test_deposit_key_reused(self):
+        key = self.client.get(reverse('bank')).context['form']['idempotency_key'].value()
+        self.client.post(reverse('bank'), {'amount': '3', 'direction': 'D', 'idempotency_key': key})
+        response = self.client.post(reverse('bank'), {'amount': '4', 'direction': 'D', 'idempotency_key': key})
+        self.assertEquals(response.status_code, 422)
+        self.assertTrue(response.context['form'].non_field_errors())
+        self.assertEquals(models.Wallet.objects.get(pk=1).amount, Decimal('8.00'))
+
+        new_key = response.context['form']['idempotency_key'].value()
+        self.assertNotEquals(new_key, key)
+        self.assertContains(response, new_key, status_code=422)
+        response = self.client.post(reverse('bank'), {'amount': '4', 'direction': 'D', 'idempotency_key': new_key})
+        self.assertRedirects(response, reverse('bank'), fetch_redirect_response=False)
+        self.assertEquals(models.Wallet.objects.get(pk=1).amount, Decimal('12.00'))
+
+
+class HealthViewCase(TestCase):
+    def test_health(self):
+        response = self.client.get(reverse('health'))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json(), {'status': 'ok'})
+
+    def test_health_database_unavailable(self):
+        with patch.object(connection, 'cursor', side_effect=DatabaseError):
+            response = self.client.get(reverse('health'))
+        self.assertEquals(response.status_code, 503)
@@ -0,0 +1,122 @@
+"""Token bucket throttling of POST requests per endpoint, see THROTTLE_RATES setting
+
+Buckets are kept in throttle cache under key of endpoint and user, or client IP address for anonymous requests.
+Every request takes one token, batch bet request one token per bet (see COSTS), tokens refill at rate per second up
+to burst. Default local memory cache keeps buckets in every worker process, so rate is divided by THROTTLE_WORKERS
+and client gets its rate summed over all workers. Burst is not divided, so batch up to burst is still accepted by one
+worker. Shared cache with atomic add, e.g. memcached, keeps one bucket per client, updated under lock key added to it.
+"""
+import contextlib
+import json
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+# Throttled view names and their endpoints
+ENDPOINTS = {
+    'table': 'bet',
+    'api-bet': 'bet',
+    'api-bet-many': 'bet-many',
+    'bank': 'bank',
+    'accounts-login': 'login',
+    'accounts-register': 'register',
+}
+
+
+def bet_many_cost(request):
+    """Number of bets in batch, malformed body takes one token and is rejected by view"""
+    try:
+        amounts = json.loads(request.body.decode('utf-8')).get('amounts')
+    except (ValueError, AttributeError):
+        return 1
+    if not isinstance(amounts, list):
+        return 1
+    # Batch over BET_MANY_MAX is rejected by view rather than waiting for tokens it can never get
+    return max(1, min(len(amounts), settings.BET_MANY_MAX))
+
+
+# Tokens taken by request of view name, one when missing
+COSTS = {
+    'api-bet-many': bet_many_cost,
+}
+
+
+class TokenBucket(object):
+    # Seconds lock key of crashed process blocks bucket
+    LOCK_TIMEOUT = 1
+
+    def __init__(self, rate, burst, cache=None):
+        self.rate = rate
+        self.burst = burst
+        self.cache = cache or caches[settings.THROTTLE_CACHE]
+        # Full bucket is the same as missing one, so entries can expire
+        self.timeout = math.ceil(burst / rate) + 1
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def locked(self, key):
+        """Hold key against other threads, and other processes when cache is shared"""
+        with self._lock:
+            if isinstance(self.cache, LocMemCache):
+                yield
+                return
+            lock_key = key + ':lock'
+            while not self.cache.add(lock_key, 1, self.LOCK_TIMEOUT):
+                time.sleep(0.001)
+            try:
+                yield
+            finally:
+                self.cache.delete(lock_key)
+
+    def consume(self, key, cost=1, now=None):
+        """Take cost tokens of key, returns 0 when allowed or seconds until enough tokens are available"""
+        with self.locked(key):
+            now = time.time() if now is None else now
+            tokens, updated = self.cache.get(key) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < cost:
+                return (cost - tokens) / self.rate
+            self.cache.set(key, (tokens - cost, now), self.timeout)
+        return 0
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(endpoint):
+    """Return bucket of endpoint configured in THROTTLE_RATES, or None when endpoint is not throttled
+
+    Bucket in local memory cache gets share of rate of this worker.
+    """
+    rates = settings.THROTTLE_RATES.get(endpoint)
+    if rates is None:
+        return None
+    cache = caches[settings.THROTTLE_CACHE]
+    workers = settings.THROTTLE_WORKERS if isinstance(cache, LocMemCache) else 1
+    with _buckets_lock:
+        configured, bucket = _buckets.get(endpoint, (None, None))
+        if configured != (rates, workers):
+            rate, burst = rates
+            bucket = TokenBucket(rate / workers, burst, cache)
+            _buckets[endpoint] = ((rates, workers), bucket)
+    return bucket
+
+
+def client_key(request):
+    if request.user.is_authenticated:
+        return 'user:{}'.format(request.user.pk)
+    return 'ip:{}'.format(request.META.get('REMOTE_ADDR', ''))
+
+
+def throttle(request, view_name):
+    """Return seconds the request has to wait, 0 when it is allowed"""
+    endpoint = ENDPOINTS.get(view_name)
+    bucket = endpoint and get_bucket(endpoint)
+    if bucket is None:
+        return 0
+    cost = COSTS[view_name](request) if view_name in COSTS else 1
+    return bucket.consume('throttle:{}:{}'.format(endpoint, client_key(request)), cost)
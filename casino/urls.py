@@ -4,4 +4,8 @@ from . import views
 urlpatterns = [
     url(r'^$', views.TableView.as_view(), name='table'),
     url(r'^bank/$', views.BankView.as_view(), name='bank'),
+    url(r'^api/bet/$', views.BetApiView.as_view(), name='api-bet'),
+    url(r'^api/bet/many/$', views.BetManyApiView.as_view(), name='api-bet-many'),
+    url(r'^health/$', views.HealthView.as_view(), name='health'),
+    url(r'^metrics/$', views.MetricsView.as_view(), name='metrics'),
 ]
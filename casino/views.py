@@ -1,26 +1,55 @@
+import json
+import uuid
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import DatabaseError, connection
+from django.http import HttpResponse, JsonResponse
 from django.urls import reverse_lazy
+from django.utils.functional import SimpleLazyObject
+from django.views.generic import View
 from django.views.generic.edit import FormView
-from .forms import BetForm, TransactionForm
-from .services import WalletService, SimpleGame
+from . import metrics
+from .forms import BetForm, BetManyForm, TransactionForm
+from .models import IdempotencyKeyReused
+from .services import SimpleGame
 from .tables import WalletTable
 
 
+IDEMPOTENCY_KEY_REUSED = "Idempotency key was already used for request with different data"
+
+
 class WalletContextMixin:
     @property
     def wallet_service(self):
-        try:
-            return getattr(self, '_wallet_service')
-        except AttributeError:
-            self._wallet_service = WalletService(self.request.user)
-            return self._wallet_service
+        return self.request.wallet_service
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['request'] = self.request
+        return kwargs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['wallets'] = WalletTable.prepare(self.request, self.wallet_service)
+        context['customer'] = self.wallet_service.customer
+        # Table is built only when cached fragment of current wallet version is missing
+        context['wallets'] = SimpleLazyObject(lambda: WalletTable.prepare(self.request, self.wallet_service))
+        context['wallets_cache_timeout'] = settings.WALLET_TABLE_CACHE_TIMEOUT
         return context
 
+    def idempotency_key_reused(self, form):
+        """Form submitted with key of other submission is rejected instead of showing result of that one
+
+        Form is rendered again with new key, so changed submission from it is processed.
+        """
+        data = form.data.copy()
+        data['idempotency_key'] = uuid.uuid4().hex
+        form = self.get_form_class()(data, request=self.request)
+        form.add_error(None, IDEMPOTENCY_KEY_REUSED)
+        response = self.form_invalid(form)
+        response.status_code = 422
+        return response
+
 
 class TableView(LoginRequiredMixin, WalletContextMixin, FormView):
     template_name = 'casino/table.html'
@@ -28,8 +57,11 @@ class TableView(LoginRequiredMixin, WalletContextMixin, FormView):
     form_class = BetForm
 
     def form_valid(self, form):
-        game = SimpleGame(self.request.user)
-        change, status = game.bet(form.cleaned_data['amount'])
+        game = SimpleGame(self.request.user, customer=self.wallet_service.customer)
+        try:
+            change, status = game.bet(form.cleaned_data['amount'], idempotency_key=form.get_idempotency_key())
+        except IdempotencyKeyReused:
+            return self.idempotency_key_reused(form)
         messages.add_message(self.request, messages.SUCCESS if change > 0 else messages.ERROR, status)
         return super().form_valid(form)
 
@@ -42,13 +74,70 @@ class BankView(LoginRequiredMixin, WalletContextMixin, FormView):
     def form_valid(self, form):
         direction = form.cleaned_data['direction']
         amount = form.cleaned_data['amount']
-        if direction == TransactionForm.WITHDRAW:
-            if self.wallet_service.withdraw(amount):
-                messages.add_message(self.request, messages.SUCCESS, "Withdrawn {} EUR from wallet".format(amount))
-            else:
-                messages.add_message(self.request, messages.ERROR, "You don't have {} EUR".format(amount))
-        elif direction == TransactionForm.DEPOSIT:
-            self.wallet_service.deposit(amount)
-            messages.add_message(self.request, messages.SUCCESS, "Deposited {} EUR on wallet".format(amount))
+        try:
+            if direction == TransactionForm.WITHDRAW:
+                if self.wallet_service.withdraw(amount, idempotency_key=form.get_idempotency_key()):
+                    messages.add_message(self.request, messages.SUCCESS, "Withdrawn {} EUR from wallet".format(amount))
+                else:
+                    messages.add_message(self.request, messages.ERROR, "You don't have {} EUR".format(amount))
+            elif direction == TransactionForm.DEPOSIT:
+                self.wallet_service.deposit(amount, idempotency_key=form.get_idempotency_key())
+                messages.add_message(self.request, messages.SUCCESS, "Deposited {} EUR on wallet".format(amount))
+        except IdempotencyKeyReused:
+            return self.idempotency_key_reused(form)
 
         return super().form_valid(form)
+
+
+class BetApiView(LoginRequiredMixin, View):
+    """Placing a bet with JSON request, e.g. {"amount": "5.00"}, retried with the same Idempotency-Key header"""
+    raise_exception = True
+    form_class = BetForm
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({'errors': {'__all__': ['Expected JSON object']}}, status=400)
+
+        form = self.form_class(data, request=request)
+        if not form.is_valid():
+            return JsonResponse({'errors': {field: list(errors) for field, errors in form.errors.items()}}, status=400)
+        try:
+            return self.play(request, form)
+        except IdempotencyKeyReused:
+            return JsonResponse({'errors': {'idempotency_key': [IDEMPOTENCY_KEY_REUSED]}}, status=422)
+
+    def play(self, request, form):
+        game = SimpleGame(request.user, customer=request.wallet_service.customer)
+        change, status = game.bet(form.cleaned_data['amount'], idempotency_key=form.get_idempotency_key())
+        return JsonResponse({'change': change, 'status': status})
+
+
+class BetManyApiView(BetApiView):
+    """Placing many bets in one transaction, e.g. {"amounts": ["5.00", "5.00"]}, results are in order of amounts"""
+    form_class = BetManyForm
+
+    def play(self, request, form):
+        game = SimpleGame(request.user, customer=request.wallet_service.customer)
+        results = game.bet_many(form.cleaned_data['amounts'], idempotency_key=form.get_idempotency_key())
+        return JsonResponse({'results': [{'change': change, 'status': status} for change, status in results]})
+
+
+class HealthView(View):
+    """Readiness check for load balancer, answers 503 when database is not reachable"""
+    def get(self, request):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            return JsonResponse({'status': 'database unavailable'}, status=503)
+        return JsonResponse({'status': 'ok'})
+
+
+class MetricsView(View):
+    """Query count, database time and latency histograms of this process in Prometheus text format"""
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,11 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite backend taking write lock when transaction starts
+
+    Deferred transaction that reads and then writes fails with "database is locked" when other connection wrote
+    meanwhile, busy timeout does not apply to it. Immediate transaction waits for the lock with busy timeout instead.
+    """
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
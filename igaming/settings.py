@@ -43,24 +43,31 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'casino.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'casino.middleware.CachedAuthenticationMiddleware',
+    'casino.middleware.ThrottleMiddleware',
+    'casino.middleware.WalletServiceMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'igaming.urls'
 
+template_loaders = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, 'templates'),
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -68,19 +75,161 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compiled templates are kept in memory unless debugging, see igaming.warmup
+            'loaders': template_loaders if DEBUG else [('django.template.loaders.cached.Loader', template_loaders)],
         },
     },
 ]
 
 WSGI_APPLICATION = 'igaming.wsgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db', 'db.sqlite3'),
+# Database is selected with DB_ENGINE: sqlite3 (default) or postgresql
+DB_ENGINE = get_env_variable('DB_ENGINE', 'sqlite3')
+# Seconds connection is kept open by worker thread between requests, 0 closes it after every request
+DB_CONN_MAX_AGE = int(get_env_variable('DB_CONN_MAX_AGE', '60'))
+# Set when connecting through PgBouncer in transaction pooling mode, pool owns server connections then
+DB_POOLED = strtobool(get_env_variable('DB_POOLED', 'False'))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': get_env_variable('DB_NAME', 'igaming'),
+            'USER': get_env_variable('DB_USER', ''),
+            'PASSWORD': get_env_variable('DB_PASSWORD', ''),
+            'HOST': get_env_variable('DB_HOST', ''),
+            'PORT': get_env_variable('DB_PORT', ''),
+            # Connections to pool are cheap to keep, so they are never closed
+            'CONN_MAX_AGE': None if DB_POOLED else DB_CONN_MAX_AGE,
+        }
     }
+elif DB_ENGINE == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'igaming.backends.sqlite3',
+            'NAME': get_env_variable('DB_NAME', os.path.join(BASE_DIR, 'db', 'db.sqlite3')),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        }
+    }
+else:
+    raise ImproperlyConfigured('Unsupported DB_ENGINE {}, use sqlite3 or postgresql'.format(DB_ENGINE))
+
+# Applied to every SQLite connection by casino.signal_handlers.on_connection_created, WAL lets readers run along
+# single writer and busy_timeout makes writers wait for lock instead of failing
+SQLITE_PRAGMAS = {
+    'journal_mode': get_env_variable('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': get_env_variable('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(get_env_variable('SQLITE_BUSY_TIMEOUT', '5000')),
+    'mmap_size': int(get_env_variable('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
 }
 
+# Cache must be shared by all server processes, it holds e.g. bonus rules version
+CACHES = {
+    'default': {
+        'BACKEND': get_env_variable('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': get_env_variable('CACHE_LOCATION', os.path.join(BASE_DIR, 'db', 'cache')),
+    },
+    # Rendered fragments keyed by versions stored in database, so per-process cache is never stale
+    'template_fragments': {
+        'BACKEND': get_env_variable('FRAGMENT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': get_env_variable('FRAGMENT_CACHE_LOCATION', 'template_fragments'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Token buckets of throttled clients, local memory keeps buckets of every worker process, memcached shares them
+    'throttle': {
+        'BACKEND': get_env_variable('THROTTLE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': get_env_variable('THROTTLE_CACHE_LOCATION', 'throttle'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# POST requests of bet, bank, login and register endpoints per user (or IP address of anonymous client) are limited
+# by token buckets of (requests per second, burst), exceeding requests are answered with 429. Batch bet API has its
+# own bucket counted in bets rather than requests, its burst is the largest batch accepted from rested client
+THROTTLE_ENABLED = strtobool(get_env_variable('THROTTLE_ENABLED', 'True'))
+THROTTLE_CACHE = 'throttle'
+# Worker processes of the host (uwsgi.ini starts one per core), rates of buckets kept in local memory are divided by it
+THROTTLE_WORKERS = int(get_env_variable('THROTTLE_WORKERS', get_env_variable('UWSGI_PROCESSES', str(os.cpu_count()))))
+THROTTLE_RATES = {
+    'bet': (float(get_env_variable('THROTTLE_BET_RATE', '5')), int(get_env_variable('THROTTLE_BET_BURST', '20'))),
+    'bet-many': (float(get_env_variable('THROTTLE_BET_MANY_RATE', '50')),
+                 int(get_env_variable('THROTTLE_BET_MANY_BURST', '1000'))),
+    'bank': (float(get_env_variable('THROTTLE_BANK_RATE', '1')), int(get_env_variable('THROTTLE_BANK_BURST', '10'))),
+    'login': (float(get_env_variable('THROTTLE_LOGIN_RATE', '0.2')),
+              int(get_env_variable('THROTTLE_LOGIN_BURST', '10'))),
+    'register': (float(get_env_variable('THROTTLE_REGISTER_RATE', '0.05')),
+                 int(get_env_variable('THROTTLE_REGISTER_BURST', '5'))),
+}
+
+# Session storage: db, cached_db (database behind default cache), cache (default cache only, it has to be shared by
+# all workers) or signed_cookies (session data in signed cookie, no server side storage)
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_MODE = get_env_variable('SESSION_MODE', 'db')
+if SESSION_MODE not in SESSION_ENGINES:
+    raise ImproperlyConfigured('SESSION_MODE must be one of {}'.format(', '.join(sorted(SESSION_ENGINES))))
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+
+# Messages are kept in cookie and touch session only when they do not fit, e.g. for client not following redirects
+MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
+
+# Seconds authenticated users are kept in per-process cache, 0 loads user from database on every request.
+# Password change or deactivation done in other process takes effect after timeout, see casino.auth
+AUTH_USER_CACHE_TIMEOUT = int(get_env_variable('AUTH_USER_CACHE_TIMEOUT', '0'))
+
+# Seconds rendered wallet table of customer wallet version is kept in template_fragments cache
+WALLET_TABLE_CACHE_TIMEOUT = int(get_env_variable('WALLET_TABLE_CACHE_TIMEOUT', '600'))
+
+# Age in days of depleted wallets moved to archive by compact_wallets command
+WALLET_ARCHIVE_DAYS = int(get_env_variable('WALLET_ARCHIVE_DAYS', '90'))
+
+# Seconds result of operation is returned for retried request with the same idempotency key
+IDEMPOTENCY_KEY_TTL = int(get_env_variable('IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+
+# Maximal number of bets in single request to batch bet API
+BET_MANY_MAX = int(get_env_variable('BET_MANY_MAX', '1000'))
+
+# Bonuses for login and deposit are recorded in outbox and applied by run_bonus_worker command instead of in request
+BONUS_OUTBOX = strtobool(get_env_variable('BONUS_OUTBOX', 'False'))
+BONUS_EVENT_MAX_ATTEMPTS = int(get_env_variable('BONUS_EVENT_MAX_ATTEMPTS', '5'))
+# Days processed events are kept before bonus worker deletes them
+BONUS_EVENT_RETENTION_DAYS = int(get_env_variable('BONUS_EVENT_RETENTION_DAYS', '7'))
+
+# Query count, database time and latency histograms of views and services, exposed on /metrics/
+METRICS_ENABLED = strtobool(get_env_variable('METRICS_ENABLED', 'True'))
+# Aliases of DATABASES whose connections count queries, connections to other databases are left unpatched
+METRICS_DATABASES = get_env_variable('METRICS_DATABASES', 'default').split()
+# File every observation is logged to, rotated at 10 MiB
+METRICS_LOG = get_env_variable('METRICS_LOG', '')
+if METRICS_LOG:
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'metrics': {'format': '%(asctime)s %(process)d %(message)s'},
+        },
+        'handlers': {
+            'metrics': {
+                'class': 'logging.handlers.RotatingFileHandler',
+                'filename': METRICS_LOG,
+                'maxBytes': 10 * 1024 * 1024,
+                'backupCount': 5,
+                'formatter': 'metrics',
+            },
+        },
+        'loggers': {
+            'casino.metrics': {'handlers': ['metrics'], 'level': 'INFO', 'propagate': False},
+        },
+    }
+
+# Random number generator for games: system, stdlib or seeded (reproducible, for replays only), see casino.rng
+GAME_RNG = get_env_variable('GAME_RNG', 'system')
+GAME_RNG_SEED = int(get_env_variable('GAME_RNG_SEED', '0'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
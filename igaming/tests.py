@@ -0,0 +1,19 @@
+from unittest.mock import patch
+from django.template import engines
+from django.test import SimpleTestCase
+
+from . import warmup
+
+
+class WarmUpCase(SimpleTestCase):
+    def test_template_names(self):
+        names = warmup.template_names(engines['django'].engine.dirs)
+        self.assertIn('casino/table.html', names)
+        self.assertIn('base.html', names)
+
+    def test_warm_up(self):
+        with patch.object(engines['django'].engine, 'get_template') as get_template:
+            count = warmup.warm_up()
+        self.assertEquals(get_template.call_count, count)
+        get_template.assert_any_call('casino/base.html')
+        get_template.assert_any_call('django_tables2/table.html')
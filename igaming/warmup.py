@@ -0,0 +1,46 @@
+"""Loading of lazily initialized parts of Django before the first request
+
+Called by igaming.wsgi in uWSGI master, so workers forked from it share loaded code and compiled templates
+copy-on-write instead of loading them on their first request.
+"""
+import os
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.template.utils import get_app_template_dirs
+from django.urls import get_resolver
+
+TEMPLATE_EXTENSIONS = ('.html', '.txt')
+
+
+def template_names(dirs):
+    """Names of templates found in template directories"""
+    names = set()
+    for directory in dirs:
+        for root, _, files in os.walk(directory):
+            names.update(
+                os.path.relpath(os.path.join(root, file), directory) for file in files
+                if file.endswith(TEMPLATE_EXTENSIONS)
+            )
+    return sorted(names)
+
+
+def populate_resolver(resolver):
+    """Build reverse lookups of resolver and resolvers of its includes"""
+    resolver.reverse_dict
+    for pattern in resolver.url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            populate_resolver(pattern)
+
+
+def warm_up():
+    """Import URL conf with views and compile all templates, returns number of compiled templates"""
+    # Resolvers are cached by urlconf argument, requests use ROOT_URLCONF set by handler
+    populate_resolver(get_resolver(settings.ROOT_URLCONF))
+    engine = engines['django'].engine
+    names = template_names(list(engine.dirs) + list(get_app_template_dirs('templates')))
+    for name in names:
+        engine.get_template(name)
+    # Connections must not be inherited by forked workers
+    connections.close_all()
+    return len(names)
@@ -5,3 +5,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "igaming.settings")
 
 application = get_wsgi_application()
+
+from .warmup import warm_up  # noqa: E402 settings must be configured first
+warm_up()